@@ -1,7 +1,13 @@
 # admin.py
 import streamlit as st
+from pymongo.errors import DuplicateKeyError
 from mongodb_utils import get_db_collection
+from user_store import ensure_user_indexes, fetch_users_page, invalidate_user_allergies
+import auth_service
+from stats import stats_service
+from feedback import get_feedback_analytics
 from datetime import datetime
+import io
 from bson.objectid import ObjectId
 
 def admin_dashboard():
@@ -11,6 +17,19 @@ def admin_dashboard():
     if "admin_username" not in st.session_state:
         st.session_state.admin_username = ""
 
+    # The signed token is verified locally on every rerun (no database query while the profile is cached)
+    try:
+        session = auth_service.current_session(st.session_state.get("admin_token"), role="admin")
+    except Exception as e:
+        # Profile lookup failed (database down); keep the token so the next rerun can retry
+        st.error(f"❌ Database connection error: {e}")
+        session = None
+    if session is None:
+        st.session_state.admin_logged_in = False
+        st.session_state.admin_username = ""
+    else:
+        st.session_state.admin_username = session[0]["sub"]
+
     # Show login form if not logged in
     if not st.session_state.admin_logged_in:
         render_admin_login()
@@ -29,7 +48,9 @@ def render_admin_login():
         login_button = st.form_submit_button("🚀 Login", use_container_width=True)
         
         if login_button:
-            if authenticate_admin(username, password):
+            token = authenticate_admin(username, password)
+            if token:
+                st.session_state.admin_token = token
                 st.session_state.admin_logged_in = True
                 st.session_state.admin_username = username
                 st.success("✅ Login successful! Redirecting...")
@@ -38,20 +59,12 @@ def render_admin_login():
                 st.error("❌ Invalid username or password")
 
 def authenticate_admin(username, password):
-    """Authenticate admin against MongoDB"""
+    """Authenticate admin against the salted password hash; returns a session token or None"""
     try:
-        # Connect to MongoDB admin collection
-        from pymongo import MongoClient
-        client = MongoClient("mongodb+srv://url")
-        db = client["drug_recommender_db"]
-        admins_col = db["admins"]
-        
-        # Check if admin exists
-        admin = admins_col.find_one({"username": username, "password": password})
-        return admin is not None
+        return auth_service.authenticate_admin(username, password)
     except Exception as e:
         st.error(f"Database connection error: {e}")
-        return False
+        return None
 
 def render_admin_panel():
     # Header with logout option
@@ -63,6 +76,7 @@ def render_admin_panel():
         if st.button("🚪 Logout", use_container_width=True):
             st.session_state.admin_logged_in = False
             st.session_state.admin_username = ""
+            st.session_state.pop("admin_token", None)
             st.rerun()
     
     st.markdown("---")
@@ -70,6 +84,7 @@ def render_admin_panel():
     # Connect to MongoDB
     try:
         users_col = get_db_collection()
+        ensure_user_indexes(users_col)
         
         # Admin Stats
         st.subheader("📊 Dashboard Overview")
@@ -77,7 +92,7 @@ def render_admin_panel():
         col1, col2, col3, col4 = st.columns(4)
         
         with col1:
-            total_users = users_col.count_documents({})
+            total_users = stats_service.get("users")
             st.metric("Total Users", total_users)
         
         with col2:
@@ -92,6 +107,11 @@ def render_admin_panel():
         
         st.markdown("---")
         
+        # Feedback analytics (served from running aggregates, no log scan)
+        render_feedback_analytics()
+        
+        st.markdown("---")
+        
         # User Management Section
         st.subheader("👥 User Management")
         
@@ -114,26 +134,30 @@ def render_admin_panel():
                 
                 if add_button:
                     if new_name and new_email and new_password:
-                        # Check if email already exists
-                        existing_user = users_col.find_one({"email": new_email})
-                        if existing_user:
-                            st.error("❌ User with this email already exists!")
-                        else:
-                            # Insert new user
+                        # The unique email index rejects duplicates (no separate lookup)
+                        try:
                             users_col.insert_one({
                                 "full_name": new_name,
                                 "email": new_email,
-                                "password": new_password,
+                                "password": auth_service.hash_password(new_password),
                                 "age": new_age,
                                 "allergies": new_allergies,
                                 "created_at": datetime.now(),
                                 "is_active": True
                             })
+                        except DuplicateKeyError:
+                            st.error("❌ User with this email already exists!")
+                        else:
+                            stats_service.increment("users")
                             st.success(f"✅ User {new_name} added successfully!")
                             st.rerun()
                     else:
                         st.error("❌ Please fill in all required fields (Name, Email, Password)")
         
+        # Bulk import / export (streamed, chunked upserts on the unique email index)
+        with st.expander("📦 Bulk Import / Export", expanded=False):
+            render_bulk_user_transfer(users_col)
+        
         st.markdown("---")
         
         # Display Existing Users
@@ -146,27 +170,21 @@ def render_admin_panel():
         with col2:
             items_per_page = st.selectbox("Users per page", [5, 10, 20, 50], index=1)
         
-        # Fetch users with optional search
-        query = {}
-        if search_term:
-            query = {
-                "$or": [
-                    {"full_name": {"$regex": search_term, "$options": "i"}},
-                    {"email": {"$regex": search_term, "$options": "i"}}
-                ]
-            }
+        # Keyset pagination state: cursors[i] is the _id after which page i+1 starts
+        list_key = (search_term, items_per_page)
+        if st.session_state.get("user_list_key") != list_key:
+            st.session_state.user_list_key = list_key
+            st.session_state.user_page_cursors = [None]
+        cursors = st.session_state.user_page_cursors
+        page_number = len(cursors)
         
-        users = list(users_col.find(query))
+        # Fetch only the current page (projected fields, indexed search)
+        users_to_display, next_after_id = fetch_users_page(
+            users_col, search_term, page_size=items_per_page, after_id=cursors[-1]
+        )
         
-        if users:
-            # Pagination
-            total_users = len(users)
-            page_number = st.number_input("Page", min_value=1, value=1, step=1)
-            start_idx = (page_number - 1) * items_per_page
-            end_idx = start_idx + items_per_page
-            users_to_display = users[start_idx:end_idx]
-            
-            st.write(f"Showing {len(users_to_display)} of {total_users} users")
+        if users_to_display:
+            st.write(f"Showing {len(users_to_display)} users (page {page_number})")
             
             for user in users_to_display:
                 with st.container():
@@ -188,24 +206,28 @@ def render_admin_panel():
                     
                     with col3:
                         if st.button(f"🗑️ Delete", key=f"delete_{user.get('_id')}"):
-                            users_col.delete_one({"_id": user.get('_id')})
+                            if users_col.delete_one({"_id": user.get('_id')}).deleted_count:
+                                stats_service.increment("users", -1)
+                                invalidate_user_allergies(user.get('email'))
+                                auth_service.invalidate_profile("user", user.get('email'))
                             st.success(f"✅ User {user.get('full_name')} deleted successfully")
                             st.rerun()
                     
                     st.markdown("---")
             
             # Pagination controls
-            total_pages = (total_users + items_per_page - 1) // items_per_page
-            if total_pages > 1:
+            if page_number > 1 or next_after_id is not None:
                 col1, col2, col3 = st.columns([1, 2, 1])
                 with col2:
-                    st.write(f"Page {page_number} of {total_pages}")
+                    st.write(f"Page {page_number}")
                     prev_col, next_col = st.columns(2)
                     with prev_col:
                         if page_number > 1 and st.button("⬅️ Previous"):
+                            cursors.pop()
                             st.rerun()
                     with next_col:
-                        if page_number < total_pages and st.button("Next ➡️"):
+                        if next_after_id is not None and st.button("Next ➡️"):
+                            cursors.append(next_after_id)
                             st.rerun()
         
         else:
@@ -215,6 +237,79 @@ def render_admin_panel():
         st.error(f"❌ Database connection error: {e}")
         st.info("ℹ️ Please check your MongoDB connection and try again.")
 
+def render_feedback_analytics():
+    st.subheader("📈 Feedback Analytics")
+    analytics = get_feedback_analytics()
+    totals = analytics.totals()
+    
+    col1, col2, col3 = st.columns(3)
+    with col1:
+        st.metric("Feedback Received", totals["count"])
+    with col2:
+        st.metric("Average Rating", totals["avg_rating"] if totals["avg_rating"] is not None else "N/A")
+    with col3:
+        rate = totals["compatibility_rate"]
+        st.metric("Image Compatibility", f"{rate * 100:.1f}%" if rate is not None else "N/A")
+    
+    col1, col2 = st.columns(2)
+    with col1:
+        condition = st.selectbox("Condition", ["*"] + analytics.conditions(), key="analytics_condition",
+                                 format_func=lambda c: "All conditions" if c == "*" else c)
+    with col2:
+        input_type = st.selectbox("Input type", ["*", "text", "voice", "image"], key="analytics_input_type",
+                                  format_func=lambda t: "All inputs" if t == "*" else t)
+    
+    rows = analytics.table(condition, input_type)
+    if rows:
+        st.dataframe(
+            [{k: row[k] for k in ("drug", "count", "avg_rating", "positive", "negative", "compatibility_rate")} for row in rows],
+            use_container_width=True,
+        )
+    else:
+        st.info("ℹ️ No feedback recorded for this selection yet.")
+
+def render_bulk_user_transfer(users_col):
+    """CSV/JSONL import of many users at once, and a streamed export"""
+    import tempfile
+    from user_transfer import export_users, import_users
+    
+    st.write("**Import users** (columns: full_name, email, age, allergies, password)")
+    upload = st.file_uploader("CSV or JSONL file", type=["csv", "jsonl"], key="user_import_file")
+    update_passwords = st.checkbox("Replace passwords of existing users", value=False, key="user_import_update_passwords")
+    if upload is not None and st.button("📥 Import Users", use_container_width=True):
+        fmt = "jsonl" if upload.name.lower().endswith(".jsonl") else "csv"
+        with st.spinner("Importing users..."):
+            result = import_users(upload, fmt, users_col, update_passwords=update_passwords)
+        stats_service.invalidate("users")
+        st.success(
+            f"✅ {result['inserted']} added, {result['updated']} updated, {result['failed']} rejected, "
+            f"{result['skipped']} duplicate rows skipped of {result['rows']} rows"
+        )
+        if result["passwords_replaced"]:
+            st.warning(f"⚠️ Replaced the password of {result['passwords_replaced']} existing users")
+        if result["passwords_ignored"]:
+            st.info(f"ℹ️ Kept the current password of {result['passwords_ignored']} existing users")
+        if result["errors"]:
+            st.dataframe(result["errors"], use_container_width=True)
+    
+    st.write("**Export users**")
+    export_format = st.selectbox("Format", ["csv", "jsonl"], key="user_export_format")
+    if st.button("📤 Prepare Export", use_container_width=True):
+        # Rows are written to disk as the cursor streams them, not collected in memory
+        export_file = tempfile.TemporaryFile(mode="w+b")
+        text = io.TextIOWrapper(export_file, encoding="utf-8", newline="")
+        count = export_users(text, export_format, users_col)
+        text.flush()
+        text.detach()
+        export_file.seek(0)
+        st.download_button(
+            f"⬇️ Download {count} users",
+            data=export_file,
+            file_name=f"users_{datetime.now():%Y%m%d_%H%M%S}.{export_format}",
+            mime="text/csv" if export_format == "csv" else "application/x-ndjson",
+            use_container_width=True,
+        )
+
 # Edit User Functionality (optional enhancement)
 def edit_user_form(user_id, users_col):
     """Form to edit user details"""
@@ -243,9 +338,17 @@ def edit_user_form(user_id, users_col):
                         "allergies": new_allergies
                     }
                     if new_password:
-                        update_data["password"] = new_password
+                        update_data["password"] = auth_service.hash_password(new_password)
                     
-                    users_col.update_one({"_id": user_id}, {"$set": update_data})
+                    try:
+                        users_col.update_one({"_id": user_id}, {"$set": update_data})
+                    except DuplicateKeyError:
+                        st.error("❌ Another user already has this email!")
+                        return
+                    invalidate_user_allergies(user.get('email'))
+                    invalidate_user_allergies(new_email)
+                    auth_service.invalidate_profile("user", user.get('email'))
+                    auth_service.invalidate_profile("user", new_email)
                     st.success("✅ User updated successfully!")
                     del st.session_state.editing_user
                     st.rerun()
@@ -0,0 +1,193 @@
+# auth_service.py
+"""
+Password hashing, signed session tokens and a cached profile lookup.
+
+Passwords are stored as salted PBKDF2-SHA256 hashes. A successful login
+returns an HMAC-signed token that the Streamlit session keeps; every rerun
+verifies it locally and reads the profile from an in-process TTL cache, so
+authenticated page loads make no MongoDB queries. Records still holding a
+plaintext password are upgraded to a hash on their next successful login.
+"""
+import base64
+import hashlib
+import hmac
+import json
+import os
+import secrets
+import threading
+import time
+
+from pymongo import ASCENDING
+from pymongo.errors import OperationFailure
+
+from mongodb_utils import get_admins_collection, get_users_collection
+from prediction_cache import PredictionCache
+from user_store import EMAIL_COLLATION, ensure_user_indexes
+
+PASSWORD_HASH_ITERATIONS = int(os.environ.get("PASSWORD_HASH_ITERATIONS", "310000"))
+SESSION_TTL_SECONDS = float(os.environ.get("SESSION_TTL_SECONDS", str(12 * 3600)))
+AUTH_PROFILE_TTL_SECONDS = float(os.environ.get("AUTH_PROFILE_TTL_SECONDS", "300"))
+# Set AUTH_SECRET_KEY in production; the random fallback invalidates sessions on restart
+AUTH_SECRET_KEY = os.environ.get("AUTH_SECRET_KEY", "").encode("utf-8") or secrets.token_bytes(32)
+
+_HASH_SCHEME = "pbkdf2_sha256"
+PROFILE_PROJECTION = {"password": 0}
+
+
+# ---- Password hashing ----
+def hash_password(password: str, iterations: int = PASSWORD_HASH_ITERATIONS) -> str:
+    """'pbkdf2_sha256$<iterations>$<salt>$<hash>' with a fresh 16-byte salt"""
+    salt = secrets.token_bytes(16)
+    digest = hashlib.pbkdf2_hmac("sha256", password.encode("utf-8"), salt, iterations)
+    return "$".join((_HASH_SCHEME, str(iterations), _b64encode(salt), _b64encode(digest)))
+
+
+def verify_password(password: str, stored: str) -> tuple:
+    """
+    (valid, needs_rehash). Legacy plaintext values are compared in constant
+    time and always need a rehash, as do hashes with fewer iterations.
+    """
+    if not stored or not isinstance(stored, str) or password is None:
+        return False, False
+    parts = stored.split("$")
+    if len(parts) != 4 or parts[0] != _HASH_SCHEME:
+        return hmac.compare_digest(password.encode("utf-8"), stored.encode("utf-8")), True
+    try:
+        iterations, salt, expected = int(parts[1]), _b64decode(parts[2]), _b64decode(parts[3])
+        digest = hashlib.pbkdf2_hmac("sha256", password.encode("utf-8"), salt, iterations)
+    except ValueError:
+        # Malformed stored hash (bad iteration count or base64): a failed login, not a crash
+        return False, False
+    return hmac.compare_digest(digest, expected), iterations < PASSWORD_HASH_ITERATIONS
+
+
+def _b64encode(data: bytes) -> str:
+    return base64.urlsafe_b64encode(data).rstrip(b"=").decode("ascii")
+
+
+def _b64decode(text: str) -> bytes:
+    return base64.urlsafe_b64decode(text + "=" * (-len(text) % 4))
+
+
+# ---- Session tokens ----
+def issue_token(role: str, subject: str, ttl_seconds: float = SESSION_TTL_SECONDS) -> str:
+    """Signed '<payload>.<signature>' token for `subject` (admin username or user email)"""
+    payload = _b64encode(json.dumps(
+        {"role": role, "sub": subject, "exp": int(time.time() + ttl_seconds)}, separators=(",", ":")
+    ).encode("utf-8"))
+    signature = hmac.new(AUTH_SECRET_KEY, payload.encode("ascii"), hashlib.sha256).digest()
+    return f"{payload}.{_b64encode(signature)}"
+
+
+def verify_token(token: str, role: str = None):
+    """The token's claims if the signature is valid, it has not expired and the role matches; else None"""
+    if not token or token.count(".") != 1:
+        return None
+    payload, signature = token.split(".")
+    try:
+        # UnicodeEncodeError (non-ASCII token) is a ValueError too
+        expected = hmac.new(AUTH_SECRET_KEY, payload.encode("ascii"), hashlib.sha256).digest()
+        if not hmac.compare_digest(_b64decode(signature), expected):
+            return None
+        claims = json.loads(_b64decode(payload))
+    except ValueError:
+        return None
+    if claims.get("exp", 0) < time.time() or (role is not None and claims.get("role") != role):
+        return None
+    return claims
+
+
+# ---- Indexes ----
+_indexes_ready = False
+_indexes_lock = threading.Lock()
+
+
+def ensure_auth_indexes():
+    """Unique admin usernames and (case-insensitive) user emails, once per process"""
+    global _indexes_ready
+    if _indexes_ready:
+        return
+    with _indexes_lock:
+        if _indexes_ready:
+            return
+        admins = get_admins_collection()
+        try:
+            admins.create_index([("username", ASCENDING)], name="admins_username_unique", unique=True)
+        except OperationFailure:
+            # Duplicate usernames already stored; logins still work, uniqueness is not enforced
+            pass
+        ensure_user_indexes(get_users_collection())
+        _indexes_ready = True
+
+
+# ---- Authentication ----
+_ROLES = {
+    "admin": (get_admins_collection, "username", None),
+    "user": (get_users_collection, "email", EMAIL_COLLATION),
+}
+
+profile_cache = PredictionCache(maxsize=10000, ttl_seconds=AUTH_PROFILE_TTL_SECONDS)
+
+
+def authenticate(role: str, subject: str, password: str):
+    """Check credentials (one indexed lookup); returns a session token or None"""
+    if not subject or not password:
+        return None
+    ensure_auth_indexes()
+    collection_fn, field, collation = _ROLES[role]
+    collection = collection_fn()
+    cursor = collection.find({field: subject}).limit(1)
+    if collation:
+        cursor = cursor.collation(collation)
+    account = next(iter(cursor), None)
+    if account is None:
+        # Same cost as a real check so response time does not reveal unknown accounts
+        hashlib.pbkdf2_hmac("sha256", password.encode("utf-8"), b"\0" * 16, PASSWORD_HASH_ITERATIONS)
+        return None
+    valid, needs_rehash = verify_password(password, account.get("password"))
+    if not valid:
+        return None
+    if needs_rehash:
+        collection.update_one({"_id": account["_id"]}, {"$set": {"password": hash_password(password)}})
+    account.pop("password", None)
+    profile_cache.put((role, account[field]), account)
+    return issue_token(role, account[field])
+
+
+def authenticate_admin(username: str, password: str):
+    return authenticate("admin", username, password)
+
+
+def authenticate_user(email: str, password: str):
+    return authenticate("user", email, password)
+
+
+def get_profile(role: str, subject: str):
+    """Account document without the password, from the TTL cache when possible"""
+    key = (role, subject)
+    profile = profile_cache.get(key)
+    if profile is None:
+        collection_fn, field, collation = _ROLES[role]
+        cursor = collection_fn().find({field: subject}, PROFILE_PROJECTION).limit(1)
+        if collation:
+            cursor = cursor.collation(collation)
+        profile = next(iter(cursor), None)
+        if profile is not None:
+            profile_cache.put(key, profile)
+    return profile
+
+
+def current_session(token: str, role: str = None):
+    """(claims, profile) for a valid token, or None; no MongoDB query while the profile is cached"""
+    claims = verify_token(token, role)
+    if claims is None:
+        return None
+    profile = get_profile(claims["role"], claims["sub"])
+    if profile is None:
+        return None
+    return claims, profile
+
+
+def invalidate_profile(role: str, subject: str):
+    """Call after editing or deleting an account so the next rerun reloads it"""
+    profile_cache.invalidate((role, subject))
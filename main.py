@@ -6,21 +6,30 @@ import plotly.express as px
 import plotly.graph_objects as go
 from plotly.subplots import make_subplots
 import time
-import random
 
 # Your existing imports and MongoDB connection
 from admin import admin_dashboard
 from user import user_page
-from bert_model import predict_drug
-from mongodb_utils import get_db_collection
-from pymongo import MongoClient
+from recommendation_log import predict_and_record  # records every prediction; uses the inference server when INFERENCE_SERVER_URL is set
+from mongodb_utils import get_users_collection, get_admins_collection, get_recommendations_collection
+import stats
+import trends
+import metrics
 
-# Your existing MongoDB collections
-users_col = get_db_collection()  # returns the "users" collection
-client = MongoClient("mongodb+srv://url")
-db = client["drug_recommender_db"]
-admins_col = db["admins"]
-recommendations_col = db["recommendations"]  # Add this line to define recommendations_col
+# Your existing MongoDB collections (all share one pooled client)
+users_col = get_users_collection()
+admins_col = get_admins_collection()
+recommendations_col = get_recommendations_collection()
+
+
+def predict_drug(symptoms, input_type="text"):
+    """
+    Prediction for the logged-in user: drugs their allergies rule out are
+    skipped, and every call is recorded in the recommendations collection.
+    Raises user_store.UnknownUserError if the session's email has no user.
+    """
+    user_email = st.session_state.get("user_email") or None
+    return predict_and_record(user_email, symptoms, input_type)
 
 # Set page configuration
 st.set_page_config(
@@ -125,17 +134,16 @@ st.markdown("""
 """, unsafe_allow_html=True)
 
 def get_user_count():
-    # Replace mock with actual count from your database
-    return users_col.count_documents({})
+    # Cached estimated count shared with the admin panel (no collection scan per rerun)
+    return stats.get_user_count()
 
 def get_recommendation_count():
-    # Replace with actual count from your recommendations collection
-    return recommendations_col.count_documents({})
+    # Cached estimated count of the recommendations collection
+    return stats.get_recommendation_count()
 
 def get_accuracy_rate():
-    # Replace with actual calculation from your data
-    # This is a placeholder - implement your actual accuracy calculation
-    return 92.5  # Example static value
+    # Share of positive (rating >= 4) user feedback; None until feedback exists
+    return trends.get_accuracy_rate()
 
 # Initialize session state
 def init_session_state():
@@ -176,11 +184,13 @@ def render_sidebar():
             if st.button("🚪 Logout", key="sidebar_logout_user", use_container_width=True):
                 st.session_state.user_logged_in = False
                 st.session_state.user_email = ""
+                st.session_state.pop("user_token", None)
                 st.rerun()
         elif st.session_state.admin_logged_in:
             st.success("Logged in as Admin")
             if st.button("🚪 Logout", key="sidebar_logout_admin", use_container_width=True):
                 st.session_state.admin_logged_in = False
+                st.session_state.pop("admin_token", None)
                 st.rerun()
         else:
             st.info("Please log in to access all features")
@@ -218,16 +228,17 @@ def render_home_page():
         st.markdown(f"""
         <div class="stat-card">
             <h3>💊 Recommendations</h3>
-            <h2>{250}</h2>
+            <h2>{get_recommendation_count():,}</h2>
             <p>Drug recommendations provided</p>
         </div>
         """, unsafe_allow_html=True)
     
     with col3:
+        accuracy = get_accuracy_rate()
         st.markdown(f"""
         <div class="stat-card">
             <h3>🎯 Accuracy</h3>
-            <h2>{get_accuracy_rate()}%</h2>
+            <h2>{f"{accuracy}%" if accuracy is not None else "N/A"}</h2>
             <p>System accuracy rate</p>
         </div>
         """, unsafe_allow_html=True)
@@ -235,10 +246,11 @@ def render_home_page():
     # Interactive Chart
     st.markdown('<h2 class="sub-header">📈 Recommendation Trends</h2>', unsafe_allow_html=True)
     
-    # Generate sample data for the chart
-    months = ['Jan', 'Feb', 'Mar', 'Apr', 'May', 'Jun', 'Jul', 'Aug', 'Sep', 'Oct', 'Nov', 'Dec']
-    recommendations = [random.randint(300, 800) for _ in range(12)]
-    users = [random.randint(50, 200) for _ in range(12)]
+    # Last 12 months from the incrementally maintained rollup collection
+    monthly = trends.get_monthly_trends(12)
+    months = [row["month"].strftime("%b %Y") for row in monthly]
+    recommendations = [row["recommendations"] for row in monthly]
+    users = [row["new_users"] for row in monthly]
     
     fig = make_subplots(specs=[[{"secondary_y": True}]])
     fig.add_trace(
@@ -432,6 +444,14 @@ def render_contact_page():
                     st.error("❌ Please fill in all required fields.")
 # Main app logic
 def main():
+    # Expose /metrics when METRICS_ENABLED=1 and METRICS_PORT is set
+    if metrics.ENABLED and metrics.METRICS_PORT:
+        metrics.start_http_server(metrics.METRICS_PORT)
+    with metrics.trace():
+        render_page()
+
+
+def render_page():
     init_session_state()
     render_sidebar()
     
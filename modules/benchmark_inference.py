@@ -0,0 +1,248 @@
+# benchmark_inference.py
+"""
+Inference benchmark for the drug classifier.
+
+Builds a throwaway model directory from the shipped
+models/distilbert_drug_model/config.json and label encoder, with randomly
+initialised weights and a synthetic WordPiece vocabulary, so nothing has to
+be downloaded. Each backend is loaded through bert_model.ModelHolder and
+every case is timed through the public prediction API (predict_drug for
+batch size 1, predict_drugs otherwise) with the prediction and token caches
+and micro-batching disabled, so batch-1 latency is the backend's and not the
+batcher's collection window. Sweeps backend x threads x batch size x sequence length and
+reports latency percentiles, throughput, per-case RSS and per-backend load
+time as JSON.
+
+    python modules/benchmark_inference.py --backends torch int8 --output bench.json
+    python modules/benchmark_inference.py --baseline bench_baseline.json --threshold 0.15
+"""
+import argparse
+import gc
+import json
+import platform
+import shutil
+import sys
+import tempfile
+import threading
+import time
+from contextlib import contextmanager
+from pathlib import Path
+
+import numpy as np
+
+MODEL_DIR = Path(__file__).parent / "models" / "distilbert_drug_model"
+SPECIAL_TOKENS = ["[PAD]", "[UNK]", "[CLS]", "[SEP]", "[MASK]"]
+RSS_SAMPLE_INTERVAL = 0.005
+
+
+def build_model_dir(out_dir: Path, model_dir: Path = MODEL_DIR, seed: int = 0) -> int:
+    """
+    Write a loadable model directory (random safetensors weights, synthetic
+    tokenizer, shipped config and label encoder) to out_dir; returns the
+    vocabulary size.
+    """
+    import torch
+    from transformers import DistilBertConfig, DistilBertForSequenceClassification, DistilBertTokenizerFast
+
+    torch.manual_seed(seed)
+    config = DistilBertConfig.from_pretrained(model_dir)
+    model = DistilBertForSequenceClassification(config)
+    model.save_pretrained(out_dir, safe_serialization=True)
+
+    # One whole-word token per vocabulary entry, so a text of n words is n tokens
+    vocab_file = Path(out_dir) / "vocab.txt"
+    words = [f"tok{i}" for i in range(config.vocab_size - len(SPECIAL_TOKENS))]
+    vocab_file.write_text("\n".join(SPECIAL_TOKENS + words) + "\n", encoding="utf-8")
+    DistilBertTokenizerFast(vocab_file=str(vocab_file)).save_pretrained(out_dir)
+    shutil.copy(model_dir / "label_encoder.joblib", Path(out_dir) / "label_encoder.joblib")
+    return config.vocab_size
+
+
+def random_texts(batch_size: int, seq_len: int, vocab_size: int, rng) -> list:
+    """Texts that tokenize to exactly seq_len ids including [CLS]/[SEP]"""
+    ids = rng.integers(0, vocab_size - len(SPECIAL_TOKENS), size=(batch_size, max(seq_len - 2, 1)))
+    return [" ".join(f"tok{i}" for i in row) for row in ids]
+
+
+@contextmanager
+def sample_rss(interval: float = RSS_SAMPLE_INTERVAL):
+    """Poll this process's RSS on a thread; the yielded list holds every sample (None where unsupported)"""
+    from mmap_weights import rss_mb
+
+    samples = [rss_mb()]
+    stop = threading.Event()
+
+    def poll():
+        while not stop.wait(interval):
+            samples.append(rss_mb())
+
+    thread = threading.Thread(target=poll, name="rss-sampler", daemon=True)
+    thread.start()
+    try:
+        yield samples
+    finally:
+        stop.set()
+        thread.join()
+        samples.append(rss_mb())
+
+
+def _rss_summary(samples: list) -> dict:
+    if samples[0] is None:
+        return {"rss_before_mb": None, "rss_peak_mb": None}
+    return {"rss_before_mb": round(samples[0], 1), "rss_peak_mb": round(max(samples), 1)}
+
+
+def run_case(bert_model, batch_size: int, seq_len: int, vocab_size: int, iterations: int, warmup: int, rng) -> dict:
+    texts = random_texts(batch_size, seq_len, vocab_size, rng)
+    if batch_size == 1:
+        predict = lambda: bert_model.predict_drug(texts[0])
+    else:
+        predict = lambda: bert_model.predict_drugs(texts)
+    for _ in range(warmup):
+        predict()
+    latencies = []
+    with sample_rss() as samples:
+        for _ in range(iterations):
+            start = time.perf_counter()
+            predict()
+            latencies.append((time.perf_counter() - start) * 1000)
+    latencies = np.asarray(latencies)
+    return {
+        "p50_ms": round(float(np.percentile(latencies, 50)), 3),
+        "p95_ms": round(float(np.percentile(latencies, 95)), 3),
+        "p99_ms": round(float(np.percentile(latencies, 99)), 3),
+        "mean_ms": round(float(latencies.mean()), 3),
+        "throughput_per_s": round(batch_size * 1000.0 / float(latencies.mean()), 2),
+        **_rss_summary(samples),
+    }
+
+
+def case_key(case: dict) -> str:
+    return f"{case['backend']}/threads={case['threads']}/batch={case['batch_size']}/seq={case['seq_len']}"
+
+
+def load_holder(bert_model, model_dir: Path, backend_name: str, threads: int):
+    """ModelHolder for model_dir loaded the way the app loads it; returns (holder, load stats)"""
+    import torch
+
+    torch.set_num_threads(threads)
+    holder = bert_model.ModelHolder(model_dir, Path(model_dir) / "label_encoder.joblib", backend=backend_name)
+    with sample_rss() as samples:
+        holder.load()
+    if backend_name == "onnx":
+        from inference_backends import OnnxBackend
+
+        # The export is current, so this only opens a session with the requested thread count
+        holder.backend = OnnxBackend(model_dir, num_threads=threads)
+    return holder, {**holder.load_stats, **_rss_summary(samples)}
+
+
+def run_benchmark(backends, batch_sizes, seq_lens, thread_counts, iterations: int = 20, warmup: int = 3, seed: int = 0) -> dict:
+    import torch
+    import bert_model
+
+    # Time the model, not cache lookups or the micro-batcher's wait for company
+    bert_model.CACHE_SIZE = 0
+    bert_model.TOKEN_CACHE_SIZE = 0
+    bert_model.MICRO_BATCHING = False
+    rng = np.random.default_rng(seed)
+    cases = []
+    load_stats = {}
+    original_holder = bert_model.holder
+    with tempfile.TemporaryDirectory() as model_dir:
+        model_dir = Path(model_dir)
+        vocab_size = build_model_dir(model_dir, seed=seed)
+        try:
+            for backend_name in backends:
+                for threads in thread_counts:
+                    holder, stats = load_holder(bert_model, model_dir, backend_name, threads)
+                    load_stats[f"{backend_name}/threads={threads}"] = stats
+                    bert_model.holder = holder
+                    for batch_size in batch_sizes:
+                        for seq_len in seq_lens:
+                            case = {"backend": backend_name, "threads": threads, "batch_size": batch_size, "seq_len": seq_len}
+                            case.update(run_case(bert_model, batch_size, seq_len, vocab_size, iterations, warmup, rng))
+                            cases.append(case)
+                            print(
+                                f"{case_key(case)}: p50={case['p50_ms']}ms p95={case['p95_ms']}ms "
+                                f"{case['throughput_per_s']}/s peak={case['rss_peak_mb']}MiB",
+                                file=sys.stderr,
+                            )
+                    # Drop this holder before loading the next so cases do not share its memory
+                    bert_model.holder = original_holder
+                    del holder
+                    gc.collect()
+        finally:
+            bert_model.holder = original_holder
+    return {
+        "environment": {
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "torch": torch.__version__,
+            "micro_batching": bert_model.MICRO_BATCHING,
+        },
+        "model_load": load_stats,
+        "cases": cases,
+    }
+
+
+def compare_to_baseline(report: dict, baseline: dict, threshold: float) -> list:
+    """
+    Cases whose p95 latency grew, or throughput fell, by more than `threshold`
+    (fraction). A baseline sharing no case with the report is itself a
+    failure, so a changed sweep cannot pass unnoticed.
+    """
+    baseline_cases = {case_key(case): case for case in baseline.get("cases", [])}
+    regressions = []
+    matched = 0
+    for case in report["cases"]:
+        base = baseline_cases.get(case_key(case))
+        if base is None or "p95_ms" not in base:
+            continue
+        matched += 1
+        if case["p95_ms"] > base["p95_ms"] * (1 + threshold):
+            regressions.append(f"{case_key(case)}: p95 {base['p95_ms']}ms -> {case['p95_ms']}ms")
+        if case["throughput_per_s"] < base["throughput_per_s"] * (1 - threshold):
+            regressions.append(f"{case_key(case)}: throughput {base['throughput_per_s']}/s -> {case['throughput_per_s']}/s")
+    if not matched:
+        regressions.append("no case in the baseline matches this run (different backends, threads, batch sizes or lengths?)")
+    return regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark drug classifier inference")
+    parser.add_argument("--backends", nargs="+", default=["torch"], choices=["torch", "int8", "onnx"])
+    parser.add_argument("--batch-sizes", nargs="+", type=int, default=[1, 8, 32])
+    parser.add_argument("--seq-lens", nargs="+", type=int, default=[16, 64, 128])
+    parser.add_argument("--threads", nargs="+", type=int, default=[1, 4])
+    parser.add_argument("--iterations", type=int, default=20)
+    parser.add_argument("--warmup", type=int, default=3)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", type=Path, default=None, help="write the JSON report here (default: stdout)")
+    parser.add_argument("--baseline", type=Path, default=None, help="fail if slower than this stored report")
+    parser.add_argument("--threshold", type=float, default=0.10, help="allowed regression as a fraction (default 0.10)")
+    args = parser.parse_args(argv)
+
+    report = run_benchmark(args.backends, args.batch_sizes, args.seq_lens, args.threads, args.iterations, args.warmup, args.seed)
+
+    exit_code = 0
+    if args.baseline:
+        with open(args.baseline) as f:
+            regressions = compare_to_baseline(report, json.load(f), args.threshold)
+        report["regressions"] = regressions
+        if regressions:
+            print("Regressions beyond threshold:", file=sys.stderr)
+            for line in regressions:
+                print(f"  {line}", file=sys.stderr)
+            exit_code = 1
+
+    text = json.dumps(report, indent=2)
+    if args.output:
+        args.output.write_text(text)
+    else:
+        print(text)
+    return exit_code
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,29 +1,485 @@
-import torch
-from transformers import DistilBertTokenizerFast, DistilBertForSequenceClassification
-import joblib
+import hashlib
+import os
+import queue
+import threading
+import time
+from concurrent.futures import Future
+
+import numpy as np
 from pathlib import Path
 
+import metrics
+from prediction_cache import PredictionCache, files_fingerprint, normalize_text
+
 # Paths
 BASE_DIR = Path(__file__).parent
 MODEL_DIR = BASE_DIR / "models" / "distilbert_drug_model"
 LABEL_ENCODER_PATH = MODEL_DIR / "label_encoder.joblib"
+WEIGHT_SUFFIXES = (".safetensors", ".bin", ".pt")
+TOKENIZER_FILES = ("vocab.txt", "tokenizer.json", "tokenizer_config.json", "special_tokens_map.json")
+
+# Micro-batching settings (concurrent single calls are grouped into one forward pass)
+MICRO_BATCHING = os.environ.get("DRUG_MODEL_MICRO_BATCHING", "1") == "1"
+MAX_BATCH_SIZE = int(os.environ.get("DRUG_MODEL_MAX_BATCH_SIZE", "32"))
+MAX_BATCH_WAIT_MS = float(os.environ.get("DRUG_MODEL_MAX_BATCH_WAIT_MS", "5"))
+
+# Softmax temperature fitted on held-out data (1.0 = raw model probabilities)
+CALIBRATION_TEMPERATURE = float(os.environ.get("DRUG_MODEL_TEMPERATURE", "1.0"))
+
+# Inference backend: "torch" (fp32 eager), "int8" (dynamic quantization) or "onnx" (onnxruntime)
+BACKEND = os.environ.get("DRUG_MODEL_BACKEND", "torch")
+
+# Map model.safetensors read-only and shared between processes instead of copying weights
+MMAP_WEIGHTS = os.environ.get("DRUG_MODEL_MMAP_WEIGHTS", "1") == "1"
+
+# Prediction cache settings (0 entries disables the cache)
+CACHE_SIZE = int(os.environ.get("DRUG_MODEL_CACHE_SIZE", "4096"))
+CACHE_TTL_SECONDS = float(os.environ.get("DRUG_MODEL_CACHE_TTL", "3600"))
+
+# Tokenization: long texts keep their first HEAD_TOKENS and the remaining budget from
+# the end (head+tail truncation); batches are split into buckets of similar length
+MAX_SEQ_LENGTH = int(os.environ.get("DRUG_MODEL_MAX_LENGTH", "128"))
+HEAD_TOKENS = int(os.environ.get("DRUG_MODEL_HEAD_TOKENS", str(MAX_SEQ_LENGTH // 2)))
+LENGTH_BUCKETS = (8, 16, 32, 64, 128, 256, 512)
+TOKEN_CACHE_SIZE = int(os.environ.get("DRUG_MODEL_TOKEN_CACHE_SIZE", "8192"))
+
+
+# ---- Lazily loaded model ----
+class ModelHolder:
+    """
+    Thread-safe holder that loads the tokenizer, model and label encoder on
+    first use, so importing this module stays cheap.
+    """
+
+    def __init__(self, model_dir: Path = MODEL_DIR, label_encoder_path: Path = LABEL_ENCODER_PATH, backend: str = BACKEND):
+        self.model_dir = model_dir
+        self.label_encoder_path = label_encoder_path
+        self.backend_name = backend
+        self.tokenizer = None
+        self.backend = None
+        self.label_encoder = None
+        self.id_to_drug = None
+        self.load_seconds = None
+        self.load_stats = {}
+        self.weights_mode = None
+        self._mappings = []
+        self._embedding_backend = None
+        self._lock = threading.Lock()
+
+    @property
+    def loaded(self) -> bool:
+        return self.backend is not None
+
+    def load_fp32_model(self):
+        """Fresh eager fp32 model from model_dir (the reference for parity checks)"""
+        from mmap_weights import SAFETENSORS_FILENAME, load_model_mmap
+
+        if MMAP_WEIGHTS and (self.model_dir / SAFETENSORS_FILENAME).exists():
+            model, mapping = load_model_mmap(self.model_dir)
+            # Tensors point into the mapping; keep it alive with the holder
+            self._mappings.append(mapping)
+            self.weights_mode = "mmap"
+            return model
+
+        from transformers import DistilBertForSequenceClassification
+
+        model = DistilBertForSequenceClassification.from_pretrained(self.model_dir, local_files_only=True)
+        model.eval()
+        self.weights_mode = "copy"
+        return model
+
+    def load(self):
+        """Load everything if not already loaded; returns self"""
+        if self.backend is not None:
+            return self
+        with self._lock:
+            if self.backend is None:
+                # Heavy imports are deferred until a prediction actually needs them
+                import joblib
+                from transformers import DistilBertTokenizerFast
+                from inference_backends import create_backend
+                from mmap_weights import rss_mb
+
+                rss_before = rss_mb()
+                start = time.perf_counter()
+                self.tokenizer = DistilBertTokenizerFast.from_pretrained(self.model_dir)
+                # The fp32 model is only loaded if the backend needs it (not for an up-to-date model.onnx)
+                backend = create_backend(
+                    self.backend_name, self.load_fp32_model, self.model_dir,
+                    source_fingerprint=weights_fingerprint(self.model_dir),
+                )
+                self.label_encoder = joblib.load(self.label_encoder_path)
+                # Precomputed id -> drug name lookup (same mapping as label_encoder.inverse_transform)
+                self.id_to_drug = np.asarray(self.label_encoder.classes_, dtype=object)
+                self.load_seconds = time.perf_counter() - start
+                self.load_stats = {
+                    "seconds": round(self.load_seconds, 3),
+                    "backend": self.backend_name,
+                    "weights": self.weights_mode or "not loaded",
+                    "rss_before_mb": rss_before,
+                    "rss_after_mb": rss_mb(),
+                }
+                metrics.observe("model_load_seconds", self.load_seconds, backend=self.backend_name)
+                # Published last so other threads never see a half-loaded holder
+                self.backend = backend
+        return self
+
+    def embedding_backend(self):
+        """The serving backend if it exposes pooled outputs, else a separate fp32 torch backend (e.g. for onnx)"""
+        self.load()
+        if hasattr(self.backend, "embeddings"):
+            return self.backend
+        with self._lock:
+            if self._embedding_backend is None:
+                from inference_backends import TorchBackend
+
+                self._embedding_backend = TorchBackend(self.load_fp32_model())
+        return self._embedding_backend
+
+
+holder = ModelHolder()
+
+
+def warmup(text: str = "headache and fever") -> float:
+    """Load the model and run one prediction ahead of traffic; returns load time in seconds"""
+    holder.load()
+    predict_probabilities([text])
+    return holder.load_seconds
+
+
+def model_load_seconds():
+    """Seconds spent loading the model, or None if it has not been loaded yet"""
+    return holder.load_seconds
+
+
+def model_load_stats() -> dict:
+    """Load time, weight loading mode (mmap/copy) and RSS before/after loading"""
+    return dict(holder.load_stats)
+
+
+def weight_files(model_dir: Path = MODEL_DIR) -> list:
+    """Weight files directly in model_dir (a listing of one directory, no recursive walk)"""
+    return sorted(path for path in Path(model_dir).glob("*") if path.suffix in WEIGHT_SUFFIXES)
+
+
+def weights_fingerprint(model_dir: Path = MODEL_DIR) -> tuple:
+    """Changes when config.json or a weight file is rewritten; model.onnx is exported from this state"""
+    return files_fingerprint(Path(model_dir) / "config.json", *weight_files(model_dir))
+
+
+def model_fingerprint() -> tuple:
+    """Changes when the config, weights or label encoder are rewritten (not on derived files like model.onnx)"""
+    return weights_fingerprint() + files_fingerprint(LABEL_ENCODER_PATH)
+
+
+_model_version = None
+
+
+def model_version() -> str:
+    """
+    Short identifier of the deployed model: a hash of config.json and the
+    label encoder plus size/mtime of the weight files, and the backend name.
+    """
+    global _model_version
+    if _model_version is None:
+        digest = hashlib.sha1()
+        for path in (MODEL_DIR / "config.json", LABEL_ENCODER_PATH):
+            if path.exists():
+                digest.update(path.read_bytes())
+        for path in weight_files():
+            stat = path.stat()
+            digest.update(f"{path.name}:{stat.st_size}:{stat.st_mtime_ns}".encode())
+        _model_version = f"distilbert-{digest.hexdigest()[:12]}-{BACKEND}"
+    return _model_version
+
+
+# ---- Tokenization with head+tail truncation, token reuse and length bucketing ----
+token_cache = PredictionCache(
+    maxsize=TOKEN_CACHE_SIZE,
+    ttl_seconds=CACHE_TTL_SECONDS,
+    fingerprint_fn=lambda: files_fingerprint(*(MODEL_DIR / name for name in TOKENIZER_FILES)),
+)
+
+
+def _truncate(ids: list, budget: int, head: int) -> list:
+    if len(ids) <= budget:
+        return ids
+    head = min(head, budget)
+    tail = budget - head
+    return ids[:head] + (ids[-tail:] if tail else [])
+
+
+def _token_ids(tokenizer, texts: list[str]) -> list:
+    """Token ids with [CLS]/[SEP] for each text, reusing cached ids where possible"""
+    results = [None] * len(texts)
+    missing = []
+    for i, text in enumerate(texts):
+        ids = token_cache.get(text) if TOKEN_CACHE_SIZE > 0 else None
+        if ids is None:
+            missing.append(i)
+        else:
+            results[i] = ids
+    if missing:
+        budget = MAX_SEQ_LENGTH - 2
+        with metrics.timer("tokenize_seconds"):
+            encoded = tokenizer([texts[i] for i in missing], add_special_tokens=False, truncation=False)["input_ids"]
+        for i, ids in zip(missing, encoded):
+            ids = (tokenizer.cls_token_id, *_truncate(ids, budget, HEAD_TOKENS), tokenizer.sep_token_id)
+            results[i] = ids
+            if TOKEN_CACHE_SIZE > 0:
+                token_cache.put(texts[i], ids)
+    return results
+
+
+def _pad(token_ids: list, pad_id: int):
+    width = max(len(ids) for ids in token_ids)
+    input_ids = np.full((len(token_ids), width), pad_id, dtype=np.int64)
+    attention_mask = np.zeros((len(token_ids), width), dtype=np.int64)
+    for row, ids in enumerate(token_ids):
+        input_ids[row, :len(ids)] = ids
+        attention_mask[row, :len(ids)] = 1
+    return input_ids, attention_mask
+
+
+def _buckets(token_ids: list) -> list:
+    """Group row indices by length bucket so each group is padded only to its own longest row"""
+    groups = {}
+    for i, ids in enumerate(token_ids):
+        bucket = next((b for b in LENGTH_BUCKETS if len(ids) <= b), LENGTH_BUCKETS[-1])
+        groups.setdefault(bucket, []).append(i)
+    return [groups[b] for b in sorted(groups)]
+
+
+def _encode(tokenizer, texts: list[str]):
+    """Padded (input_ids, attention_mask) for one batch, without bucketing"""
+    return _pad(_token_ids(tokenizer, texts), tokenizer.pad_token_id)
+
+
+def _softmax(logits: np.ndarray) -> np.ndarray:
+    logits = logits - logits.max(axis=1, keepdims=True)
+    exp = np.exp(logits)
+    return exp / exp.sum(axis=1, keepdims=True)
+
+
+def predict_probabilities(texts: list[str]) -> np.ndarray:
+    """Return the (len(texts), num_labels) calibrated probability matrix (one forward pass per length bucket)"""
+    loaded = holder.load()
+    if not texts:
+        return np.empty((0, len(loaded.id_to_drug)), dtype=np.float32)
+    token_ids = _token_ids(loaded.tokenizer, texts)
+    logits = np.empty((len(texts), len(loaded.id_to_drug)), dtype=np.float32)
+    for rows in _buckets(token_ids):
+        input_ids, attention_mask = _pad([token_ids[i] for i in rows], loaded.tokenizer.pad_token_id)
+        with metrics.timer("model_forward_seconds", backend=loaded.backend.name):
+            logits[rows] = loaded.backend.logits(input_ids, attention_mask)
+        metrics.inc("model_forward_rows_total", len(rows), backend=loaded.backend.name)
+    return _softmax(logits / CALIBRATION_TEMPERATURE)
+
+
+def embed_texts(texts: list[str], normalize: bool = True) -> np.ndarray:
+    """
+    (len(texts), hidden_size) float32 pooled DistilBERT outputs, one forward
+    pass per length bucket; rows are L2-normalized unless normalize=False.
+    """
+    loaded = holder.load()
+    backend = loaded.embedding_backend()
+    if not texts:
+        return np.empty((0, 0), dtype=np.float32)
+    token_ids = _token_ids(loaded.tokenizer, texts)
+    vectors = None
+    for rows in _buckets(token_ids):
+        input_ids, attention_mask = _pad([token_ids[i] for i in rows], loaded.tokenizer.pad_token_id)
+        with metrics.timer("model_embed_seconds", backend=backend.name):
+            pooled = backend.embeddings(input_ids, attention_mask)
+        if vectors is None:
+            vectors = np.empty((len(texts), pooled.shape[1]), dtype=np.float32)
+        vectors[rows] = pooled
+    if normalize:
+        norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+        vectors /= np.maximum(norms, 1e-12)
+    return vectors
+
+
+def check_backend_parity(texts: list[str], batch_size: int = 32) -> dict:
+    """
+    Compare the configured backend against eager fp32 on `texts` and report
+    the top-1 agreement rate.
+    """
+    from inference_backends import TorchBackend, top1_agreement
+
+    loaded = holder.load()
+    reference = TorchBackend(loaded.load_fp32_model())
+    ref_logits, cand_logits = [], []
+    for i in range(0, len(texts), batch_size):
+        input_ids, attention_mask = _encode(loaded.tokenizer, texts[i:i + batch_size])
+        ref_logits.append(reference.logits(input_ids, attention_mask))
+        cand_logits.append(loaded.backend.logits(input_ids, attention_mask))
+    num_labels = len(loaded.id_to_drug)
+    ref = np.concatenate(ref_logits) if ref_logits else np.empty((0, num_labels))
+    cand = np.concatenate(cand_logits) if cand_logits else np.empty((0, num_labels))
+    return {
+        "backend": loaded.backend.name,
+        "samples": len(texts),
+        "top1_agreement": top1_agreement(ref, cand),
+    }
+
+
+def _top_k(probs: np.ndarray, k: int, allowed: np.ndarray = None):
+    """
+    Top-k (drug, confidence %) pairs for one probability row, best first.
+    Label ids where `allowed` is False are never returned.
+    """
+    if allowed is not None:
+        probs = np.where(allowed, probs, -1.0)
+        k = min(k, int(np.count_nonzero(allowed)))
+        if k <= 0:
+            return []
+    k = max(1, min(k, probs.shape[0]))
+    if k == 1:
+        top_ids = np.array([int(np.argmax(probs))])
+    else:
+        top_ids = np.argpartition(probs, -k)[-k:]
+        top_ids = top_ids[np.argsort(probs[top_ids])[::-1]]
+    id_to_drug = holder.id_to_drug
+    return [(id_to_drug[i], round(float(probs[i]) * 100, 2)) for i in top_ids]
+
+
+def predict_drugs(texts: list[str]):
+    """Predict drug name and confidence for a batch of symptom texts in one forward pass"""
+    return [_top_k(row, 1)[0] for row in predict_probabilities(texts)]
+
+
+def predict_drugs_topk(texts: list[str], k: int = 5):
+    """Top-k (drug, confidence) predictions for a batch of symptom texts"""
+    return [_top_k(row, k) for row in predict_probabilities(texts)]
+
+
+# ---- Allergy contraindications ----
+_contraindications = None
+_contraindications_lock = threading.Lock()
+
+
+def contraindication_index():
+    """Allergen -> label id index over this model's labels, built once on first use"""
+    global _contraindications
+    if _contraindications is None:
+        loaded = holder.load()
+        with _contraindications_lock:
+            if _contraindications is None:
+                from contraindications import ContraindicationIndex
+
+                _contraindications = ContraindicationIndex(loaded.id_to_drug)
+    return _contraindications
+
+
+def allowed_mask(allergies: str = None):
+    """Boolean mask of labels that are safe for this allergy profile, or None if nothing is excluded"""
+    if not allergies:
+        return None
+    return contraindication_index().allowed_mask(allergies)
+
+
+# ---- Dynamic micro-batching for concurrent sessions ----
+class MicroBatcher:
+    """
+    Collects concurrent single predictions for up to `max_wait_ms` and runs
+    them as one padded batch on a background thread.
+    """
+
+    def __init__(self, batch_fn, max_batch_size: int = MAX_BATCH_SIZE, max_wait_ms: float = MAX_BATCH_WAIT_MS):
+        self.batch_fn = batch_fn
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait_ms / 1000.0
+        self._queue = queue.Queue()
+        self._thread = None
+        self._lock = threading.Lock()
+
+    def _ensure_started(self):
+        with self._lock:
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._run, name="drug-micro-batcher", daemon=True)
+                self._thread.start()
+
+    def submit(self, text: str) -> Future:
+        """Queue one text and return a future resolving to its batch_fn result"""
+        self._ensure_started()
+        future = Future()
+        self._queue.put((text, future))
+        return future
+
+    def predict(self, text: str):
+        return self.submit(text).result()
+
+    def _collect(self):
+        # Block for the first request, then gather more until the window closes
+        batch = [self._queue.get()]
+        deadline = time.monotonic() + self.max_wait
+        while len(batch) < self.max_batch_size:
+            remaining = deadline - time.monotonic()
+            try:
+                if remaining > 0:
+                    batch.append(self._queue.get(timeout=remaining))
+                else:
+                    batch.append(self._queue.get_nowait())
+            except queue.Empty:
+                break
+        return batch
+
+    def _run(self):
+        while True:
+            batch = self._collect()
+            texts = [text for text, _ in batch]
+            try:
+                results = self.batch_fn(texts)
+            except Exception as e:
+                for _, future in batch:
+                    future.set_exception(e)
+                continue
+            for (_, future), result in zip(batch, results):
+                future.set_result(result)
+
+
+batcher = MicroBatcher(predict_probabilities)
+
+
+# ---- Prediction cache in front of the classifier ----
+prediction_cache = PredictionCache(
+    maxsize=CACHE_SIZE,
+    ttl_seconds=CACHE_TTL_SECONDS,
+    fingerprint_fn=model_fingerprint,
+)
+
+
+def _probabilities(text: str) -> np.ndarray:
+    # Normalized only for the lookup: spellings differing in case/punctuation share an entry,
+    # while the model still sees the raw text it was trained on
+    key = normalize_text(text)
+    if CACHE_SIZE > 0:
+        probs = prediction_cache.get(key)
+        metrics.inc("prediction_cache_requests_total", result="miss" if probs is None else "hit")
+        if probs is not None:
+            return probs
+    probs = batcher.predict(text) if MICRO_BATCHING else predict_probabilities([text])[0]
+    if CACHE_SIZE > 0:
+        probs.setflags(write=False)
+        prediction_cache.put(key, probs)
+    return probs
+
+
+def cache_stats() -> dict:
+    """Hit/miss/eviction counters of the prediction cache"""
+    return prediction_cache.stats()
+
+
+def predict_drug(text: str, allergies: str = None):
+    """
+    Predict drug name and confidence from symptom text. Drugs contraindicated
+    by `allergies` (free text) are skipped; (None, 0.0) if all of them are.
+    """
+    predictions = _top_k(_probabilities(text), 1, allowed_mask(allergies))
+    return predictions[0] if predictions else (None, 0.0)
+
 
-# Load tokenizer & model
-tokenizer = DistilBertTokenizerFast.from_pretrained(MODEL_DIR)
-model = DistilBertForSequenceClassification.from_pretrained(MODEL_DIR, local_files_only=True)
-model.eval()
-
-# Load label encoder
-label_encoder = joblib.load(LABEL_ENCODER_PATH)
-
-def predict_drug(text: str):
-    """Predict drug name and confidence from symptom text"""
-    inputs = tokenizer(text, return_tensors="pt", truncation=True, padding=True, max_length=128)
-    with torch.no_grad():
-        outputs = model(**inputs)
-        logits = outputs.logits
-        probs = torch.softmax(logits, dim=1)
-        predicted_id = torch.argmax(probs, dim=1).item()
-        confidence = float(probs[0, predicted_id] * 100)
-        predicted_label = label_encoder.inverse_transform([predicted_id])[0]
-    return predicted_label, round(confidence, 2)
+def predict_drug_topk(text: str, k: int = 5, allergies: str = None):
+    """Return the k most likely drugs with confidences from a single forward pass"""
+    return _top_k(_probabilities(text), k, allowed_mask(allergies))
@@ -0,0 +1,258 @@
+# bulk_score.py
+"""
+Offline bulk scoring of symptom datasets with the DistilBERT drug classifier.
+
+    python modules/bulk_score.py symptoms.csv scored.parquet --text-column symptoms --workers 4 --top-k 3
+
+The input (CSV or Parquet) is streamed in chunks, chunks are scored in a pool
+of worker processes, and results are written in input order as they finish.
+Progress is checkpointed after every chunk; rerunning the same command after
+an interruption resumes from the last completed chunk.
+"""
+import argparse
+import json
+import os
+import sys
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+
+
+# ---- Input ----
+def iter_chunks(input_path: Path, text_column: str, id_column: str, chunk_size: int):
+    """Yield (ids, texts) chunks without loading the whole file"""
+    suffix = input_path.suffix.lower()
+    if suffix == ".parquet":
+        import pyarrow.parquet as pq
+
+        columns = [text_column] + ([id_column] if id_column else [])
+        for batch in pq.ParquetFile(input_path).iter_batches(batch_size=chunk_size, columns=columns):
+            texts = batch.column(text_column).to_pylist()
+            ids = batch.column(id_column).to_pylist() if id_column else None
+            yield ids, texts
+    elif suffix in (".csv", ".tsv", ".txt"):
+        import pandas as pd
+
+        sep = "\t" if suffix == ".tsv" else ","
+        usecols = [text_column] + ([id_column] if id_column else [])
+        for frame in pd.read_csv(input_path, sep=sep, usecols=usecols, chunksize=chunk_size, dtype=str, keep_default_na=False):
+            ids = frame[id_column].tolist() if id_column else None
+            yield ids, frame[text_column].tolist()
+    else:
+        raise ValueError(f"Unsupported input format: {input_path.suffix} (use .csv, .tsv or .parquet)")
+
+
+# ---- Workers ----
+def _init_worker(threads_per_worker: int):
+    # One intra-op thread pool per process; processes, not threads, provide the parallelism
+    import torch
+
+    torch.set_num_threads(threads_per_worker)
+    import bert_model
+    bert_model.warmup()
+
+
+def _score_chunk(chunk_index: int, texts: list, top_k: int, batch_size: int):
+    import bert_model
+
+    texts = ["" if text is None else str(text) for text in texts]
+    results = []
+    for i in range(0, len(texts), batch_size):
+        results.extend(bert_model.predict_drugs_topk(texts[i:i + batch_size], k=top_k))
+    return chunk_index, results
+
+
+def _rows(chunk_start: int, ids, texts, results, top_k: int) -> dict:
+    """Column-oriented output for one chunk: id, text, drug_1..k, confidence_1..k"""
+    columns = {
+        "id": ids if ids is not None else list(range(chunk_start, chunk_start + len(texts))),
+        "text": texts,
+    }
+    for rank in range(top_k):
+        columns[f"drug_{rank + 1}"] = [preds[rank][0] if rank < len(preds) else None for preds in results]
+        columns[f"confidence_{rank + 1}"] = [preds[rank][1] if rank < len(preds) else None for preds in results]
+    return columns
+
+
+# ---- Output ----
+class ChunkWriter:
+    """
+    Incremental, resumable writer. CSV output is appended in place and
+    truncated back to the last checkpointed byte offset on resume; Parquet
+    output is written as one part file per chunk and merged at the end.
+    """
+
+    def __init__(self, output_path: Path, state: dict):
+        self.output_path = output_path
+        self.state = state
+        self.format = "parquet" if output_path.suffix.lower() == ".parquet" else "csv"
+        self.parts_dir = output_path.with_name(output_path.name + ".parts")
+        if self.format == "csv":
+            offset = state.get("csv_offset", 0)
+            if output_path.exists():
+                with open(output_path, "r+b") as f:
+                    f.truncate(offset)
+            elif offset:
+                raise RuntimeError(f"Checkpoint expects {output_path} to exist; delete the checkpoint to start over")
+        else:
+            self.parts_dir.mkdir(parents=True, exist_ok=True)
+
+    def write(self, chunk_index: int, columns: dict):
+        import pandas as pd
+
+        frame = pd.DataFrame(columns)
+        if self.format == "csv":
+            header = self.state.get("csv_offset", 0) == 0
+            with open(self.output_path, "a", newline="", encoding="utf-8") as f:
+                frame.to_csv(f, index=False, header=header)
+                f.flush()
+                os.fsync(f.fileno())
+                self.state["csv_offset"] = f.tell()
+        else:
+            part = self.parts_dir / f"part-{chunk_index:06d}.parquet"
+            tmp = part.with_suffix(".tmp")
+            frame.to_parquet(tmp, index=False)
+            tmp.replace(part)
+
+    def finish(self):
+        if self.format != "parquet":
+            return
+        import pyarrow.parquet as pq
+
+        parts = sorted(self.parts_dir.glob("part-*.parquet"))
+        tmp = self.output_path.with_name(self.output_path.name + ".tmp")
+        writer = None
+        try:
+            for part in parts:
+                # Stream part by part so memory stays at one chunk
+                table = pq.read_table(part)
+                if writer is None:
+                    writer = pq.ParquetWriter(tmp, table.schema)
+                writer.write_table(table)
+        finally:
+            if writer is not None:
+                writer.close()
+        if writer is not None:
+            tmp.replace(self.output_path)
+        for part in parts:
+            part.unlink()
+        self.parts_dir.rmdir()
+
+
+def _save_checkpoint(path: Path, state: dict):
+    tmp = path.with_name(path.name + ".tmp")
+    with open(tmp, "w") as f:
+        json.dump(state, f)
+        f.flush()
+        os.fsync(f.fileno())
+    tmp.replace(path)
+
+
+# ---- Driver ----
+def score_file(
+    input_path: Path,
+    output_path: Path,
+    text_column: str = "symptoms",
+    id_column: str = None,
+    chunk_size: int = 5000,
+    batch_size: int = 64,
+    top_k: int = 3,
+    workers: int = None,
+    threads_per_worker: int = 1,
+    checkpoint_path: Path = None,
+    log=print,
+):
+    input_path, output_path = Path(input_path), Path(output_path)
+    checkpoint_path = Path(checkpoint_path) if checkpoint_path else output_path.with_name(output_path.name + ".checkpoint.json")
+    workers = workers or os.cpu_count() or 1
+
+    settings = {"input": str(input_path.resolve()), "chunk_size": chunk_size, "top_k": top_k, "text_column": text_column}
+    state = {"settings": settings, "chunks_done": 0, "rows_done": 0}
+    if checkpoint_path.exists():
+        with open(checkpoint_path) as f:
+            saved = json.load(f)
+        if saved.get("settings") != settings:
+            raise RuntimeError(f"{checkpoint_path} was written with different settings; delete it to start over")
+        state = saved
+        log(f"Resuming after chunk {state['chunks_done']} ({state['rows_done']} rows)")
+
+    writer = ChunkWriter(output_path, state)
+    skip = state["chunks_done"]
+    max_in_flight = workers * 2
+    pending, finished = {}, {}
+    chunk_meta = {}
+    next_to_write = skip
+
+    def drain(block: bool):
+        nonlocal next_to_write
+        for index in list(pending):
+            future = pending[index]
+            if block or future.done():
+                if block and index != next_to_write:
+                    continue
+                _, results = future.result()
+                finished[index] = results
+                del pending[index]
+        # Write completed chunks strictly in input order
+        while next_to_write in finished:
+            ids, texts, row_start = chunk_meta.pop(next_to_write)
+            writer.write(next_to_write, _rows(row_start, ids, texts, finished.pop(next_to_write), top_k))
+            state["chunks_done"] = next_to_write + 1
+            state["rows_done"] = row_start + len(texts)
+            _save_checkpoint(checkpoint_path, state)
+            next_to_write += 1
+            log(f"Scored {state['rows_done']} rows")
+
+    with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker, initargs=(threads_per_worker,)) as pool:
+        row_start = 0
+        for index, (ids, texts) in enumerate(iter_chunks(input_path, text_column, id_column, chunk_size)):
+            if index < skip:
+                row_start += len(texts)
+                continue
+            chunk_meta[index] = (ids, texts, row_start)
+            pending[index] = pool.submit(_score_chunk, index, texts, top_k, batch_size)
+            row_start += len(texts)
+            # Bound memory: never hold more than max_in_flight chunks
+            while len(pending) + len(finished) >= max_in_flight:
+                drain(block=True)
+            drain(block=False)
+        while pending:
+            drain(block=True)
+        drain(block=False)
+
+    writer.finish()
+    checkpoint_path.unlink(missing_ok=True)
+    return state["rows_done"]
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Score a CSV/Parquet file of symptom texts with the drug classifier")
+    parser.add_argument("input", type=Path, help="input .csv, .tsv or .parquet file")
+    parser.add_argument("output", type=Path, help="output .csv or .parquet file")
+    parser.add_argument("--text-column", default="symptoms")
+    parser.add_argument("--id-column", default=None, help="column copied to the output as 'id' (default: row number)")
+    parser.add_argument("--chunk-size", type=int, default=5000, help="rows per chunk handed to a worker")
+    parser.add_argument("--batch-size", type=int, default=64, help="texts per forward pass")
+    parser.add_argument("--top-k", type=int, default=3)
+    parser.add_argument("--workers", type=int, default=None, help="worker processes (default: CPU count)")
+    parser.add_argument("--threads-per-worker", type=int, default=1)
+    parser.add_argument("--checkpoint", type=Path, default=None, help="default: <output>.checkpoint.json")
+    args = parser.parse_args(argv)
+
+    rows = score_file(
+        args.input,
+        args.output,
+        text_column=args.text_column,
+        id_column=args.id_column,
+        chunk_size=args.chunk_size,
+        batch_size=args.batch_size,
+        top_k=args.top_k,
+        workers=args.workers,
+        threads_per_worker=args.threads_per_worker,
+        checkpoint_path=args.checkpoint,
+        log=lambda message: print(message, file=sys.stderr),
+    )
+    print(f"Wrote {rows} scored rows to {args.output}", file=sys.stderr)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,164 @@
+# contraindications.py
+"""
+Allergy-aware filtering of classifier outputs.
+
+A ContraindicationIndex maps allergen terms to the label ids of the drugs
+they rule out, computed once from the label encoder's drug names. A user's
+free-text allergies are parsed into a boolean "allowed" mask over the label
+space (cached per normalized allergy text), and bert_model applies that mask
+to the probability vector before top-k selection.
+
+Terms match whole words (a trailing "s"/"es" allowed, so "statins" finds
+"statin"), never the inside of a word: "statin" does not rule out Nystatin
+and "sulfa" does not rule out magnesium sulfate. A term ending in "*" matches
+as a word prefix ("cef*" finds cefdinir).
+"""
+import json
+import os
+import re
+from pathlib import Path
+
+import numpy as np
+
+from knowledge_base import AhoCorasick
+from prediction_cache import PredictionCache, normalize_text
+
+CONTRAINDICATIONS_FILE = Path(os.environ.get(
+    "CONTRAINDICATIONS_FILE", Path(__file__).parent / "contraindications.json"
+))
+ALLERGY_MASK_CACHE_SIZE = int(os.environ.get("ALLERGY_MASK_CACHE_SIZE", "1024"))
+
+# Allergen class -> drug names (or "prefix*" stems) it rules out (lowercase).
+# Extended or overridden by CONTRAINDICATIONS_FILE when present.
+DEFAULT_ALLERGEN_CLASSES = {
+    "penicillin": ["penicillin", "amoxicillin", "ampicillin", "augmentin", "clavulan*", "cloxacillin", "dicloxacillin", "piperacillin"],
+    "cephalosporin": ["cef*", "ceph*"],
+    "sulfa": ["sulfa", "sulfonamide", "sulfamethoxazole", "sulfadiazine", "sulfasalazine", "bactrim", "septra"],
+    "nsaid": ["ibuprofen", "naproxen", "aspirin", "diclofenac", "ketorolac", "indomethacin", "meloxicam", "celecoxib", "piroxicam", "aceclofenac"],
+    "aspirin": ["aspirin", "acetylsalicylic"],
+    "paracetamol": ["paracetamol", "acetaminophen", "dolo", "calpol", "tylenol"],
+    "acetaminophen": ["paracetamol", "acetaminophen", "dolo", "calpol", "tylenol"],
+    "opioid": ["codeine", "morphine", "tramadol", "oxycodone", "hydrocodone", "fentanyl", "tapentadol"],
+    "codeine": ["codeine"],
+    "macrolide": ["erythromycin", "azithromycin", "clarithromycin"],
+    "tetracycline": ["tetracycline", "doxycycline", "minocycline"],
+    "fluoroquinolone": ["ciprofloxacin", "levofloxacin", "moxifloxacin", "ofloxacin", "norfloxacin"],
+    "statin": ["atorvastatin", "simvastatin", "rosuvastatin", "pravastatin", "lovastatin", "fluvastatin", "pitavastatin"],
+}
+
+# Separators in the free-text field: "Penicillin, sulfa; latex and peanuts"
+_SEPARATORS = re.compile(r"[,;/\n]+|\band\b", re.IGNORECASE)
+# Shorter drug names are not matched as free text (too many accidental hits)
+MIN_DRUG_NAME_LENGTH = 4
+
+
+def _normalize_term(term: str) -> str:
+    """normalize_text, keeping a trailing "*" (prefix match)"""
+    return normalize_text(term) + ("*" if term.strip().endswith("*") else "")
+
+
+def load_allergen_classes(path: Path = CONTRAINDICATIONS_FILE) -> dict:
+    classes = {key: list(values) for key, values in DEFAULT_ALLERGEN_CLASSES.items()}
+    if Path(path).exists():
+        with open(path, "r", encoding="utf-8") as f:
+            for key, values in json.load(f).items():
+                classes[normalize_text(key)] = [_normalize_term(v) for v in values]
+    return classes
+
+
+def parse_allergies(text: str) -> list:
+    """Normalized allergy entries from the free-text field ('None'/'nil' mean no allergies)"""
+    entries = [normalize_text(part) for part in _SEPARATORS.split(text or "")]
+    return [entry for entry in entries if entry and entry not in ("none", "nil", "no", "na", "n a", "no known allergies", "nka", "nkda")]
+
+
+class TermMatcher:
+    """
+    Whole-word term matcher: Aho-Corasick finds candidate terms in one pass,
+    then each candidate is confirmed at word boundaries.
+    """
+
+    def __init__(self, terms):
+        self._patterns = {}
+        self._by_stem = {}
+        for term in terms:
+            stem = term.rstrip("*")
+            if not stem:
+                continue
+            tail = "" if term.endswith("*") else r"(?:e?s)?(?!\w)"
+            self._patterns[term] = re.compile(r"(?<!\w)" + re.escape(stem) + tail)
+            self._by_stem.setdefault(stem, []).append(term)
+        self._matcher = AhoCorasick(self._by_stem)
+
+    def find(self, text: str) -> set:
+        """Set of terms occurring in `text` as whole words (or word prefixes for "stem*" terms)"""
+        return {
+            term
+            for stem in self._matcher.find(text)
+            for term in self._by_stem[stem]
+            if self._patterns[term].search(text)
+        }
+
+
+class ContraindicationIndex:
+    """
+    `drug_names[i]` is the drug for label id i. Every allergen term (class
+    name, class member fragment or drug name) is resolved to a label id array
+    up front, so turning an allergy profile into a mask is one Aho-Corasick
+    pass over the profile text plus a few array assignments.
+    """
+
+    def __init__(self, drug_names, allergen_classes: dict = None):
+        allergen_classes = allergen_classes if allergen_classes is not None else load_allergen_classes()
+        self.num_labels = len(drug_names)
+        names = [normalize_text(str(name)) for name in drug_names]
+
+        fragments = {fragment for members in allergen_classes.values() for fragment in members if fragment}
+        fragments.update(name for name in names if len(name) >= MIN_DRUG_NAME_LENGTH)
+
+        # One scan of each drug name finds every fragment it contains as a word
+        by_fragment = {}
+        fragment_matcher = TermMatcher(fragments)
+        for label_id, name in enumerate(names):
+            for fragment in fragment_matcher.find(name):
+                by_fragment.setdefault(fragment, []).append(label_id)
+
+        self.term_ids = {fragment: np.array(ids, dtype=np.int64) for fragment, ids in by_fragment.items()}
+        for allergen, members in allergen_classes.items():
+            ids = set(self.term_ids.get(allergen, ()))
+            for fragment in members:
+                ids.update(by_fragment.get(fragment, ()))
+            self.term_ids[allergen] = np.array(sorted(ids), dtype=np.int64)
+        self.matcher = TermMatcher(self.term_ids)
+        self._masks = PredictionCache(maxsize=ALLERGY_MASK_CACHE_SIZE, ttl_seconds=float("inf"))
+
+    def terms(self, allergies: str) -> set:
+        """Allergen terms mentioned in the profile text"""
+        found = set()
+        for entry in parse_allergies(allergies):
+            found.update(self.matcher.find(entry))
+        return found
+
+    def blocked_ids(self, allergies: str) -> np.ndarray:
+        ids = [self.term_ids[term] for term in self.terms(allergies)]
+        return np.unique(np.concatenate(ids)) if ids else np.empty(0, dtype=np.int64)
+
+    def allowed_mask(self, allergies: str):
+        """
+        Read-only boolean mask over label ids (False = contraindicated), or
+        None when the profile rules nothing out.
+        """
+        key = " , ".join(parse_allergies(allergies))
+        if not key:
+            return None
+        mask = self._masks.get(key, default=False)
+        if mask is False:
+            blocked = self.blocked_ids(allergies)
+            if len(blocked):
+                mask = np.ones(self.num_labels, dtype=bool)
+                mask[blocked] = False
+                mask.setflags(write=False)
+            else:
+                mask = None
+            self._masks.put(key, mask)
+        return mask
@@ -0,0 +1,340 @@
+# embedding_index.py
+"""
+Nearest-neighbour retrieval of similar past cases by symptom embedding.
+
+Historical symptom texts (feedback log and recommendation records) are
+embedded with bert_model.embed_texts and stored as one contiguous,
+L2-normalized matrix (float32, or int8 with a per-row scale), so cosine
+similarity is a plain matrix product. Saved indexes are memory-mapped on
+load, so the matrix costs no copy and is shared between processes.
+
+    python modules/embedding_index.py build --int8 --ivf
+
+Exact search scans the matrix in blocks; for large corpora an IVF index
+(k-means lists stored contiguously) restricts each query to the `nprobe`
+closest lists.
+"""
+import argparse
+import json
+import math
+import os
+from pathlib import Path
+
+import numpy as np
+
+import metrics
+from prediction_cache import normalize_text
+
+INDEX_DIR = Path(os.environ.get("EMBEDDING_INDEX_DIR", Path(__file__).parent / "embedding_index"))
+EMBEDDING_NPROBE = int(os.environ.get("EMBEDDING_NPROBE", "8"))
+# Rows scored per matrix product in exact search (bounds the temporary score matrix)
+SEARCH_BLOCK_ROWS = 65536
+
+VECTORS_FILENAME = "vectors.npy"
+SCALES_FILENAME = "scales.npy"
+RECORDS_FILENAME = "records.jsonl"
+IVF_FILENAME = "ivf.npz"
+
+
+def quantize_int8(vectors: np.ndarray) -> tuple:
+    """Symmetric per-row int8 quantization; returns (int8 matrix, float32 scales)"""
+    scales = np.abs(vectors).max(axis=1) / 127.0
+    scales[scales == 0] = 1.0
+    quantized = np.round(vectors / scales[:, None]).astype(np.int8)
+    return quantized, scales.astype(np.float32)
+
+
+def _normalize(vectors: np.ndarray) -> np.ndarray:
+    vectors = np.asarray(vectors, dtype=np.float32)
+    return vectors / np.maximum(np.linalg.norm(vectors, axis=1, keepdims=True), 1e-12)
+
+
+def _merge_topk(best_scores, best_ids, scores, ids, k):
+    """Keep the k highest of (best, new) per query row; neither side needs to be sorted"""
+    scores = np.concatenate([best_scores, scores], axis=1)
+    ids = np.concatenate([best_ids, ids], axis=1)
+    if scores.shape[1] <= k:
+        return scores, ids
+    top = np.argpartition(scores, -k, axis=1)[:, -k:]
+    return np.take_along_axis(scores, top, axis=1), np.take_along_axis(ids, top, axis=1)
+
+
+class EmbeddingIndex:
+    """
+    `vectors` is (n, dim) float32 or int8 (with `scales`), rows aligned with
+    `records` (dicts with symptoms/drug/source). Build with `from_vectors`,
+    persist with `save` and reopen with `load`.
+    """
+
+    def __init__(self, vectors: np.ndarray, records: list, scales: np.ndarray = None,
+                 centroids: np.ndarray = None, list_offsets: np.ndarray = None):
+        if len(vectors) != len(records):
+            raise ValueError(f"{len(vectors)} vectors but {len(records)} records")
+        if vectors.dtype == np.int8 and scales is None:
+            raise ValueError("int8 vectors need per-row scales")
+        self.vectors = vectors
+        self.records = records
+        self.scales = scales
+        self.centroids = centroids
+        self.list_offsets = list_offsets
+
+    @classmethod
+    def from_vectors(cls, vectors: np.ndarray, records: list, dtype: str = "float32"):
+        vectors = _normalize(vectors)
+        if dtype == "int8":
+            quantized, scales = quantize_int8(vectors)
+            return cls(quantized, records, scales)
+        return cls(np.ascontiguousarray(vectors), records)
+
+    def __len__(self):
+        return len(self.records)
+
+    @property
+    def dim(self) -> int:
+        return self.vectors.shape[1]
+
+    @property
+    def has_ivf(self) -> bool:
+        return self.centroids is not None
+
+    # ---- Scoring ----
+    def _scores(self, queries: np.ndarray, start: int, stop: int) -> np.ndarray:
+        block = self.vectors[start:stop]
+        if block.dtype == np.int8:
+            return (queries @ block.T.astype(np.float32)) * self.scales[start:stop]
+        return queries @ block.T
+
+    def _search_exact(self, queries: np.ndarray, k: int):
+        m = len(queries)
+        best_scores = np.empty((m, 0), dtype=np.float32)
+        best_ids = np.empty((m, 0), dtype=np.int64)
+        for start in range(0, len(self), SEARCH_BLOCK_ROWS):
+            stop = min(start + SEARCH_BLOCK_ROWS, len(self))
+            scores = self._scores(queries, start, stop)
+            if scores.shape[1] > k:
+                top = np.argpartition(scores, -k, axis=1)[:, -k:]
+                scores = np.take_along_axis(scores, top, axis=1)
+                ids = top + start
+            else:
+                ids = np.broadcast_to(np.arange(start, stop), scores.shape)
+            best_scores, best_ids = _merge_topk(best_scores, best_ids, scores, ids, k)
+        return best_scores, best_ids
+
+    def _search_ivf(self, queries: np.ndarray, k: int, nprobe: int):
+        nprobe = max(1, min(nprobe, len(self.centroids)))
+        centroid_scores = queries @ self.centroids.T
+        probes = np.argpartition(centroid_scores, -nprobe, axis=1)[:, -nprobe:]
+        results_scores, results_ids = [], []
+        for query, lists in zip(queries, probes):
+            scores, ids = [], []
+            for lst in lists:
+                start, stop = int(self.list_offsets[lst]), int(self.list_offsets[lst + 1])
+                if stop > start:
+                    scores.append(self._scores(query[None, :], start, stop)[0])
+                    ids.append(np.arange(start, stop))
+            scores = np.concatenate(scores) if scores else np.empty(0, dtype=np.float32)
+            ids = np.concatenate(ids) if ids else np.empty(0, dtype=np.int64)
+            if len(scores) > k:
+                top = np.argpartition(scores, -k)[-k:]
+                scores, ids = scores[top], ids[top]
+            results_scores.append(scores)
+            results_ids.append(ids)
+        return results_scores, results_ids
+
+    def search(self, queries: np.ndarray, k: int = 5, nprobe: int = EMBEDDING_NPROBE) -> list:
+        """
+        Top-k most similar records for each query vector, best first, as
+        lists of (cosine similarity, record). Uses the IVF lists when built.
+        """
+        queries = _normalize(np.atleast_2d(queries))
+        if not len(self) or k < 1:
+            return [[] for _ in queries]
+        k = min(k, len(self))
+        with metrics.timer("embedding_search_seconds", mode="ivf" if self.has_ivf else "exact"):
+            if self.has_ivf:
+                all_scores, all_ids = self._search_ivf(queries, k, nprobe)
+            else:
+                all_scores, all_ids = self._search_exact(queries, k)
+        results = []
+        for scores, ids in zip(all_scores, all_ids):
+            order = np.argsort(scores)[::-1]
+            results.append([(round(float(scores[i]), 4), self.records[int(ids[i])]) for i in order])
+        return results
+
+    # ---- IVF partitioning ----
+    def build_ivf(self, n_lists: int = None, iterations: int = 10, sample_size: int = None, seed: int = 0):
+        """
+        Spherical k-means over a sample of the vectors, then reorder vectors
+        and records so every list is one contiguous row range.
+        """
+        n = len(self)
+        n_lists = max(1, min(n_lists or int(math.sqrt(n)), n))
+        rng = np.random.default_rng(seed)
+        sample_size = min(n, sample_size or n_lists * 64)
+        sample = self._dense(np.sort(rng.choice(n, sample_size, replace=False)))
+        centroids = sample[rng.choice(sample_size, n_lists, replace=False)].copy()
+        for _ in range(iterations):
+            assignment = np.argmax(sample @ centroids.T, axis=1)
+            sums = np.zeros_like(centroids)
+            np.add.at(sums, assignment, sample)
+            empty = ~sums.any(axis=1)
+            # Re-seed empty lists from random sample rows
+            sums[empty] = sample[rng.choice(sample_size, int(empty.sum()))]
+            centroids = _normalize(sums)
+
+        assignment = np.empty(n, dtype=np.int64)
+        for start in range(0, n, SEARCH_BLOCK_ROWS):
+            stop = min(start + SEARCH_BLOCK_ROWS, n)
+            assignment[start:stop] = np.argmax(self._dense(slice(start, stop)) @ centroids.T, axis=1)
+        order = np.argsort(assignment, kind="stable")
+        self.vectors = np.ascontiguousarray(self.vectors[order])
+        if self.scales is not None:
+            self.scales = np.ascontiguousarray(self.scales[order])
+        self.records = [self.records[i] for i in order]
+        self.centroids = centroids.astype(np.float32)
+        self.list_offsets = np.searchsorted(assignment[order], np.arange(n_lists + 1)).astype(np.int64)
+        return self
+
+    def _dense(self, rows) -> np.ndarray:
+        block = self.vectors[rows]
+        if block.dtype == np.int8:
+            return _normalize(block.astype(np.float32) * self.scales[rows][:, None])
+        return np.asarray(block, dtype=np.float32)
+
+    # ---- Persistence ----
+    def save(self, directory: Path = INDEX_DIR) -> Path:
+        directory = Path(directory)
+        directory.mkdir(parents=True, exist_ok=True)
+        np.save(directory / VECTORS_FILENAME, self.vectors)
+        if self.scales is not None:
+            np.save(directory / SCALES_FILENAME, self.scales)
+        elif (directory / SCALES_FILENAME).exists():
+            (directory / SCALES_FILENAME).unlink()
+        if self.has_ivf:
+            np.savez(directory / IVF_FILENAME, centroids=self.centroids, list_offsets=self.list_offsets)
+        elif (directory / IVF_FILENAME).exists():
+            (directory / IVF_FILENAME).unlink()
+        tmp = directory / (RECORDS_FILENAME + ".tmp")
+        with open(tmp, "w", encoding="utf-8") as f:
+            for record in self.records:
+                f.write(json.dumps(record, ensure_ascii=False) + "\n")
+        os.replace(tmp, directory / RECORDS_FILENAME)
+        return directory
+
+    @classmethod
+    def load(cls, directory: Path = INDEX_DIR, mmap: bool = True):
+        """Open a saved index; with mmap=True the matrix is a read-only view of the file"""
+        directory = Path(directory)
+        mode = "r" if mmap else None
+        vectors = np.load(directory / VECTORS_FILENAME, mmap_mode=mode)
+        scales_path = directory / SCALES_FILENAME
+        scales = np.load(scales_path) if scales_path.exists() else None
+        with open(directory / RECORDS_FILENAME, encoding="utf-8") as f:
+            records = [json.loads(line) for line in f if line.strip()]
+        centroids = list_offsets = None
+        if (directory / IVF_FILENAME).exists():
+            with np.load(directory / IVF_FILENAME) as ivf:
+                centroids, list_offsets = ivf["centroids"], ivf["list_offsets"]
+        return cls(vectors, records, scales, centroids, list_offsets)
+
+
+# ---- Building from history ----
+def iter_history(feedback_entries, recommendation_docs):
+    """Unique (symptoms, drug) records from feedback log entries and recommendation documents"""
+    seen = set()
+    for source, docs in (("feedback", feedback_entries), ("recommendation", recommendation_docs)):
+        for doc in docs:
+            symptoms = (doc.get("symptoms") or "").strip()
+            drug = doc.get("recommended_drug") or doc.get("predicted_drug")
+            key = (normalize_text(symptoms), drug)
+            if not symptoms or not drug or key in seen:
+                continue
+            seen.add(key)
+            yield {"symptoms": symptoms, "drug": drug, "source": source}
+
+
+def build_index(records, embed_fn=None, batch_size: int = 256, dtype: str = "float32") -> EmbeddingIndex:
+    """
+    Embed records in batches of `batch_size`. With dtype="int8" each batch is
+    quantized as it arrives, so peak memory is the int8 matrix plus one batch.
+    """
+    if embed_fn is None:
+        from bert_model import embed_texts as embed_fn
+
+    kept, chunks, scale_chunks, batch = [], [], [], []
+
+    def flush():
+        vectors = _normalize(embed_fn([record["symptoms"] for record in batch]))
+        if dtype == "int8":
+            vectors, scales = quantize_int8(vectors)
+            scale_chunks.append(scales)
+        chunks.append(vectors)
+        kept.extend(batch)
+        batch.clear()
+
+    for record in records:
+        batch.append(record)
+        if len(batch) >= batch_size:
+            flush()
+    if batch:
+        flush()
+    if not chunks:
+        raise ValueError("No historical symptom texts to index")
+    vectors = np.concatenate(chunks)
+    scales = np.concatenate(scale_chunks) if scale_chunks else None
+    return EmbeddingIndex(vectors, kept, scales)
+
+
+# ---- Default index for the app ----
+_index = None
+
+
+def get_index():
+    """The saved index at INDEX_DIR (memory-mapped, loaded once), or None if it was never built"""
+    global _index
+    if _index is None and (INDEX_DIR / VECTORS_FILENAME).exists():
+        _index = EmbeddingIndex.load(INDEX_DIR)
+    return _index
+
+
+def similar_cases(text: str, k: int = 5) -> list:
+    """(similarity, record) for the k past cases closest to `text`; empty when no index is built"""
+    index = get_index()
+    if index is None:
+        return []
+    from bert_model import embed_texts
+
+    return index.search(embed_texts([text]), k)[0]
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Build the symptom embedding index from feedback and recommendation history")
+    parser.add_argument("command", choices=["build"])
+    parser.add_argument("--output", type=Path, default=INDEX_DIR)
+    parser.add_argument("--int8", action="store_true", help="store int8 vectors with per-row scales (4x smaller)")
+    parser.add_argument("--ivf", action="store_true", help="partition into k-means lists for large corpora")
+    parser.add_argument("--lists", type=int, default=None, help="IVF list count (default sqrt(n))")
+    parser.add_argument("--batch-size", type=int, default=256)
+    parser.add_argument("--no-mongo", action="store_true", help="index the feedback log only")
+    args = parser.parse_args(argv)
+
+    from feedback import iter_feedback
+
+    recommendations = ()
+    if not args.no_mongo:
+        from mongodb_utils import get_recommendations_collection
+
+        recommendations = get_recommendations_collection().find(
+            {}, {"_id": 0, "symptoms": 1, "predicted_drug": 1}, batch_size=1000
+        )
+    records = iter_history(iter_feedback(), recommendations)
+    index = build_index(records, batch_size=args.batch_size, dtype="int8" if args.int8 else "float32")
+    if args.ivf:
+        index.build_ivf(args.lists)
+    index.save(args.output)
+    print(f"Indexed {len(index)} cases ({index.vectors.dtype}, dim {index.dim}"
+          f"{f', {len(index.centroids)} IVF lists' if index.has_ivf else ''}) into {args.output}")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,16 +1,26 @@
 # feedback.py
-import json
+import threading
+import uuid
 from pathlib import Path
 from datetime import datetime
 
-# Path to store feedback data
+from feedback_analytics import FeedbackAggregator
+from feedback_store import FeedbackLog, migrate_json_array
+from knowledge_base import KnowledgeBase
+from persistence import writer, atomic_write_json
+
+# Path to store feedback data (append-only JSONL, rotated into numbered segments)
 BASE_DIR = Path(__file__).parent
-FEEDBACK_FILE = BASE_DIR / "feedback_log.json"
+FEEDBACK_FILE = BASE_DIR / "feedback_log.jsonl"
+LEGACY_FEEDBACK_FILE = BASE_DIR / "feedback_log.json"
+
+feedback_log = FeedbackLog(FEEDBACK_FILE)
+# Close (and fsync) again once the writer has drained at shutdown
+writer.on_shutdown(feedback_log.close)
 
-# Initialize feedback file if it doesn't exist
-if not FEEDBACK_FILE.exists():
-    with open(FEEDBACK_FILE, "w") as f:
-        json.dump([], f, indent=4)
+# Move entries from the old JSON-array file into the log (runs once)
+if LEGACY_FEEDBACK_FILE.exists():
+    migrate_json_array(LEGACY_FEEDBACK_FILE, feedback_log)
 
 
 def update_feedback(
@@ -35,6 +45,8 @@ def update_feedback(
         is_compatible (bool, optional): Compatibility result for image input.
     """
     feedback_entry = {
+        # Unique per entry, so an analytics rebuild can tell logged entries from its replay tail
+        "id": uuid.uuid4().hex,
         "timestamp": str(datetime.now()),
         "user_id": user_id,
         "symptoms": symptoms,
@@ -45,21 +57,24 @@ def update_feedback(
         "is_compatible": is_compatible
     }
 
-    # Load existing feedback
-    with open(FEEDBACK_FILE, "r") as f:
-        feedback_data = json.load(f)
-
-    # Append new feedback
-    feedback_data.append(feedback_entry)
-
-    # Save updated feedback
-    with open(FEEDBACK_FILE, "w") as f:
-        json.dump(feedback_data, f, indent=4)
+    # Append new feedback on the background writer (constant cost, no disk I/O here)
+    with _analytics_lock:
+        writer.append(FEEDBACK_FILE, feedback_entry, feedback_log.append_many)
+        if _analytics_ready:
+            feedback_analytics.add(feedback_entry)
+        elif _analytics_tail is not None:
+            _analytics_tail.append(feedback_entry)
+            _analytics_tail_ids.add(feedback_entry["id"])
 
     # Optionally, improve drug-symptom knowledge
     _update_knowledge_base(symptoms, recommended_drug, rating, is_compatible)
 
 
+def iter_feedback():
+    """Stream all logged feedback entries, oldest first"""
+    return feedback_log.iter_entries()
+
+
 # ---- Internal function for simple reinforcement ----
 KNOWN_DRUGS_FILE = BASE_DIR / "known_drugs.json"
 
@@ -73,8 +88,13 @@ if not KNOWN_DRUGS_FILE.exists():
         "inflammation": ["Ibuprofen", "Naproxen"],
         "allergy": ["Loratadine", "Cetirizine"]
     }
-    with open(KNOWN_DRUGS_FILE, "w") as f:
-        json.dump(known_drugs, f, indent=4)
+    atomic_write_json(KNOWN_DRUGS_FILE, known_drugs)
+
+
+# Resident knowledge base; disk is updated by periodic snapshots, not per feedback
+KNOWLEDGE_SNAPSHOT_INTERVAL = 30.0
+knowledge_base = KnowledgeBase.load(KNOWN_DRUGS_FILE)
+knowledge_base.start_periodic_snapshots(KNOWLEDGE_SNAPSHOT_INTERVAL, writer=writer)
 
 
 def _update_knowledge_base(symptoms, recommended_drug, rating, is_compatible):
@@ -83,21 +103,64 @@ def _update_knowledge_base(symptoms, recommended_drug, rating, is_compatible):
     - Positive feedback (rating >=4) → add drug to matching symptoms
     - Negative feedback (rating <=2) → optionally remove or flag drug
     """
-    with open(KNOWN_DRUGS_FILE, "r") as f:
-        known_drugs = json.load(f)
-
-    symptoms_lower = symptoms.lower()
-
-    for condition in known_drugs.keys():
-        if condition in symptoms_lower:
-            if rating >= 4:
-                if recommended_drug not in known_drugs[condition]:
-                    known_drugs[condition].append(recommended_drug)
-            elif rating <= 2:
-                if recommended_drug in known_drugs[condition]:
-                    # Optional: flag instead of removing
-                    known_drugs[condition].remove(recommended_drug)
-
-    # Save updated knowledge
-    with open(KNOWN_DRUGS_FILE, "w") as f:
-        json.dump(known_drugs, f, indent=4)
+    knowledge_base.apply_feedback(symptoms, recommended_drug, rating)
+
+
+def save_knowledge_base(force: bool = False):
+    """Explicitly snapshot the knowledge base to KNOWN_DRUGS_FILE"""
+    return knowledge_base.snapshot(force=force)
+
+
+def flush_feedback(timeout: float = None) -> bool:
+    """Wait until queued feedback and knowledge-base writes are on disk"""
+    return writer.flush(timeout=timeout)
+
+
+# ---- Feedback analytics (per condition, drug and input type) ----
+ANALYTICS_FLUSH_TIMEOUT = 5.0
+feedback_analytics = FeedbackAggregator(knowledge_base.match_conditions)
+_analytics_ready = False
+_analytics_lock = threading.Lock()
+_analytics_rebuild_lock = threading.Lock()
+# Feedback logged while a rebuild runs; replayed once it finishes
+_analytics_tail = None
+_analytics_tail_ids = set()
+
+
+def get_feedback_analytics() -> FeedbackAggregator:
+    """
+    Running per-(condition, drug, input_type) statistics. Rebuilt from the log
+    in one streaming pass on first use, then kept current by update_feedback.
+
+    The rebuild runs outside _analytics_lock, so feedback keeps being
+    accepted meanwhile: new entries are collected in a tail, skipped when
+    read back from the log and replayed under the lock at the end. Waiting
+    for queued writes is bounded by ANALYTICS_FLUSH_TIMEOUT.
+    """
+    global _analytics_ready, _analytics_tail
+    if _analytics_ready:
+        return feedback_analytics
+    with _analytics_rebuild_lock:
+        if _analytics_ready:
+            return feedback_analytics
+        with _analytics_lock:
+            _analytics_tail = []
+            _analytics_tail_ids.clear()
+        # Entries queued before the tail started are written by now (unless the timeout passed)
+        writer.flush(timeout=ANALYTICS_FLUSH_TIMEOUT)
+        feedback_analytics.rebuild(
+            entry for entry in feedback_log.iter_entries() if entry.get("id") not in _analytics_tail_ids
+        )
+        with _analytics_lock:
+            for entry in _analytics_tail:
+                feedback_analytics.add(entry)
+            _analytics_tail = None
+            _analytics_tail_ids.clear()
+            _analytics_ready = True
+    return feedback_analytics
+
+
+def feedback_totals() -> dict:
+    """{"rated": n, "positive": n} over all feedback (positive = rating >= 4)"""
+    totals = get_feedback_analytics().totals()
+    return {"rated": totals["rated"], "positive": totals["positive"]}
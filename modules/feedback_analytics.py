@@ -0,0 +1,118 @@
+# feedback_analytics.py
+"""
+Incremental per-(condition, drug, input_type) feedback statistics.
+
+Every event updates the exact key and all of its wildcard roll-ups ("*" in
+any position), so a query for one drug, one condition, or the overall total
+is a single dict lookup instead of a scan of the feedback log.
+"""
+import threading
+from itertools import product
+
+ANY = "*"
+UNMATCHED = "(unmatched)"
+
+
+class FeedbackStats:
+    __slots__ = ("count", "rating_count", "rating_sum", "positive", "negative", "compat_checks", "compatible", "last_timestamp")
+
+    def __init__(self):
+        self.count = 0
+        self.rating_count = 0
+        self.rating_sum = 0.0
+        self.positive = 0
+        self.negative = 0
+        self.compat_checks = 0
+        self.compatible = 0
+        self.last_timestamp = None
+
+    def add(self, rating, is_compatible, timestamp):
+        self.count += 1
+        if isinstance(rating, (int, float)):
+            self.rating_count += 1
+            self.rating_sum += rating
+            if rating >= 4:
+                self.positive += 1
+            elif rating <= 2:
+                self.negative += 1
+        if is_compatible is not None:
+            self.compat_checks += 1
+            self.compatible += bool(is_compatible)
+        if timestamp is not None and (self.last_timestamp is None or timestamp > self.last_timestamp):
+            self.last_timestamp = timestamp
+
+    def as_dict(self) -> dict:
+        return {
+            "count": self.count,
+            "avg_rating": round(self.rating_sum / self.rating_count, 3) if self.rating_count else None,
+            "rated": self.rating_count,
+            "positive": self.positive,
+            "negative": self.negative,
+            "compatibility_rate": round(self.compatible / self.compat_checks, 3) if self.compat_checks else None,
+            "compatibility_checks": self.compat_checks,
+            "last_timestamp": self.last_timestamp,
+        }
+
+
+class FeedbackAggregator:
+    """
+    `condition_fn(symptoms)` maps symptom text to condition names (the
+    knowledge base matcher); feedback that matches none is filed under
+    "(unmatched)".
+    """
+
+    def __init__(self, condition_fn):
+        self.condition_fn = condition_fn
+        self._stats = {}
+        self._drugs_by_condition = {}
+        self._all_drugs = set()
+        self._lock = threading.Lock()
+
+    def add(self, entry: dict):
+        conditions = self.condition_fn(entry.get("symptoms") or "") or [UNMATCHED]
+        drug = entry.get("recommended_drug")
+        input_type = entry.get("input_type") or "text"
+        with self._lock:
+            # The total and per-drug / per-input-type roll-ups count each event once,
+            # even when the symptoms mention several conditions
+            seen = set()
+            self._all_drugs.add(drug)
+            for condition in conditions:
+                self._drugs_by_condition.setdefault(condition, set()).add(drug)
+                for key in product((condition, ANY), (drug, ANY), (input_type, ANY)):
+                    if key in seen:
+                        continue
+                    seen.add(key)
+                    stats = self._stats.get(key)
+                    if stats is None:
+                        stats = self._stats[key] = FeedbackStats()
+                    stats.add(entry.get("rating"), entry.get("is_compatible"), entry.get("timestamp"))
+
+    def rebuild(self, entries):
+        """Reset and rebuild from an iterable of log entries in one streaming pass"""
+        with self._lock:
+            self._stats.clear()
+            self._drugs_by_condition.clear()
+            self._all_drugs.clear()
+        for entry in entries:
+            self.add(entry)
+
+    # ---- Queries (O(1) lookups) ----
+    def get(self, condition: str = ANY, drug: str = ANY, input_type: str = ANY) -> dict:
+        with self._lock:
+            stats = self._stats.get((condition, drug, input_type))
+            return (stats or FeedbackStats()).as_dict()
+
+    def totals(self) -> dict:
+        return self.get()
+
+    def conditions(self) -> list:
+        with self._lock:
+            return sorted(self._drugs_by_condition)
+
+    def table(self, condition: str = ANY, input_type: str = ANY) -> list:
+        """Rows for the admin dashboard, one per drug under `condition`/`input_type`, most feedback first"""
+        with self._lock:
+            drugs = list(self._all_drugs if condition == ANY else self._drugs_by_condition.get(condition, ()))
+        rows = [{"condition": condition, "drug": drug, "input_type": input_type, **self.get(condition, drug, input_type)} for drug in drugs]
+        return sorted((row for row in rows if row["count"]), key=lambda row: row["count"], reverse=True)
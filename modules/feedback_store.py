@@ -0,0 +1,189 @@
+# feedback_store.py
+"""
+Append-only, line-delimited (JSONL) feedback log with batched fsync and
+size-based segment rotation.
+
+The active segment is `<name>.jsonl`; full segments are renamed to
+`<name>.000001.jsonl`, `<name>.000002.jsonl`, ... and never touched again.
+Entries migrated from the legacy JSON-array file form segment `<name>.000000.jsonl`.
+"""
+import atexit
+import json
+import logging
+import os
+import threading
+import time
+from pathlib import Path
+
+import metrics
+from persistence import file_lock
+
+logger = logging.getLogger("drug_recommender.feedback_store")
+
+
+class FeedbackLog:
+    def __init__(
+        self,
+        path: Path,
+        max_segment_bytes: int = 64 * 1024 * 1024,
+        fsync_every: int = 64,
+        fsync_interval: float = 1.0,
+    ):
+        self.path = Path(path)
+        self.max_segment_bytes = max_segment_bytes
+        self.fsync_every = fsync_every
+        self.fsync_interval = fsync_interval
+        self._lock = threading.Lock()
+        self._fd = None
+        self._size = 0
+        self._unsynced = 0
+        self._last_sync = time.monotonic()
+        self._timer = None
+        atexit.register(self.close)
+
+    # ---- Writing ----
+    def _open(self):
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        # O_APPEND makes each single-line write land atomically at the end,
+        # even with several processes appending to the same segment
+        self._fd = os.open(self.path, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+        self._size = os.fstat(self._fd).st_size
+
+    def _sync(self):
+        if self._fd is not None and self._unsynced:
+            os.fsync(self._fd)
+        self._unsynced = 0
+        self._last_sync = time.monotonic()
+
+    def _schedule_sync(self):
+        # Entries short of `fsync_every` still reach disk within `fsync_interval` once appends stop
+        if self._timer is None:
+            self._timer = threading.Timer(self.fsync_interval, self._timed_sync)
+            self._timer.daemon = True
+            self._timer.start()
+
+    def _timed_sync(self):
+        with self._lock:
+            self._timer = None
+            self._sync()
+
+    def _rotate(self):
+        self._sync()
+        os.close(self._fd)
+        self._fd = None
+        segments = self.rotated_segments()
+        next_index = int(segments[-1].name.split(".")[-2]) + 1 if segments else 1
+        self.path.rename(self._segment_path(next_index))
+        self._open()
+
+    def _segment_path(self, index: int) -> Path:
+        return self.path.with_name(f"{self.path.stem}.{index:06d}{self.path.suffix}")
+
+    def append(self, entry: dict):
+        """Append one entry; fsync happens every `fsync_every` entries or `fsync_interval` seconds"""
+        self.append_many([entry])
+
+    def append_many(self, entries):
+        data = "".join(json.dumps(entry, default=str) + "\n" for entry in entries).encode("utf-8")
+        if not data:
+            return
+        with self._lock, file_lock(self.path), metrics.timer("feedback_write_seconds"):
+            if self._fd is None:
+                self._open()
+            elif not self.path.exists() or os.fstat(self._fd).st_ino != os.stat(self.path).st_ino:
+                # Another process rotated the segment under us; reopen the new active file
+                os.close(self._fd)
+                self._open()
+            self._size = os.fstat(self._fd).st_size
+            if self._size and self._size + len(data) > self.max_segment_bytes:
+                self._rotate()
+            os.write(self._fd, data)
+            self._size += len(data)
+            self._unsynced += data.count(b"\n")
+            if self._unsynced >= self.fsync_every or time.monotonic() - self._last_sync >= self.fsync_interval:
+                self._sync()
+            if self._unsynced:
+                self._schedule_sync()
+        metrics.inc("feedback_entries_written_total", data.count(b"\n"))
+
+    def flush(self):
+        """Force pending entries to stable storage"""
+        with self._lock:
+            self._sync()
+
+    def close(self):
+        with self._lock:
+            if self._timer is not None:
+                self._timer.cancel()
+                self._timer = None
+            if self._fd is not None:
+                self._sync()
+                os.close(self._fd)
+                self._fd = None
+
+    # ---- Reading ----
+    def rotated_segments(self) -> list[Path]:
+        pattern = f"{self.path.stem}.[0-9][0-9][0-9][0-9][0-9][0-9]{self.path.suffix}"
+        return sorted(self.path.parent.glob(pattern))
+
+    def segments(self) -> list[Path]:
+        """All segments, oldest first"""
+        segments = self.rotated_segments()
+        if self.path.exists():
+            segments.append(self.path)
+        return segments
+
+    def iter_entries(self):
+        """Stream entries oldest first without loading the log into memory"""
+        for segment in self.segments():
+            with open(segment, "r", encoding="utf-8") as f:
+                for line in f:
+                    line = line.strip()
+                    if not line:
+                        continue
+                    try:
+                        yield json.loads(line)
+                    except json.JSONDecodeError:
+                        # A torn final line from a crash mid-write; skip it
+                        continue
+
+
+def migrate_json_array(json_path: Path, log: FeedbackLog) -> int:
+    """
+    One-time migration of a legacy JSON-array feedback file into `log`.
+
+    The entries are written to a temp file and renamed into place as segment
+    000000 (older than any rotated segment), then the legacy file is renamed
+    to `<name>.migrated`. Both steps run under the legacy file's lock and the
+    first is skipped when segment 000000 already exists, so a crash between
+    them or several processes starting at once never duplicate entries. A
+    legacy file that is not a valid JSON array is left in place and logged.
+    Returns the number of migrated entries.
+    """
+    json_path = Path(json_path)
+    with file_lock(json_path):
+        if not json_path.exists():
+            # Nothing to do, or another process migrated it while we waited
+            return 0
+        segment = log._segment_path(0)
+        count = 0
+        if not segment.exists():
+            with open(json_path, "r", encoding="utf-8") as f:
+                try:
+                    entries = json.load(f)
+                except json.JSONDecodeError:
+                    entries = None
+            if not isinstance(entries, list):
+                logger.error("Legacy feedback file %s is not a valid JSON array; left in place, not migrated", json_path)
+                return 0
+            segment.parent.mkdir(parents=True, exist_ok=True)
+            tmp_path = segment.with_name(f".{segment.name}.tmp")
+            with open(tmp_path, "w", encoding="utf-8") as f:
+                for entry in entries:
+                    f.write(json.dumps(entry, default=str) + "\n")
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(tmp_path, segment)
+            count = len(entries)
+        json_path.rename(json_path.with_name(json_path.name + ".migrated"))
+    return count
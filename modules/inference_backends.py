@@ -0,0 +1,150 @@
+# inference_backends.py
+"""
+Pluggable CPU inference backends for the DistilBERT drug classifier.
+
+Every backend takes numpy `input_ids` / `attention_mask` arrays and returns
+numpy logits, so bert_model does not care which runtime is behind it.
+"""
+import hashlib
+from pathlib import Path
+
+import numpy as np
+
+BACKENDS = ("torch", "int8", "onnx")
+ONNX_FILENAME = "model.onnx"
+# Sidecar next to model.onnx recording which weights it was exported from
+ONNX_SOURCE_FILENAME = "model.onnx.source"
+
+
+class TorchBackend:
+    """Eager fp32 PyTorch model (the original path)"""
+
+    name = "torch"
+
+    def __init__(self, model):
+        self.model = model
+
+    def logits(self, input_ids: np.ndarray, attention_mask: np.ndarray) -> np.ndarray:
+        import torch
+
+        with torch.no_grad():
+            outputs = self.model(
+                input_ids=torch.from_numpy(input_ids),
+                attention_mask=torch.from_numpy(attention_mask),
+            )
+        return outputs.logits.numpy()
+
+    def embeddings(self, input_ids: np.ndarray, attention_mask: np.ndarray) -> np.ndarray:
+        """Pooled sentence vectors: the [CLS] hidden state through pre_classifier + ReLU, as the classifier sees it"""
+        import torch
+
+        with torch.no_grad():
+            hidden = self.model.distilbert(
+                input_ids=torch.from_numpy(input_ids),
+                attention_mask=torch.from_numpy(attention_mask),
+            ).last_hidden_state
+            pooled = torch.relu(self.model.pre_classifier(hidden[:, 0]))
+        return pooled.numpy()
+
+
+class QuantizedTorchBackend(TorchBackend):
+    """Dynamic int8 quantization of the Linear layers; activations stay fp32"""
+
+    name = "int8"
+
+    def __init__(self, model):
+        import torch
+
+        quantized = torch.quantization.quantize_dynamic(model, {torch.nn.Linear}, dtype=torch.qint8)
+        quantized.eval()
+        super().__init__(quantized)
+
+
+class OnnxBackend:
+    """
+    Exported ONNX graph executed with onnxruntime.
+
+    model.onnx is (re-)exported when it is missing or, given a
+    `source_fingerprint` of the weights, when it was exported from different
+    weights. `load_model` is only called in that case, so serving an
+    up-to-date export never loads the fp32 torch model.
+    """
+
+    name = "onnx"
+
+    def __init__(self, model_dir: Path, model=None, num_threads: int = 0, load_model=None, source_fingerprint=None):
+        import onnxruntime as ort
+
+        self.onnx_path = Path(model_dir) / ONNX_FILENAME
+        source_path = Path(model_dir) / ONNX_SOURCE_FILENAME
+        source = None if source_fingerprint is None else hashlib.sha1(repr(source_fingerprint).encode("utf-8")).hexdigest()
+        stale = source is not None and (not source_path.exists() or source_path.read_text().strip() != source)
+        if stale or not self.onnx_path.exists():
+            if model is None and load_model is not None:
+                model = load_model()
+            if model is None:
+                raise FileNotFoundError(f"{self.onnx_path} missing or out of date and no model given to export")
+            export_onnx(model, self.onnx_path)
+            if source is not None:
+                source_path.write_text(source)
+
+        options = ort.SessionOptions()
+        options.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+        if num_threads:
+            options.intra_op_num_threads = num_threads
+        self.session = ort.InferenceSession(
+            str(self.onnx_path), sess_options=options, providers=["CPUExecutionProvider"]
+        )
+
+    def logits(self, input_ids: np.ndarray, attention_mask: np.ndarray) -> np.ndarray:
+        (logits,) = self.session.run(
+            ["logits"],
+            {"input_ids": input_ids.astype(np.int64), "attention_mask": attention_mask.astype(np.int64)},
+        )
+        return logits
+
+
+def export_onnx(model, onnx_path: Path, opset: int = 14):
+    """Export a DistilBertForSequenceClassification model with dynamic batch/sequence axes"""
+    import torch
+
+    dummy_ids = torch.ones((1, 8), dtype=torch.long)
+    dummy_mask = torch.ones((1, 8), dtype=torch.long)
+    tmp_path = Path(onnx_path).with_suffix(".onnx.tmp")
+    with torch.no_grad():
+        torch.onnx.export(
+            model,
+            (dummy_ids, dummy_mask),
+            str(tmp_path),
+            input_names=["input_ids", "attention_mask"],
+            output_names=["logits"],
+            dynamic_axes={
+                "input_ids": {0: "batch", 1: "sequence"},
+                "attention_mask": {0: "batch", 1: "sequence"},
+                "logits": {0: "batch"},
+            },
+            opset_version=opset,
+        )
+    tmp_path.replace(onnx_path)
+    return onnx_path
+
+
+def create_backend(name: str, load_model, model_dir: Path, source_fingerprint=None):
+    """
+    Build the backend called `name`; `load_model()` returns the fp32 model and
+    is only called when the backend needs it.
+    """
+    if name == "torch":
+        return TorchBackend(load_model())
+    if name == "int8":
+        return QuantizedTorchBackend(load_model())
+    if name == "onnx":
+        return OnnxBackend(model_dir, load_model=load_model, source_fingerprint=source_fingerprint)
+    raise ValueError(f"Unknown inference backend {name!r}; expected one of {BACKENDS}")
+
+
+def top1_agreement(reference_logits: np.ndarray, candidate_logits: np.ndarray) -> float:
+    """Fraction of rows where both logit matrices pick the same label"""
+    if len(reference_logits) == 0:
+        return 1.0
+    return float(np.mean(reference_logits.argmax(axis=1) == candidate_logits.argmax(axis=1)))
@@ -0,0 +1,118 @@
+# inference_client.py
+"""
+Client for inference_server.py, used by the UI instead of importing the model.
+
+When INFERENCE_SERVER_URL is set (e.g. http://127.0.0.1:8601) predictions go
+to the server over keep-alive HTTP connections; otherwise they fall back to
+running bert_model in-process, so development setups keep working.
+"""
+import http.client
+import json
+import os
+import socket
+import threading
+from urllib.parse import urlparse
+
+INFERENCE_SERVER_URL = os.environ.get("INFERENCE_SERVER_URL", "")
+INFERENCE_TIMEOUT_SECONDS = float(os.environ.get("INFERENCE_TIMEOUT_SECONDS", "10"))
+
+
+class InferenceError(Exception):
+    pass
+
+
+class InferenceClient:
+    def __init__(self, base_url: str, timeout: float = INFERENCE_TIMEOUT_SECONDS):
+        parsed = urlparse(base_url)
+        self.host = parsed.hostname
+        self.port = parsed.port or (443 if parsed.scheme == "https" else 80)
+        self.https = parsed.scheme == "https"
+        self.timeout = timeout
+        # One persistent connection per thread (Streamlit runs sessions in threads)
+        self._local = threading.local()
+        self._model_version = None
+
+    def _connection(self):
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            cls = http.client.HTTPSConnection if self.https else http.client.HTTPConnection
+            conn = self._local.conn = cls(self.host, self.port, timeout=self.timeout)
+        return conn
+
+    def _request(self, method: str, path: str, payload=None):
+        body = json.dumps(payload).encode("utf-8") if payload is not None else None
+        headers = {"Content-Type": "application/json"} if body is not None else {}
+        for attempt in range(2):
+            conn = self._connection()
+            try:
+                conn.request(method, path, body=body, headers=headers)
+                response = conn.getresponse()
+                raw = response.read()
+                break
+            except socket.timeout as e:
+                # The server may still be working on it; retrying would only double the wait
+                conn.close()
+                self._local.conn = None
+                raise InferenceError(f"Inference server timed out after {self.timeout}s") from e
+            except (ConnectionError, http.client.HTTPException, OSError) as e:
+                # Stale keep-alive connection: reconnect once, then give up
+                conn.close()
+                self._local.conn = None
+                if attempt:
+                    raise InferenceError(f"Inference server unreachable: {e}") from e
+        try:
+            data = json.loads(raw or b"{}")
+        except ValueError as e:
+            # e.g. an HTML error page from a proxy in front of the server
+            raise InferenceError(f"Invalid response from inference server (HTTP {response.status})") from e
+        if not isinstance(data, dict):
+            raise InferenceError(f"Invalid response from inference server (HTTP {response.status})")
+        if response.status != 200:
+            raise InferenceError(data.get("error", f"HTTP {response.status}"))
+        return data
+
+    def health(self) -> dict:
+        return self._request("GET", "/health")
+
+    def predict_drug(self, text: str, allergies: str = None):
+        data = self._request("POST", "/predict", {"text": text, "allergies": allergies})
+        return data["drug"], data["confidence"]
+
+    def predict_drug_topk(self, text: str, k: int = 5, allergies: str = None):
+        data = self._request("POST", "/topk", {"text": text, "k": k, "allergies": allergies})
+        return [(p["drug"], p["confidence"]) for p in data["predictions"]]
+
+    def predict_drugs_topk(self, texts: list, k: int = 1):
+        data = self._request("POST", "/predict_batch", {"texts": texts, "k": k})
+        return [[(p["drug"], p["confidence"]) for p in preds] for preds in data["predictions"]]
+
+    def model_version(self) -> str:
+        if self._model_version is None:
+            self._model_version = self.health()["model_version"]
+        return self._model_version
+
+
+_client = InferenceClient(INFERENCE_SERVER_URL) if INFERENCE_SERVER_URL else None
+
+
+def predict_drug(text: str, allergies: str = None):
+    """Predict drug name and confidence from symptom text, skipping drugs contraindicated by `allergies`"""
+    if _client is None:
+        import bert_model
+        return bert_model.predict_drug(text, allergies)
+    return _client.predict_drug(text, allergies)
+
+
+def predict_drug_topk(text: str, k: int = 5, allergies: str = None):
+    """Return the k most likely drugs with confidences"""
+    if _client is None:
+        import bert_model
+        return bert_model.predict_drug_topk(text, k, allergies)
+    return _client.predict_drug_topk(text, k, allergies)
+
+
+def model_version() -> str:
+    if _client is None:
+        import bert_model
+        return bert_model.model_version()
+    return _client.model_version()
@@ -0,0 +1,248 @@
+# inference_server.py
+"""
+Standalone asyncio HTTP inference server that owns the DistilBERT model.
+
+    python modules/inference_server.py --host 127.0.0.1 --port 8601 --workers 4
+
+Endpoints (JSON in, JSON out):
+    POST /predict        {"text": "...", "allergies": "..."}          -> {"drug": ..., "confidence": ...}
+    POST /topk           {"text": "...", "k": 5, "allergies": "..."}  -> {"predictions": [{"drug": ..., "confidence": ...}, ...]}
+    POST /predict_batch  {"texts": [...], "k": 1}                     -> {"predictions": [[...], ...]}
+    GET  /health                                                      -> {"status": "ok", ...}
+
+"allergies" is optional free text; contraindicated drugs are excluded.
+
+Concurrent requests are handed to bert_model on a thread pool, where the
+MicroBatcher groups them into one forward pass. With --workers > 1 the parent
+loads the weights once and forks the workers, which share the weight pages
+copy-on-write and accept on one listening socket.
+"""
+import argparse
+import asyncio
+import json
+import os
+import signal
+import socket
+import sys
+from concurrent.futures import ThreadPoolExecutor
+
+import bert_model
+
+MAX_BODY_BYTES = 1024 * 1024
+REASONS = {200: "OK", 400: "Bad Request", 404: "Not Found", 405: "Method Not Allowed", 413: "Payload Too Large", 500: "Internal Server Error"}
+
+
+class HttpError(Exception):
+    def __init__(self, status: int, message: str):
+        super().__init__(message)
+        self.status = status
+
+
+class InferenceServer:
+    def __init__(self, max_concurrency: int = 64):
+        # Threads block inside the MicroBatcher, so this bounds requests per batch window
+        self.executor = ThreadPoolExecutor(max_workers=max_concurrency, thread_name_prefix="inference")
+
+    async def _run(self, fn, *args):
+        return await asyncio.get_running_loop().run_in_executor(self.executor, fn, *args)
+
+    # ---- Endpoints ----
+    async def health(self, _body):
+        return {
+            "status": "ok",
+            "pid": os.getpid(),
+            "model_loaded": bert_model.holder.loaded,
+            "model_version": bert_model.model_version(),
+            "model_load_seconds": bert_model.model_load_seconds(),
+            "model_load": bert_model.model_load_stats(),
+            "backend": bert_model.BACKEND,
+            "cache": bert_model.cache_stats(),
+        }
+
+    async def predict(self, body):
+        drug, confidence = await self._run(bert_model.predict_drug, _text(body), _allergies(body))
+        return {"drug": drug, "confidence": confidence}
+
+    async def topk(self, body):
+        predictions = await self._run(bert_model.predict_drug_topk, _text(body), _k(body), _allergies(body))
+        return {"predictions": [{"drug": drug, "confidence": confidence} for drug, confidence in predictions]}
+
+    async def predict_batch(self, body):
+        texts = body.get("texts")
+        if not isinstance(texts, list) or not all(isinstance(text, str) for text in texts):
+            raise HttpError(400, '"texts" must be a list of strings')
+        results = await self._run(bert_model.predict_drugs_topk, texts, _k(body, default=1))
+        return {"predictions": [
+            [{"drug": drug, "confidence": confidence} for drug, confidence in predictions]
+            for predictions in results
+        ]}
+
+    # ---- HTTP plumbing ----
+    def route(self, method: str, path: str):
+        routes = {
+            ("GET", "/health"): self.health,
+            ("POST", "/predict"): self.predict,
+            ("POST", "/topk"): self.topk,
+            ("POST", "/predict_batch"): self.predict_batch,
+        }
+        handler = routes.get((method, path))
+        if handler is None:
+            if any(route_path == path for _, route_path in routes):
+                raise HttpError(405, f"{method} not allowed on {path}")
+            raise HttpError(404, f"No endpoint {path}")
+        return handler
+
+    async def handle_connection(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        try:
+            while True:
+                request_line = await reader.readline()
+                if not request_line:
+                    break
+                keep_alive = await self._handle_request(request_line, reader, writer)
+                if not keep_alive:
+                    break
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass
+        except (ValueError, asyncio.LimitOverrunError):
+            # Request or header line longer than the stream limit: drop the connection
+            pass
+        finally:
+            writer.close()
+
+    async def _handle_request(self, request_line: bytes, reader, writer) -> bool:
+        headers = {}
+        while True:
+            line = await reader.readline()
+            if line in (b"\r\n", b"\n", b""):
+                break
+            name, _, value = line.decode("latin-1").partition(":")
+            headers[name.strip().lower()] = value.strip()
+
+        keep_alive = headers.get("connection", "").lower() != "close"
+        body_read = False
+        try:
+            method, target, _version = request_line.decode("latin-1").split()
+            length = int(headers.get("content-length", "0"))
+            if length < 0:
+                raise ValueError(f"invalid Content-Length {length}")
+            if length > MAX_BODY_BYTES:
+                raise HttpError(413, "Request body too large")
+            raw = await reader.readexactly(length) if length else b""
+            body_read = True
+            body = json.loads(raw) if raw else {}
+            if not isinstance(body, dict):
+                raise HttpError(400, "Request body must be a JSON object")
+            handler = self.route(method, target.split("?")[0])
+            status, payload = 200, await handler(body)
+        except HttpError as e:
+            status, payload = e.status, {"error": str(e)}
+        except (ValueError, UnicodeDecodeError) as e:
+            status, payload = 400, {"error": f"Malformed request: {e}"}
+        except Exception as e:
+            status, payload = 500, {"error": str(e)}
+        if not body_read:
+            # The unread body is still on the socket; the next "request" would be parsed from inside it
+            keep_alive = False
+
+        data = json.dumps(payload, default=str).encode("utf-8")
+        writer.write(
+            f"HTTP/1.1 {status} {REASONS.get(status, '')}\r\n"
+            f"Content-Type: application/json\r\n"
+            f"Content-Length: {len(data)}\r\n"
+            f"Connection: {'keep-alive' if keep_alive else 'close'}\r\n\r\n".encode("latin-1") + data
+        )
+        await writer.drain()
+        return keep_alive
+
+    async def serve(self, sock: socket.socket):
+        server = await asyncio.start_server(self.handle_connection, sock=sock)
+        async with server:
+            await server.serve_forever()
+
+
+def _text(body) -> str:
+    text = body.get("text")
+    if not isinstance(text, str) or not text.strip():
+        raise HttpError(400, '"text" must be a non-empty string')
+    return text
+
+
+def _allergies(body):
+    allergies = body.get("allergies")
+    if allergies is not None and not isinstance(allergies, str):
+        raise HttpError(400, '"allergies" must be a string')
+    return allergies or None
+
+
+def _k(body, default: int = 5) -> int:
+    try:
+        return max(1, min(int(body.get("k", default)), 50))
+    except (TypeError, ValueError):
+        raise HttpError(400, '"k" must be an integer')
+
+
+def _listen(host: str, port: int) -> socket.socket:
+    sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    sock.bind((host, port))
+    sock.listen(1024)
+    sock.setblocking(False)
+    return sock
+
+
+def _serve_worker(sock: socket.socket, max_concurrency: int):
+    # Warm up inside the worker: thread pools must be created after fork
+    bert_model.warmup()
+    asyncio.run(InferenceServer(max_concurrency).serve(sock))
+
+
+def run(host: str = "127.0.0.1", port: int = 8601, workers: int = 1, max_concurrency: int = 64):
+    sock = _listen(host, port)
+    # Load torch weights once in the parent so forked workers share them copy-on-write.
+    # onnxruntime sessions start their thread pools on creation, so each worker builds its own.
+    if bert_model.BACKEND != "onnx":
+        bert_model.holder.load()
+    print(f"Inference server on http://{host}:{port} ({workers} worker(s), backend {bert_model.BACKEND})", file=sys.stderr)
+
+    if workers <= 1 or not hasattr(os, "fork"):
+        _serve_worker(sock, max_concurrency)
+        return
+
+    children = []
+    for _ in range(workers):
+        pid = os.fork()
+        if pid == 0:
+            try:
+                _serve_worker(sock, max_concurrency)
+            finally:
+                os._exit(0)
+        children.append(pid)
+
+    def stop(signum, _frame):
+        for child in children:
+            try:
+                os.kill(child, signal.SIGTERM)
+            except ProcessLookupError:
+                pass
+
+    signal.signal(signal.SIGTERM, stop)
+    signal.signal(signal.SIGINT, stop)
+    for child in children:
+        try:
+            os.waitpid(child, 0)
+        except ChildProcessError:
+            pass
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Serve the drug classifier over HTTP")
+    parser.add_argument("--host", default=os.environ.get("INFERENCE_HOST", "127.0.0.1"))
+    parser.add_argument("--port", type=int, default=int(os.environ.get("INFERENCE_PORT", "8601")))
+    parser.add_argument("--workers", type=int, default=int(os.environ.get("INFERENCE_WORKERS", "1")))
+    parser.add_argument("--max-concurrency", type=int, default=64, help="in-flight requests per worker")
+    args = parser.parse_args(argv)
+    run(args.host, args.port, args.workers, args.max_concurrency)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,270 @@
+# knowledge_base.py
+"""
+Resident symptom -> drug knowledge base.
+
+Conditions are matched against symptom text with an Aho-Corasick automaton,
+so one pass over the text finds every condition regardless of how many
+conditions exist. Changes live in memory and reach disk through snapshots
+that merge with whatever other processes have written.
+"""
+import atexit
+import json
+import logging
+import threading
+from collections import deque
+from pathlib import Path
+
+import metrics
+from persistence import atomic_write_json, file_lock
+
+logger = logging.getLogger("drug_recommender.knowledge_base")
+
+
+class AhoCorasick:
+    """Multi-pattern substring matcher (same semantics as `pattern in text` for each pattern)"""
+
+    def __init__(self, patterns):
+        self._goto = [{}]
+        self._fail = [0]
+        self._out = [[]]
+        for pattern in patterns:
+            self._add(pattern)
+        self._build()
+
+    def _add(self, pattern: str):
+        if not pattern:
+            return
+        node = 0
+        for ch in pattern:
+            nxt = self._goto[node].get(ch)
+            if nxt is None:
+                nxt = len(self._goto)
+                self._goto[node][ch] = nxt
+                self._goto.append({})
+                self._fail.append(0)
+                self._out.append([])
+            node = nxt
+        self._out[node].append(pattern)
+
+    def _build(self):
+        # Breadth-first so every failure link points at an already finished node
+        pending = deque(self._goto[0].values())
+        while pending:
+            node = pending.popleft()
+            for ch, child in self._goto[node].items():
+                pending.append(child)
+                fail = self._fail[node]
+                while fail and ch not in self._goto[fail]:
+                    fail = self._fail[fail]
+                self._fail[child] = self._goto[fail].get(ch, 0)
+                self._out[child] = self._out[child] + self._out[self._fail[child]]
+
+    def find(self, text: str) -> set:
+        """Set of patterns that occur anywhere in `text`"""
+        found = set()
+        node = 0
+        goto, fail, out = self._goto, self._fail, self._out
+        for ch in text:
+            while node and ch not in goto[node]:
+                node = fail[node]
+            node = goto[node].get(ch, 0)
+            if out[node]:
+                found.update(out[node])
+        return found
+
+
+class KnowledgeBase:
+    """
+    In-memory condition -> drugs mapping. Drug lists are insertion-ordered
+    dicts used as sets, so membership checks are O(1) and the JSON snapshot
+    keeps the original order.
+
+    Local changes are also kept as a delta (condition -> {drug: present}).
+    A snapshot re-reads the file under the file lock, applies only this
+    process's delta to it and adopts the merged result, so workers sharing
+    the file never overwrite each other's updates.
+    """
+
+    def __init__(self, known_drugs: dict, path: Path = None):
+        self.path = Path(path) if path else None
+        self._conditions = {condition.lower(): dict.fromkeys(drugs) for condition, drugs in known_drugs.items()}
+        self._lock = threading.RLock()
+        self._matcher = None
+        self._rank = {}
+        self._delta = {}
+        self._mtime_ns = self._file_mtime()
+        self._snapshot_timer = None
+
+    @classmethod
+    def load(cls, path: Path):
+        with open(path, "r") as f:
+            return cls(json.load(f), path=path)
+
+    # ---- Queries ----
+    @property
+    def matcher(self) -> AhoCorasick:
+        # Rebuilt lazily after conditions are added
+        if self._matcher is None:
+            self._rank = {condition: i for i, condition in enumerate(self._conditions)}
+            self._matcher = AhoCorasick(self._conditions.keys())
+        return self._matcher
+
+    def match_conditions(self, symptoms: str) -> list:
+        """Known conditions mentioned in `symptoms`, in knowledge-base order"""
+        with self._lock:
+            found = self.matcher.find(symptoms.lower())
+            return sorted(found, key=self._rank.__getitem__)
+
+    def drugs_for(self, symptoms: str) -> list:
+        """Union of drugs for every condition mentioned in `symptoms`"""
+        with self._lock:
+            drugs = {}
+            for condition in self.match_conditions(symptoms):
+                drugs.update(self._conditions[condition])
+            return list(drugs)
+
+    def has_drug(self, condition: str, drug: str) -> bool:
+        return drug in self._conditions.get(condition.lower(), ())
+
+    def to_dict(self) -> dict:
+        with self._lock:
+            return {condition: list(drugs) for condition, drugs in self._conditions.items()}
+
+    # ---- Updates ----
+    def add_condition(self, condition: str, drugs=()):
+        with self._lock:
+            condition = condition.lower()
+            if condition not in self._conditions:
+                self._conditions[condition] = {}
+                self._matcher = None
+            self._conditions[condition].update(dict.fromkeys(drugs))
+            delta = self._delta.setdefault(condition, {})
+            delta.update(dict.fromkeys(drugs, True))
+
+    def apply_feedback(self, symptoms: str, recommended_drug: str, rating: int) -> bool:
+        """
+        Positive feedback (rating >= 4) adds the drug to every matching
+        condition, negative feedback (rating <= 2) removes it. Returns True if
+        anything changed.
+        """
+        changed = False
+        with self._lock:
+            for condition in self.match_conditions(symptoms):
+                drugs = self._conditions[condition]
+                if rating >= 4 and recommended_drug not in drugs:
+                    drugs[recommended_drug] = None
+                    self._delta.setdefault(condition, {})[recommended_drug] = True
+                    changed = True
+                elif rating <= 2 and recommended_drug in drugs:
+                    del drugs[recommended_drug]
+                    self._delta.setdefault(condition, {})[recommended_drug] = False
+                    changed = True
+        return changed
+
+    # ---- Persistence ----
+    @property
+    def dirty(self) -> bool:
+        return bool(self._delta)
+
+    @staticmethod
+    def _apply(base: dict, delta: dict) -> dict:
+        """`base` (condition -> drug dict) with `delta` applied, as a new mapping"""
+        merged = {condition: dict(drugs) for condition, drugs in base.items()}
+        for condition, changes in delta.items():
+            drugs = merged.setdefault(condition, {})
+            for drug, present in changes.items():
+                if present:
+                    drugs[drug] = None
+                else:
+                    drugs.pop(drug, None)
+        return merged
+
+    def _file_mtime(self):
+        try:
+            return self.path.stat().st_mtime_ns if self.path else None
+        except FileNotFoundError:
+            return None
+
+    def _read_file(self, path: Path):
+        try:
+            with open(path, "r") as f:
+                return {condition.lower(): dict.fromkeys(drugs) for condition, drugs in json.load(f).items()}
+        except FileNotFoundError:
+            return {}
+        except ValueError:
+            logger.error("Unreadable knowledge base %s; rewriting it from memory", path)
+            return None
+
+    def _adopt(self, conditions: dict):
+        """Replace the in-memory mapping with `conditions` plus changes not yet snapshotted (lock held)"""
+        self._conditions = self._apply(conditions, self._delta)
+        self._matcher = None
+
+    def snapshot(self, path: Path = None, force: bool = False) -> bool:
+        """
+        Merge this process's changes into the file on disk and adopt the
+        merged result. On failure the changes stay pending for the next snapshot.
+        """
+        path = Path(path) if path else self.path
+        with self._lock:
+            if path is None or not (self._delta or force):
+                return False
+            delta, self._delta = self._delta, {}
+            fallback = self._apply(self._conditions, {})
+        try:
+            with file_lock(path), metrics.timer("knowledge_snapshot_seconds"):
+                on_disk = self._read_file(path)
+                merged = self._apply(fallback if on_disk is None else on_disk, delta)
+                atomic_write_json(path, {condition: list(drugs) for condition, drugs in merged.items()})
+                mtime_ns = path.stat().st_mtime_ns
+        except BaseException:
+            with self._lock:
+                # Put the changes back underneath anything recorded since
+                for condition, changes in delta.items():
+                    self._delta[condition] = {**changes, **self._delta.get(condition, {})}
+            raise
+        with self._lock:
+            if path == self.path:
+                self._adopt(merged)
+                self._mtime_ns = mtime_ns
+        return True
+
+    def reload_if_changed(self) -> bool:
+        """Pick up snapshots written by other processes since we last read or wrote the file"""
+        mtime_ns = self._file_mtime()
+        if mtime_ns is None or mtime_ns == self._mtime_ns:
+            return False
+        with file_lock(self.path):
+            on_disk = self._read_file(self.path)
+        if on_disk is None:
+            return False
+        with self._lock:
+            self._adopt(on_disk)
+            self._mtime_ns = mtime_ns
+        return True
+
+    def start_periodic_snapshots(self, interval: float = 30.0, writer=None):
+        """
+        Snapshot every `interval` seconds, and once more at exit. With a
+        persistence.BackgroundWriter the snapshot is queued on its thread.
+        """
+        def tick():
+            try:
+                if self._delta:
+                    if writer is not None:
+                        writer.replace(self.path, self.snapshot)
+                    else:
+                        self.snapshot()
+                else:
+                    self.reload_if_changed()
+            except Exception:
+                logger.exception("Knowledge base snapshot failed; changes kept for the next attempt")
+            self._schedule(interval, tick)
+
+        self._schedule(interval, tick)
+        atexit.register(self.snapshot)
+
+    def _schedule(self, interval, fn):
+        self._snapshot_timer = threading.Timer(interval, fn)
+        self._snapshot_timer.daemon = True
+        self._snapshot_timer.start()
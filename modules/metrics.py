@@ -0,0 +1,221 @@
+# metrics.py
+"""
+Lightweight in-process instrumentation.
+
+Timers/histograms and counters for the hot paths (tokenization, model
+forward pass, prediction cache, MongoDB commands, feedback file I/O), a
+per-request trace id, and an optional Prometheus text exporter served from
+a small local HTTP server.
+
+Disabled unless METRICS_ENABLED=1; when disabled every call returns
+immediately (timer() hands back a shared no-op context manager).
+"""
+import bisect
+import contextvars
+import logging
+import os
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+ENABLED = os.environ.get("METRICS_ENABLED", "0") == "1"
+METRICS_PORT = int(os.environ.get("METRICS_PORT", "0"))
+
+# Seconds; covers sub-millisecond cache hits up to multi-second cold loads
+DEFAULT_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+logger = logging.getLogger("drug_recommender.metrics")
+
+_trace_id = contextvars.ContextVar("trace_id", default=None)
+_lock = threading.Lock()
+_counters = {}
+_histograms = {}
+
+
+class _Histogram:
+    __slots__ = ("counts", "sum", "count")
+
+    def __init__(self):
+        self.counts = [0] * (len(DEFAULT_BUCKETS) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value: float):
+        self.counts[bisect.bisect_left(DEFAULT_BUCKETS, value)] += 1
+        self.sum += value
+        self.count += 1
+
+
+def _key(name: str, labels: dict) -> tuple:
+    return name, tuple(sorted(labels.items()))
+
+
+def inc(name: str, amount: float = 1, **labels):
+    """Add `amount` to a counter"""
+    if not ENABLED:
+        return
+    key = _key(name, labels)
+    with _lock:
+        _counters[key] = _counters.get(key, 0) + amount
+
+
+def observe(name: str, seconds: float, **labels):
+    """Record one duration in a histogram"""
+    if not ENABLED:
+        return
+    key = _key(name, labels)
+    with _lock:
+        histogram = _histograms.get(key)
+        if histogram is None:
+            histogram = _histograms[key] = _Histogram()
+        histogram.observe(seconds)
+    trace_id = _trace_id.get()
+    if trace_id is not None and logger.isEnabledFor(logging.DEBUG):
+        logger.debug("trace=%s %s%s %.3fms", trace_id, name, labels or "", seconds * 1000)
+
+
+class _Timer:
+    __slots__ = ("name", "labels", "start")
+
+    def __init__(self, name, labels):
+        self.name = name
+        self.labels = labels
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        observe(self.name, time.perf_counter() - self.start, **self.labels)
+        return False
+
+
+class _NoopTimer:
+    __slots__ = ()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+
+_NOOP_TIMER = _NoopTimer()
+
+
+def timer(name: str, **labels):
+    """`with timer("model_forward_seconds"): ...` records the block's duration"""
+    if not ENABLED:
+        return _NOOP_TIMER
+    return _Timer(name, labels)
+
+
+# ---- Trace ids ----
+def current_trace_id():
+    return _trace_id.get()
+
+
+@contextmanager
+def trace(trace_id: str = None):
+    """Tag everything recorded inside the block (this thread/task) with one trace id"""
+    token = _trace_id.set(trace_id or uuid.uuid4().hex[:16])
+    try:
+        yield _trace_id.get()
+    finally:
+        _trace_id.reset(token)
+
+
+# ---- Export ----
+def snapshot() -> dict:
+    """Copy of all counters and histograms, for tests and ad-hoc inspection"""
+    with _lock:
+        return {
+            "counters": {key: value for key, value in _counters.items()},
+            "histograms": {key: (list(h.counts), h.sum, h.count) for key, h in _histograms.items()},
+        }
+
+
+def _escape(value) -> str:
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _format_labels(labels, extra=()) -> str:
+    items = list(labels) + list(extra)
+    if not items:
+        return ""
+    body = ",".join(f'{k}="{_escape(v)}"' for k, v in items)
+    return "{" + body + "}"
+
+
+def render_prometheus() -> str:
+    """Prometheus text exposition format (version 0.0.4)"""
+    data = snapshot()
+    lines = []
+    seen = set()
+    for (name, labels), value in sorted(data["counters"].items()):
+        if name not in seen:
+            lines.append(f"# TYPE {name} counter")
+            seen.add(name)
+        lines.append(f"{name}{_format_labels(labels)} {value}")
+    for (name, labels), (counts, total, count) in sorted(data["histograms"].items()):
+        if name not in seen:
+            lines.append(f"# TYPE {name} histogram")
+            seen.add(name)
+        cumulative = 0
+        for bound, bucket_count in zip(DEFAULT_BUCKETS, counts):
+            cumulative += bucket_count
+            lines.append(f"{name}_bucket{_format_labels(labels, [('le', bound)])} {cumulative}")
+        lines.append(f"{name}_bucket{_format_labels(labels, [('le', '+Inf')])} {count}")
+        lines.append(f"{name}_sum{_format_labels(labels)} {total}")
+        lines.append(f"{name}_count{_format_labels(labels)} {count}")
+    return "\n".join(lines) + "\n"
+
+
+class _MetricsHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        if self.path.split("?")[0] != "/metrics":
+            self.send_error(404)
+            return
+        body = render_prometheus().encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+_server = None
+
+
+def start_http_server(port: int = METRICS_PORT, host: str = "127.0.0.1"):
+    """Serve /metrics on a daemon thread (once per process); returns the server"""
+    global _server
+    with _lock:
+        if _server is None:
+            _server = ThreadingHTTPServer((host, port), _MetricsHandler)
+            threading.Thread(target=_server.serve_forever, name="metrics-http", daemon=True).start()
+    return _server
+
+
+# ---- MongoDB command monitoring ----
+def mongo_command_listener():
+    """pymongo CommandListener that times every MongoDB command and counts failures"""
+    from pymongo import monitoring
+
+    class _Listener(monitoring.CommandListener):
+        def started(self, event):
+            pass
+
+        def succeeded(self, event):
+            observe("mongo_command_seconds", event.duration_micros / 1e6, command=event.command_name)
+
+        def failed(self, event):
+            observe("mongo_command_seconds", event.duration_micros / 1e6, command=event.command_name)
+            inc("mongo_command_failures_total", command=event.command_name)
+
+    return _Listener()
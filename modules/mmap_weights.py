@@ -0,0 +1,110 @@
+# mmap_weights.py
+"""
+Zero-copy model weight loading from a memory-mapped safetensors file.
+
+Tensors are views straight into a read-only shared mapping of
+model.safetensors, so every process on the host that loads the same file
+shares the same physical pages through the OS page cache: an extra worker
+costs almost no RSS for weights and skips the read/copy at startup.
+"""
+import json
+import mmap
+import os
+import struct
+from pathlib import Path
+
+SAFETENSORS_FILENAME = "model.safetensors"
+
+_DTYPES = {
+    "F64": "float64", "F32": "float32", "F16": "float16", "BF16": "bfloat16",
+    "I64": "int64", "I32": "int32", "I16": "int16", "I8": "int8", "U8": "uint8", "BOOL": "bool",
+}
+
+
+def rss_mb():
+    """Current resident set size of this process in MiB (None where /proc is unavailable)"""
+    try:
+        with open("/proc/self/status") as f:
+            for line in f:
+                if line.startswith("VmRSS:"):
+                    return int(line.split()[1]) / 1024
+    except OSError:
+        pass
+    return None
+
+
+def load_mmap_state_dict(path: Path) -> tuple:
+    """
+    Parse a safetensors file and return (state_dict, mapping). Every tensor is
+    a view into `mapping`, which must stay referenced as long as the tensors live.
+    """
+    import torch
+
+    with open(path, "rb") as f:
+        mapping = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+    (header_len,) = struct.unpack("<Q", mapping[:8])
+    header = json.loads(mapping[8:8 + header_len])
+    data_start = 8 + header_len
+
+    state_dict = {}
+    for name, info in header.items():
+        if name == "__metadata__":
+            continue
+        dtype = getattr(torch, _DTYPES[info["dtype"]])
+        begin, end = info["data_offsets"]
+        element_size = torch.tensor([], dtype=dtype).element_size()
+        count = (end - begin) // element_size
+        if count == 0:
+            state_dict[name] = torch.empty(info["shape"], dtype=dtype)
+            continue
+        tensor = torch.frombuffer(mapping, dtype=dtype, count=count, offset=data_start + begin)
+        state_dict[name] = tensor.view(info["shape"])
+    return state_dict, mapping
+
+
+def load_model_mmap(model_dir: Path):
+    """
+    DistilBertForSequenceClassification whose parameters live in the shared
+    mapping of model_dir/model.safetensors. Returns (model, mapping).
+    """
+    import warnings
+
+    from transformers import DistilBertConfig, DistilBertForSequenceClassification
+    from transformers.modeling_utils import no_init_weights
+
+    model_dir = Path(model_dir)
+    config = DistilBertConfig.from_pretrained(model_dir)
+    # Skip random init: the parameters are replaced by the mapped tensors right away
+    with no_init_weights():
+        model = DistilBertForSequenceClassification(config)
+    with warnings.catch_warnings():
+        # torch warns that the mapping is read-only; inference never writes to weights
+        warnings.simplefilter("ignore", UserWarning)
+        state_dict, mapping = load_mmap_state_dict(model_dir / SAFETENSORS_FILENAME)
+    result = model.load_state_dict(state_dict, strict=False, assign=True)
+    if result.missing_keys:
+        raise KeyError(f"{SAFETENSORS_FILENAME} is missing weights: {', '.join(result.missing_keys)}")
+    model.eval()
+    return model, mapping
+
+
+def export_safetensors(model, model_dir: Path) -> Path:
+    """Write the model's weights to model_dir/model.safetensors (atomically)"""
+    from safetensors.torch import save_file
+
+    path = Path(model_dir) / SAFETENSORS_FILENAME
+    tmp = path.with_name(path.name + ".tmp")
+    state_dict = {name: tensor.detach().contiguous() for name, tensor in model.state_dict().items()}
+    save_file(state_dict, str(tmp), metadata={"format": "pt"})
+    os.replace(tmp, path)
+    return path
+
+
+if __name__ == "__main__":
+    # One-off conversion: python modules/mmap_weights.py [model_dir]
+    import sys
+    from transformers import DistilBertForSequenceClassification
+
+    target = Path(sys.argv[1]) if len(sys.argv) > 1 else Path(__file__).parent / "models" / "distilbert_drug_model"
+    source = DistilBertForSequenceClassification.from_pretrained(target, local_files_only=True)
+    print(f"Wrote {export_safetensors(source, target)}")
@@ -0,0 +1,196 @@
+# persistence.py
+"""
+Single-writer persistence for the feedback log and knowledge base files.
+
+Callers enqueue work and return immediately. One background thread drains
+the queue, coalesces everything pending into one write per file (appends are
+concatenated, whole-file replacements keep only the latest value) and writes
+under an exclusive file lock so several processes can share the files.
+Replacements are atomic: temp file in the same directory, fsync, rename.
+"""
+import atexit
+import json
+import logging
+import os
+import queue
+import tempfile
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+from pathlib import Path
+
+try:
+    import fcntl
+except ImportError:  # Windows: fall back to in-process locking only
+    fcntl = None
+
+logger = logging.getLogger("drug_recommender.persistence")
+
+
+@contextmanager
+def file_lock(path: Path):
+    """Exclusive advisory lock on `<path>.lock` shared across processes"""
+    if fcntl is None:
+        yield
+        return
+    lock_path = Path(str(path) + ".lock")
+    with open(lock_path, "a") as lock_file:
+        fcntl.flock(lock_file.fileno(), fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(lock_file.fileno(), fcntl.LOCK_UN)
+
+
+def atomic_write_json(path: Path, data, indent: int = 4):
+    """Replace `path` with `data` as JSON so readers see either the old or the new file"""
+    path = Path(path)
+    fd, tmp_name = tempfile.mkstemp(dir=path.parent, prefix=f".{path.name}.", suffix=".tmp")
+    try:
+        with os.fdopen(fd, "w") as f:
+            json.dump(data, f, indent=indent)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_name, path)
+    except BaseException:
+        if os.path.exists(tmp_name):
+            os.unlink(tmp_name)
+        raise
+
+
+class BackgroundWriter:
+    """
+    Queue drained by one daemon thread.
+
+    - `append(key, item, fn)`: items for the same key are gathered and passed
+      to `fn(items)` as a single list.
+    - `replace(key, fn)`: only the most recent `fn` for a key runs; `fn()`
+      produces the whole file (e.g. a knowledge-base snapshot).
+
+    A failing write is retried with backoff (RETRY_DELAYS); if it still
+    fails the error is logged and kept in `errors`. Failed appends go back on
+    the queue, so their items are retried with the next batch instead of
+    being dropped.
+    """
+
+    _STOP = object()
+    RETRY_DELAYS = (0.05, 0.25, 1.0)
+
+    def __init__(self, name: str = "persistence-writer"):
+        self._queue = queue.Queue()
+        self._name = name
+        self._thread = None
+        self._start_lock = threading.Lock()
+        self._idle = threading.Condition()
+        self._pending = 0
+        self.errors = deque(maxlen=100)
+        self.failed_items = 0
+        self._stopping = False
+        self._shutdown_hooks = []
+        atexit.register(self.shutdown)
+
+    def _ensure_started(self):
+        with self._start_lock:
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._run, name=self._name, daemon=True)
+                self._thread.start()
+
+    def _put(self, job):
+        with self._idle:
+            self._pending += 1
+        self._ensure_started()
+        self._queue.put(job)
+
+    def append(self, key, item, fn):
+        self._put(("append", key, item, fn))
+
+    def replace(self, key, fn):
+        self._put(("replace", key, None, fn))
+
+    def _drain(self, first):
+        jobs = [first]
+        while True:
+            try:
+                jobs.append(self._queue.get_nowait())
+            except queue.Empty:
+                return jobs
+
+    def _run(self):
+        while True:
+            jobs = self._drain(self._queue.get())
+            stop = any(job is self._STOP for job in jobs)
+            jobs = [job for job in jobs if job is not self._STOP]
+
+            appends, replaces = {}, {}
+            for kind, key, item, fn in jobs:
+                if kind == "append":
+                    appends.setdefault(key, (fn, []))[1].append(item)
+                else:
+                    replaces[key] = fn
+            for key, (fn, items) in appends.items():
+                if self._call(fn, items):
+                    continue
+                if stop or self._stopping:
+                    self.failed_items += len(items)
+                    logger.error("Dropped %d queued items for %s at shutdown after repeated write failures", len(items), key)
+                else:
+                    # Keep the items: they are written with the next batch for this key
+                    for item in items:
+                        self._put(("append", key, item, fn))
+            for fn in replaces.values():
+                self._call(fn)
+
+            with self._idle:
+                self._pending -= len(jobs)
+                self._idle.notify_all()
+            if stop:
+                return
+
+    def _call(self, fn, *args) -> bool:
+        """Run one write, retrying with backoff; returns whether it succeeded"""
+        for attempt, delay in enumerate((0.0,) + self.RETRY_DELAYS):
+            if delay:
+                time.sleep(delay)
+            try:
+                fn(*args)
+                return True
+            except Exception as e:  # keep the writer alive
+                if attempt == len(self.RETRY_DELAYS):
+                    logger.exception("Background write %r failed after %d attempts", fn, attempt + 1)
+                    self.errors.append(e)
+        return False
+
+    def flush(self, timeout: float = None) -> bool:
+        """Block until everything queued so far has been written"""
+        with self._idle:
+            return self._idle.wait_for(lambda: self._pending == 0, timeout=timeout)
+
+    def on_shutdown(self, fn):
+        """
+        Run `fn()` at the end of shutdown, after the final drain (e.g. close
+        the file the queued writes go to). atexit runs handlers in reverse
+        registration order, so closing there can happen before the drain.
+        """
+        self._shutdown_hooks.append(fn)
+
+    def shutdown(self, timeout: float = 10.0):
+        """Flush-on-shutdown hook: write everything pending, stop the thread, then run on_shutdown hooks"""
+        if self._thread is not None and self._thread.is_alive():
+            self._stopping = True
+            self.flush(timeout=timeout)
+            self._queue.put(self._STOP)
+            self._thread.join(timeout=timeout)
+        for fn in self._shutdown_hooks:
+            self._call(fn)
+
+
+writer = BackgroundWriter()
+
+
+def flush(timeout: float = None) -> bool:
+    return writer.flush(timeout=timeout)
+
+
+def shutdown():
+    writer.shutdown()
@@ -0,0 +1,294 @@
+# pill_image.py
+"""
+Pill image identification.
+
+Images are decoded once at reduced size (JPEG draft mode) and fingerprinted
+with a 64-bit DCT perceptual hash and a coarse RGB colour histogram. A
+fingerprint close to a reference pill image is a match without running any
+model; only images with no confident reference match go to the CNN
+classifier, which scores them together in batches on CPU.
+
+    results = identify_pills(["upload1.jpg", "upload2.png"])
+    checked = identify_and_check("upload1.jpg", "fever and body ache")
+"""
+import io
+import json
+import os
+import threading
+from pathlib import Path
+
+import numpy as np
+
+import metrics
+from prediction_cache import normalize_text
+
+BASE_DIR = Path(__file__).parent
+REFERENCE_DIR = Path(os.environ.get("PILL_REFERENCE_DIR", BASE_DIR.parent))
+REFERENCE_MANIFEST = REFERENCE_DIR / "pill_references.json"
+CNN_MODEL_DIR = Path(os.environ.get("PILL_CNN_MODEL_DIR", BASE_DIR / "models" / "pill_cnn"))
+
+# Reference images shipped with the repo; pill_references.json (filename -> drug) adds more
+DEFAULT_REFERENCES = {
+    "500mg-paracetamol-tablet.jpg": "Paracetamol",
+    "dolo.jpg": "Paracetamol",
+}
+
+HASH_SIZE = 8
+HASH_IMAGE_SIZE = 32
+HISTOGRAM_BINS = 4
+CNN_IMAGE_SIZE = 224
+CNN_BATCH_SIZE = int(os.environ.get("PILL_CNN_BATCH_SIZE", "16"))
+# Max differing hash bits (of 64) and min histogram intersection for a reference match
+MAX_HASH_DISTANCE = int(os.environ.get("PILL_MAX_HASH_DISTANCE", "10"))
+MIN_HISTOGRAM_SIMILARITY = float(os.environ.get("PILL_MIN_HISTOGRAM_SIMILARITY", "0.6"))
+
+_IMAGENET_MEAN = np.array([0.485, 0.456, 0.406], dtype=np.float32)
+_IMAGENET_STD = np.array([0.229, 0.224, 0.225], dtype=np.float32)
+
+
+# ---- Preprocessing ----
+def _dct_matrix(n: int) -> np.ndarray:
+    k = np.arange(n)[:, None]
+    matrix = np.cos(np.pi * (2 * np.arange(n)[None, :] + 1) * k / (2 * n)) * np.sqrt(2.0 / n)
+    matrix[0] /= np.sqrt(2.0)
+    return matrix.astype(np.float32)
+
+
+_DCT = _dct_matrix(HASH_IMAGE_SIZE)
+_BIT_WEIGHTS = np.left_shift(np.uint64(1), np.arange(HASH_SIZE * HASH_SIZE, dtype=np.uint64))
+
+
+def load_image(source, max_side: int = CNN_IMAGE_SIZE * 2):
+    """
+    RGB PIL image from a path, bytes or file-like object (e.g. a Streamlit upload).
+    JPEGs are decoded at a reduced scale close to `max_side`, which skips most of
+    the decode work for large photos.
+    """
+    from PIL import Image, ImageOps
+
+    if isinstance(source, (bytes, bytearray)):
+        source = io.BytesIO(source)
+    image = Image.open(source)
+    image.draft("RGB", (max_side, max_side))
+    image = ImageOps.exif_transpose(image)
+    return image.convert("RGB")
+
+
+def fingerprints(images: list) -> tuple:
+    """(uint64 perceptual hashes (n,), float32 colour histograms (n, bins**3)) for a batch of PIL images"""
+    from PIL import Image
+
+    gray = np.empty((len(images), HASH_IMAGE_SIZE, HASH_IMAGE_SIZE), dtype=np.float32)
+    histograms = np.empty((len(images), HISTOGRAM_BINS ** 3), dtype=np.float32)
+    for i, image in enumerate(images):
+        gray[i] = np.asarray(image.convert("L").resize((HASH_IMAGE_SIZE, HASH_IMAGE_SIZE), Image.BILINEAR), dtype=np.float32)
+        small = np.asarray(image.resize((64, 64), Image.BILINEAR)) // (256 // HISTOGRAM_BINS)
+        codes = (small[..., 0].astype(np.int64) * HISTOGRAM_BINS + small[..., 1]) * HISTOGRAM_BINS + small[..., 2]
+        histograms[i] = np.bincount(codes.ravel(), minlength=HISTOGRAM_BINS ** 3)
+    histograms /= histograms.sum(axis=1, keepdims=True)
+
+    # Batched 2-D DCT; keep the lowest 8x8 frequencies and threshold on their median (pHash)
+    low = (_DCT @ gray @ _DCT.T)[:, :HASH_SIZE, :HASH_SIZE].reshape(len(images), -1)
+    bits = low > np.median(low[:, 1:], axis=1, keepdims=True)
+    hashes = (bits.astype(np.uint64) * _BIT_WEIGHTS).sum(axis=1, dtype=np.uint64)
+    return hashes, histograms
+
+
+def _popcount(values: np.ndarray) -> np.ndarray:
+    if hasattr(np, "bitwise_count"):
+        return np.bitwise_count(values)
+    return np.unpackbits(values[..., None].view(np.uint8), axis=-1).sum(axis=-1)
+
+
+def cnn_batch(images: list) -> np.ndarray:
+    """(n, 3, 224, 224) float32 ImageNet-normalized batch"""
+    from PIL import Image
+
+    batch = np.empty((len(images), CNN_IMAGE_SIZE, CNN_IMAGE_SIZE, 3), dtype=np.float32)
+    for i, image in enumerate(images):
+        batch[i] = np.asarray(image.resize((CNN_IMAGE_SIZE, CNN_IMAGE_SIZE), Image.BILINEAR), dtype=np.float32)
+    batch = (batch / 255.0 - _IMAGENET_MEAN) / _IMAGENET_STD
+    return np.ascontiguousarray(batch.transpose(0, 3, 1, 2))
+
+
+# ---- Reference index ----
+class PillHashIndex:
+    """Perceptual hashes and colour histograms of reference pill images, searched with vectorized XOR/popcount"""
+
+    def __init__(self):
+        self.hashes = np.empty(0, dtype=np.uint64)
+        self.histograms = np.empty((0, HISTOGRAM_BINS ** 3), dtype=np.float32)
+        self.drugs = []
+        self.sources = []
+
+    def __len__(self):
+        return len(self.drugs)
+
+    def add(self, images: list, drugs: list, sources: list = None):
+        hashes, histograms = fingerprints(images)
+        self.hashes = np.concatenate([self.hashes, hashes])
+        self.histograms = np.concatenate([self.histograms, histograms])
+        self.drugs.extend(drugs)
+        self.sources.extend(sources or [None] * len(drugs))
+
+    def query(self, hashes: np.ndarray, histograms: np.ndarray) -> list:
+        """
+        Best reference for each fingerprint: dicts with drug, hash distance
+        and histogram similarity, or None when the index is empty.
+        """
+        if not len(self):
+            return [None] * len(hashes)
+        distances = _popcount(hashes[:, None] ^ self.hashes[None, :])
+        # Histogram intersection: 1.0 for identical colour distributions
+        similarity = np.minimum(histograms[:, None, :], self.histograms[None, :, :]).sum(axis=2)
+        # Fewest differing bits wins; histogram similarity (< 1) only breaks ties
+        best = np.argmin(distances - similarity, axis=1)
+        return [
+            {
+                "drug": self.drugs[j],
+                "source": self.sources[j],
+                "distance": int(distances[i, j]),
+                "histogram_similarity": round(float(similarity[i, j]), 3),
+            }
+            for i, j in enumerate(best)
+        ]
+
+
+def load_reference_index(reference_dir: Path = REFERENCE_DIR) -> PillHashIndex:
+    references = dict(DEFAULT_REFERENCES)
+    manifest = Path(reference_dir) / REFERENCE_MANIFEST.name
+    if manifest.exists():
+        with open(manifest, "r", encoding="utf-8") as f:
+            references.update(json.load(f))
+    index = PillHashIndex()
+    paths = [(Path(reference_dir) / name, drug) for name, drug in references.items()]
+    paths = [(path, drug) for path, drug in paths if path.exists()]
+    if paths:
+        index.add([load_image(path) for path, _ in paths], [drug for _, drug in paths], [path.name for path, _ in paths])
+    return index
+
+
+# ---- CNN fallback ----
+class PillClassifier:
+    """
+    ResNet50 fine-tuned on pill photos, loaded lazily from CNN_MODEL_DIR
+    (model.pt state dict + labels.json). Unavailable when the weights are absent.
+    """
+
+    def __init__(self, model_dir: Path = CNN_MODEL_DIR):
+        self.model_dir = Path(model_dir)
+        self.model = None
+        self.labels = None
+        self._lock = threading.Lock()
+
+    @property
+    def available(self) -> bool:
+        return (self.model_dir / "model.pt").exists() and (self.model_dir / "labels.json").exists()
+
+    def load(self):
+        if self.model is not None:
+            return self
+        with self._lock:
+            if self.model is None:
+                import torch
+                from torchvision.models import resnet50
+
+                with open(self.model_dir / "labels.json", "r", encoding="utf-8") as f:
+                    labels = json.load(f)
+                model = resnet50(num_classes=len(labels))
+                model.load_state_dict(torch.load(self.model_dir / "model.pt", map_location="cpu"))
+                model.eval()
+                self.labels = labels
+                self.model = model
+        return self
+
+    def predict(self, images: list, batch_size: int = CNN_BATCH_SIZE) -> list:
+        """(drug, confidence %) for each image, batch_size images per forward pass"""
+        import torch
+
+        self.load()
+        results = []
+        for start in range(0, len(images), batch_size):
+            batch = torch.from_numpy(cnn_batch(images[start:start + batch_size]))
+            with torch.no_grad(), metrics.timer("pill_cnn_forward_seconds"):
+                probs = torch.softmax(self.model(batch), dim=1).numpy()
+            metrics.inc("pill_cnn_rows_total", len(batch))
+            for row in probs:
+                label = int(np.argmax(row))
+                results.append((self.labels[label], round(float(row[label]) * 100, 2)))
+        return results
+
+
+_reference_index = None
+_reference_lock = threading.Lock()
+classifier = PillClassifier()
+
+
+def get_reference_index() -> PillHashIndex:
+    global _reference_index
+    if _reference_index is None:
+        with _reference_lock:
+            if _reference_index is None:
+                _reference_index = load_reference_index()
+    return _reference_index
+
+
+# ---- Identification ----
+def identify_pills(sources: list) -> list:
+    """
+    Identify a batch of pill images (paths, bytes or file-like objects).
+    Each result is {"drug", "confidence", "method"}: method "reference" for a
+    perceptual-hash match, "cnn" for the classifier fallback, "none" when
+    neither applies.
+    """
+    images = [load_image(source) for source in sources]
+    if not images:
+        return []
+    with metrics.timer("pill_fingerprint_seconds"):
+        hashes, histograms = fingerprints(images)
+        matches = get_reference_index().query(hashes, histograms)
+
+    results = [None] * len(images)
+    ambiguous = []
+    for i, match in enumerate(matches):
+        if match and match["distance"] <= MAX_HASH_DISTANCE and match["histogram_similarity"] >= MIN_HISTOGRAM_SIMILARITY:
+            confidence = round((1 - match["distance"] / (HASH_SIZE * HASH_SIZE)) * 100, 2)
+            results[i] = {"drug": match["drug"], "confidence": confidence, "method": "reference", "match": match}
+            metrics.inc("pill_image_lookups_total", method="reference")
+        else:
+            ambiguous.append(i)
+
+    if ambiguous and classifier.available:
+        for i, (drug, confidence) in zip(ambiguous, classifier.predict([images[i] for i in ambiguous])):
+            results[i] = {"drug": drug, "confidence": confidence, "method": "cnn", "match": matches[i]}
+            metrics.inc("pill_image_lookups_total", method="cnn")
+    for i in ambiguous:
+        if results[i] is None:
+            results[i] = {"drug": None, "confidence": 0.0, "method": "none", "match": matches[i]}
+            metrics.inc("pill_image_lookups_total", method="none")
+    return results
+
+
+def is_compatible(image_drug: str, text_drug: str) -> bool:
+    """True when the identified pill is the drug recommended from the symptoms (names compared loosely)"""
+    if not image_drug or not text_drug:
+        return False
+    image_drug, text_drug = normalize_text(image_drug), normalize_text(text_drug)
+    return image_drug == text_drug or image_drug in text_drug or text_drug in image_drug
+
+
+def identify_and_check(source, symptoms: str, allergies: str = None) -> dict:
+    """
+    Identify one pill image and compare it with the text prediction for
+    `symptoms`; the result's is_compatible feeds update_feedback(input_type="image").
+    """
+    from inference_client import predict_drug
+
+    pill = identify_pills([source])[0]
+    text_drug, text_confidence = predict_drug(symptoms, allergies)
+    return {
+        **pill,
+        "text_drug": text_drug,
+        "text_confidence": text_confidence,
+        "is_compatible": is_compatible(pill["drug"], text_drug),
+    }
@@ -0,0 +1,119 @@
+# prediction_cache.py
+"""
+Bounded LRU + TTL cache for classifier outputs, keyed on normalized symptom text.
+"""
+import os
+import re
+import threading
+import time
+from collections import OrderedDict
+from pathlib import Path
+
+_UNSET = object()
+_PUNCTUATION = re.compile(r"[^\w\s]+")
+_WHITESPACE = re.compile(r"\s+")
+
+
+def normalize_text(text: str) -> str:
+    """Fold case, punctuation and whitespace: 'Headache, FEVER!' -> 'headache fever'"""
+    text = _PUNCTUATION.sub(" ", text.casefold())
+    return _WHITESPACE.sub(" ", text).strip()
+
+
+def files_fingerprint(*paths: Path) -> tuple:
+    """(name, mtime, size) of each file in `paths` (missing ones skipped); changes whenever one is rewritten"""
+    entries = []
+    for path in paths:
+        try:
+            stat = os.stat(path)
+        except FileNotFoundError:
+            continue
+        entries.append((str(path), stat.st_mtime_ns, stat.st_size))
+    return tuple(entries)
+
+
+class PredictionCache:
+    """
+    Thread-safe LRU cache with per-entry TTL.
+
+    `fingerprint_fn` is polled at most every `check_interval` seconds, first on
+    the first lookup; when its value changes (e.g. model files rewritten on
+    disk) the cache is cleared.
+    """
+
+    def __init__(self, maxsize: int = 4096, ttl_seconds: float = 3600.0, fingerprint_fn=None, check_interval: float = 5.0):
+        self.maxsize = maxsize
+        self.ttl = ttl_seconds
+        self.fingerprint_fn = fingerprint_fn
+        self.check_interval = check_interval
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+        self._fingerprint = _UNSET
+        self._next_check = 0.0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+        self.invalidations = 0
+
+    def _check_fingerprint(self, now: float):
+        if self.fingerprint_fn is None or now < self._next_check:
+            return
+        self._next_check = now + self.check_interval
+        fingerprint = self.fingerprint_fn()
+        if self._fingerprint is _UNSET:
+            self._fingerprint = fingerprint
+        elif fingerprint != self._fingerprint:
+            self._fingerprint = fingerprint
+            self._data.clear()
+            self.invalidations += 1
+
+    def get(self, key, default=None):
+        now = time.monotonic()
+        with self._lock:
+            self._check_fingerprint(now)
+            item = self._data.get(key)
+            if item is None:
+                self.misses += 1
+                return default
+            value, expires_at = item
+            if expires_at <= now:
+                del self._data[key]
+                self.expirations += 1
+                self.misses += 1
+                return default
+            self._data.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def put(self, key, value):
+        now = time.monotonic()
+        with self._lock:
+            self._data[key] = (value, now + self.ttl)
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+                self.evictions += 1
+
+    def invalidate(self, key):
+        """Drop one entry (no-op if absent)"""
+        with self._lock:
+            self._data.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+    def stats(self) -> dict:
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "size": len(self._data),
+                "maxsize": self.maxsize,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": self.hits / lookups if lookups else 0.0,
+                "evictions": self.evictions,
+                "expirations": self.expirations,
+                "invalidations": self.invalidations,
+            }
@@ -1,11 +1,91 @@
 # mongodb_utils.py
+import os
+import threading
+
 from pymongo import MongoClient
 
-MONGO_URI = "mongodb-url"  # replace with your URI
-DB_NAME = "drug_recommender_db"
+import metrics
+
+MONGO_URI = os.environ.get("MONGO_URI", "mongodb-url")  # replace with your URI
+DB_NAME = os.environ.get("MONGO_DB_NAME", "drug_recommender_db")
 COLLECTION_NAME = "users"
+ADMINS_COLLECTION_NAME = "admins"
+RECOMMENDATIONS_COLLECTION_NAME = "recommendations"
+
+# Connection pool and timeout settings shared by the whole process
+MONGO_MAX_POOL_SIZE = int(os.environ.get("MONGO_MAX_POOL_SIZE", "50"))
+MONGO_MIN_POOL_SIZE = int(os.environ.get("MONGO_MIN_POOL_SIZE", "0"))
+MONGO_SERVER_SELECTION_TIMEOUT_MS = int(os.environ.get("MONGO_SERVER_SELECTION_TIMEOUT_MS", "5000"))
+MONGO_CONNECT_TIMEOUT_MS = int(os.environ.get("MONGO_CONNECT_TIMEOUT_MS", "5000"))
+MONGO_SOCKET_TIMEOUT_MS = int(os.environ.get("MONGO_SOCKET_TIMEOUT_MS", "20000"))
+MONGO_RETRY_WRITES = os.environ.get("MONGO_RETRY_WRITES", "1") == "1"
+MONGO_RETRY_READS = os.environ.get("MONGO_RETRY_READS", "1") == "1"
+
+_client = None
+_client_lock = threading.Lock()
+
+
+def _create_client(uri: str):
+    # "mongomock://" runs everything in memory for tests and local development
+    if uri.startswith("mongomock://"):
+        import mongomock
+        return mongomock.MongoClient()
+    # Per-command latency histograms and failure counters when metrics are enabled
+    listeners = [metrics.mongo_command_listener()] if metrics.ENABLED else []
+    return MongoClient(
+        uri,
+        event_listeners=listeners,
+        maxPoolSize=MONGO_MAX_POOL_SIZE,
+        minPoolSize=MONGO_MIN_POOL_SIZE,
+        serverSelectionTimeoutMS=MONGO_SERVER_SELECTION_TIMEOUT_MS,
+        connectTimeoutMS=MONGO_CONNECT_TIMEOUT_MS,
+        socketTimeoutMS=MONGO_SOCKET_TIMEOUT_MS,
+        retryWrites=MONGO_RETRY_WRITES,
+        retryReads=MONGO_RETRY_READS,
+    )
+
+
+def get_client():
+    """Process-wide MongoClient, created on first use and reused by every caller"""
+    global _client
+    if _client is None:
+        with _client_lock:
+            if _client is None:
+                _client = _create_client(MONGO_URI)
+    return _client
+
+
+def set_client(client):
+    """Replace the shared client (e.g. with a mongomock client in tests)"""
+    global _client
+    with _client_lock:
+        _client = client
+
+
+def close_client():
+    global _client
+    with _client_lock:
+        if _client is not None:
+            _client.close()
+            _client = None
+
+
+def get_db():
+    return get_client()[DB_NAME]
+
+
+def get_users_collection():
+    return get_db()[COLLECTION_NAME]
+
+
+def get_admins_collection():
+    return get_db()[ADMINS_COLLECTION_NAME]
+
+
+def get_recommendations_collection():
+    return get_db()[RECOMMENDATIONS_COLLECTION_NAME]
+
 
 def get_db_collection():
-    client = MongoClient(MONGO_URI)
-    db = client[DB_NAME]
-    return db[COLLECTION_NAME]
+    """Returns the "users" collection (kept for existing callers)"""
+    return get_users_collection()
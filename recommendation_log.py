@@ -0,0 +1,192 @@
+# recommendation_log.py
+"""
+Buffered recording of every prediction into the `recommendations` collection.
+
+`record_recommendation` only appends to an in-process buffer. A background
+worker flushes the buffer with unordered `insert_many` when it reaches
+RECOMMENDATION_FLUSH_SIZE documents or every RECOMMENDATION_FLUSH_SECONDS,
+and once more at interpreter shutdown.
+
+Every document gets its `_id` before the first attempt and keeps it across
+retries, so re-sending a document the server already stored (a partial bulk
+failure, or a timeout after the write was applied) is a duplicate-key error
+that counts as written rather than a second copy.
+"""
+import atexit
+import logging
+import os
+import threading
+import time
+from datetime import datetime
+
+from bson.objectid import ObjectId
+from pymongo.errors import BulkWriteError
+
+from mongodb_utils import get_recommendations_collection
+
+logger = logging.getLogger("drug_recommender.recommendation_log")
+DUPLICATE_KEY = 11000
+
+RECOMMENDATION_FLUSH_SIZE = int(os.environ.get("RECOMMENDATION_FLUSH_SIZE", "100"))
+RECOMMENDATION_FLUSH_SECONDS = float(os.environ.get("RECOMMENDATION_FLUSH_SECONDS", "2"))
+# Upper bound on buffered documents if MongoDB is unreachable; older ones are dropped beyond it
+RECOMMENDATION_MAX_BUFFER = int(os.environ.get("RECOMMENDATION_MAX_BUFFER", "50000"))
+
+
+class RecommendationRecorder:
+    def __init__(
+        self,
+        collection_fn=get_recommendations_collection,
+        flush_size: int = RECOMMENDATION_FLUSH_SIZE,
+        flush_interval: float = RECOMMENDATION_FLUSH_SECONDS,
+        max_buffer: int = RECOMMENDATION_MAX_BUFFER,
+    ):
+        self.collection_fn = collection_fn
+        self.flush_size = flush_size
+        self.flush_interval = flush_interval
+        self.max_buffer = max_buffer
+        self._buffer = []
+        self._cond = threading.Condition()
+        self._flush_lock = threading.Lock()
+        self._thread = None
+        self._stopping = False
+        self.written = 0
+        self.dropped = 0
+        self.errors = 0
+        atexit.register(self.shutdown)
+
+    def _ensure_started(self):
+        if self._thread is None or not self._thread.is_alive():
+            self._thread = threading.Thread(target=self._run, name="recommendation-recorder", daemon=True)
+            self._thread.start()
+
+    def record(self, document: dict):
+        with self._cond:
+            self._ensure_started()
+            self._buffer.append(document)
+            overflow = len(self._buffer) - self.max_buffer
+            if overflow > 0:
+                del self._buffer[:overflow]
+                self.dropped += overflow
+            if len(self._buffer) >= self.flush_size:
+                self._cond.notify()
+
+    def _take(self) -> list:
+        with self._cond:
+            batch, self._buffer = self._buffer, []
+            return batch
+
+    def _requeue(self, documents: list):
+        """Put documents back in front so they are retried on the next flush"""
+        with self._cond:
+            self._buffer[:0] = documents
+            overflow = len(self._buffer) - self.max_buffer
+            if overflow > 0:
+                del self._buffer[:overflow]
+                self.dropped += overflow
+
+    def flush(self) -> int:
+        """Write everything buffered so far; returns the number of documents written"""
+        with self._flush_lock:
+            batch = self._take()
+            if not batch:
+                return 0
+            for document in batch:
+                document.setdefault("_id", ObjectId())
+            retry, rejected = [], 0
+            try:
+                self.collection_fn().insert_many(batch, ordered=False)
+            except BulkWriteError as e:
+                # Only the listed documents failed; the rest of the batch is stored
+                for error in e.details.get("writeErrors", []):
+                    if error.get("code") != DUPLICATE_KEY:
+                        retry.append(batch[error["index"]])
+                    elif "_id" not in (error.get("keyPattern") or {"_id": 1}):
+                        # Clashes with another unique index: retrying cannot succeed
+                        rejected += 1
+                    # A duplicate _id means an earlier attempt already stored it
+                if retry or rejected:
+                    self.errors += 1
+                    logger.warning(
+                        "Recommendation insert: %d of %d documents failed (%d requeued, %d rejected): %s",
+                        len(retry) + rejected, len(batch), len(retry), rejected,
+                        e.details.get("writeErrors", [{}])[0].get("errmsg"),
+                    )
+            except Exception:
+                # Unknown which documents arrived; their fixed _ids make the retry safe
+                self.errors += 1
+                logger.exception("Recommendation insert of %d documents failed; requeued", len(batch))
+                retry = batch
+            if retry:
+                self._requeue(retry)
+            self.dropped += rejected
+            written = len(batch) - len(retry) - rejected
+            self.written += written
+            return written
+
+    def _run(self):
+        while True:
+            with self._cond:
+                deadline = time.monotonic() + self.flush_interval
+                while not self._stopping and len(self._buffer) < self.flush_size:
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        break
+                    self._cond.wait(remaining)
+                stopping = self._stopping
+            self.flush()
+            if stopping:
+                return
+
+    def shutdown(self, timeout: float = 10.0):
+        """Flush on graceful shutdown"""
+        with self._cond:
+            self._stopping = True
+            self._cond.notify()
+        if self._thread is not None and self._thread.is_alive():
+            self._thread.join(timeout=timeout)
+        self.flush()
+
+
+recorder = RecommendationRecorder()
+
+
+def record_recommendation(
+    user_id,
+    symptoms: str,
+    predicted_drug: str,
+    confidence: float,
+    latency_ms: float,
+    model_version: str,
+    input_type: str = "text",
+):
+    """Queue one prediction for the recommendations collection (never blocks on MongoDB)"""
+    recorder.record({
+        "user_id": user_id,
+        "symptoms": symptoms,
+        "predicted_drug": predicted_drug,
+        "confidence": confidence,
+        "latency_ms": round(latency_ms, 2),
+        "model_version": model_version,
+        "input_type": input_type,
+        "created_at": datetime.now(),
+    })
+
+
+def predict_and_record(user_email, symptoms: str, input_type: str = "text"):
+    """
+    predict_drug (skipping drugs the user is allergic to) plus a buffered
+    recommendation record; returns (drug, confidence). `user_email` is the
+    logged-in user's email, or None for anonymous predictions.
+    """
+    from inference_client import predict_drug, model_version
+    from stats import stats_service
+    from user_store import get_user_allergies
+
+    allergies = get_user_allergies(user_email) if user_email else None
+    start = time.perf_counter()
+    drug, confidence = predict_drug(symptoms, allergies)
+    latency_ms = (time.perf_counter() - start) * 1000
+    record_recommendation(user_email, symptoms, drug, confidence, latency_ms, model_version(), input_type)
+    stats_service.increment("recommendations")
+    return drug, confidence
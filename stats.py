@@ -0,0 +1,71 @@
+# stats.py
+import os
+import threading
+import time
+
+import metrics
+from mongodb_utils import get_users_collection, get_recommendations_collection
+
+# How long dashboard counters are served from memory before MongoDB is asked again
+STATS_TTL_SECONDS = float(os.environ.get("STATS_TTL_SECONDS", "60"))
+
+
+class StatsService:
+    """
+    TTL cache for dashboard counters shared by the Home page and the admin panel.
+
+    Counts come from `estimated_document_count` (collection metadata, no scan).
+    Writers that know they added or removed documents call `increment`, which
+    adjusts the cached value in place, so the dashboard stays current between
+    refreshes without another query.
+    """
+
+    def __init__(self, ttl_seconds: float = STATS_TTL_SECONDS):
+        self.ttl = ttl_seconds
+        self._values = {}
+        self._lock = threading.Lock()
+        self._sources = {
+            "users": lambda: get_users_collection().estimated_document_count(),
+            "recommendations": lambda: get_recommendations_collection().estimated_document_count(),
+        }
+
+    def register(self, name: str, fn):
+        """Add a cached statistic computed by `fn()`"""
+        self._sources[name] = fn
+
+    def get(self, name: str):
+        now = time.monotonic()
+        with self._lock:
+            cached = self._values.get(name)
+            if cached and cached[1] > now:
+                metrics.inc("stats_cache_requests_total", stat=name, result="hit")
+                return cached[0]
+        metrics.inc("stats_cache_requests_total", stat=name, result="miss")
+        value = self._sources[name]()
+        with self._lock:
+            self._values[name] = (value, now + self.ttl)
+        return value
+
+    def increment(self, name: str, amount: int = 1):
+        with self._lock:
+            cached = self._values.get(name)
+            if cached:
+                self._values[name] = (cached[0] + amount, cached[1])
+
+    def invalidate(self, name: str = None):
+        with self._lock:
+            if name is None:
+                self._values.clear()
+            else:
+                self._values.pop(name, None)
+
+
+stats_service = StatsService()
+
+
+def get_user_count():
+    return stats_service.get("users")
+
+
+def get_recommendation_count():
+    return stats_service.get("recommendations")
@@ -0,0 +1,8 @@
+import sys
+from pathlib import Path
+
+# The app imports top-level files and modules/ as flat modules
+ROOT = Path(__file__).resolve().parent.parent
+for path in (ROOT, ROOT / "modules"):
+    if str(path) not in sys.path:
+        sys.path.insert(0, str(path))
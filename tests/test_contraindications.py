@@ -0,0 +1,37 @@
+import pytest
+
+pytest.importorskip("numpy")
+from contraindications import DEFAULT_ALLERGEN_CLASSES, ContraindicationIndex
+
+DRUGS = [
+    "Nystatin", "Atorvastatin", "Magnesium sulfate / potassium sulfate / sodium sulfate",
+    "Sulfamethoxazole / trimethoprim", "Cefdinir", "Apri", "Amoxicillin / clavulanate", "Zoloft",
+]
+
+
+@pytest.fixture(scope="module")
+def index():
+    return ContraindicationIndex(DRUGS, DEFAULT_ALLERGEN_CLASSES)
+
+
+def blocked(index, allergies):
+    mask = index.allowed_mask(allergies)
+    return set() if mask is None else {DRUGS[i] for i, allowed in enumerate(mask) if not allowed}
+
+
+def test_statin_allergy_does_not_mask_nystatin(index):
+    assert blocked(index, "statins") == {"Atorvastatin"}
+
+
+def test_sulfa_allergy_does_not_mask_sulfates(index):
+    assert blocked(index, "Sulfa drugs") == {"Sulfamethoxazole / trimethoprim"}
+
+
+def test_prefix_terms_and_class_names(index):
+    assert blocked(index, "cephalosporins") == {"Cefdinir"}
+    assert blocked(index, "penicillin") == {"Amoxicillin / clavulanate"}
+
+
+def test_drug_names_only_match_whole_words(index):
+    assert blocked(index, "apricots, peanuts") == set()
+    assert blocked(index, "Apri") == {"Apri"}
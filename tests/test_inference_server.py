@@ -0,0 +1,85 @@
+import asyncio
+import json
+
+import pytest
+
+pytest.importorskip("numpy")
+import bert_model
+import inference_server
+
+
+def _request(method, path, payload=None, length=None):
+    body = json.dumps(payload).encode("utf-8") if payload is not None else b""
+    length = len(body) if length is None else length
+    head = f"{method} {path} HTTP/1.1\r\nHost: test\r\nContent-Length: {length}\r\n\r\n".encode("latin-1")
+    return head + body
+
+
+async def _read_response(reader):
+    status_line = await reader.readline()
+    if not status_line:
+        return None, {}, None
+    headers = {}
+    while True:
+        line = await reader.readline()
+        if line in (b"\r\n", b""):
+            break
+        name, _, value = line.decode("latin-1").partition(":")
+        headers[name.strip().lower()] = value.strip()
+    body = await reader.readexactly(int(headers["content-length"]))
+    return int(status_line.split()[1]), headers, json.loads(body)
+
+
+def _exchange(*requests):
+    """Send `requests` back to back on one connection; returns every response until the server closes it"""
+    async def run():
+        server = await asyncio.start_server(inference_server.InferenceServer(4).handle_connection, "127.0.0.1", 0)
+        port = server.sockets[0].getsockname()[1]
+        async with server:
+            reader, writer = await asyncio.open_connection("127.0.0.1", port)
+            writer.write(b"".join(requests))
+            await writer.drain()
+            responses = []
+            for _ in requests:
+                status, headers, body = await asyncio.wait_for(_read_response(reader), timeout=5)
+                if status is None:
+                    break
+                responses.append((status, headers, body))
+            writer.close()
+            return responses
+    return asyncio.run(run())
+
+
+@pytest.fixture(autouse=True)
+def fake_model(monkeypatch):
+    monkeypatch.setattr(bert_model, "predict_drug", lambda text, allergies=None: ("Paracetamol", 91.5))
+
+
+def test_two_requests_on_one_connection():
+    responses = _exchange(
+        _request("POST", "/predict", {"text": "fever"}),
+        _request("POST", "/predict", {"text": "headache"}),
+    )
+    assert [status for status, _, _ in responses] == [200, 200]
+    assert responses[1][2] == {"drug": "Paracetamol", "confidence": 91.5}
+
+
+def test_oversized_body_closes_connection_instead_of_parsing_it():
+    # The second request sits inside the declared body, so it must not be answered
+    responses = _exchange(
+        _request("POST", "/predict", length=inference_server.MAX_BODY_BYTES + 10),
+        _request("POST", "/predict", {"text": "fever"}),
+    )
+    assert len(responses) == 1
+    status, headers, _ = responses[0]
+    assert status == 413
+    assert headers["connection"] == "close"
+
+
+def test_error_after_body_read_keeps_connection_alive():
+    responses = _exchange(
+        _request("POST", "/predict", {"text": ""}),
+        _request("POST", "/predict", {"text": "fever"}),
+    )
+    assert [status for status, _, _ in responses] == [400, 200]
+    assert responses[0][1]["connection"] == "keep-alive"
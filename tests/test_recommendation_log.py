@@ -0,0 +1,65 @@
+import pytest
+
+pytest.importorskip("pymongo")
+from pymongo.errors import AutoReconnect, BulkWriteError
+
+from recommendation_log import RecommendationRecorder
+
+
+class FlakyCollection:
+    """Stores documents by _id like MongoDB; the first insert stores only the first `store_first` and fails"""
+
+    def __init__(self, store_first=None, timeout_after_write=False):
+        self.docs = {}
+        self.calls = 0
+        self.store_first = store_first
+        self.timeout_after_write = timeout_after_write
+
+    def insert_many(self, documents, ordered=True):
+        self.calls += 1
+        errors = []
+        for index, document in enumerate(documents):
+            if self.calls == 1 and self.store_first is not None and index >= self.store_first:
+                errors.append({"index": index, "code": 91, "errmsg": "shutdown in progress"})
+            elif document["_id"] in self.docs:
+                errors.append({"index": index, "code": 11000, "keyPattern": {"_id": 1}, "errmsg": "E11000 duplicate key"})
+            else:
+                self.docs[document["_id"]] = dict(document)
+        if self.calls == 1 and self.timeout_after_write:
+            raise AutoReconnect("timed out after the server applied the write")
+        if errors:
+            raise BulkWriteError({"writeErrors": errors, "nInserted": len(documents) - len(errors)})
+
+
+def recorder_for(collection):
+    return RecommendationRecorder(collection_fn=lambda: collection, flush_size=1000, flush_interval=60)
+
+
+def test_partial_bulk_failure_requeues_only_failed_documents():
+    collection = FlakyCollection(store_first=3)
+    recorder = recorder_for(collection)
+    for i in range(5):
+        recorder.record({"n": i})
+
+    assert recorder.flush() == 3
+    assert recorder.flush() == 2
+    assert recorder.flush() == 0
+    assert sorted(doc["n"] for doc in collection.docs.values()) == [0, 1, 2, 3, 4]
+    assert recorder.written == 5
+    assert recorder.dropped == 0
+
+
+def test_retry_after_applied_write_counts_duplicates_as_written():
+    collection = FlakyCollection(timeout_after_write=True)
+    recorder = recorder_for(collection)
+    for i in range(4):
+        recorder.record({"n": i})
+
+    assert recorder.flush() == 0
+    assert recorder.errors == 1
+    # Same _ids on the retry: duplicates of the stored documents, not new copies
+    assert recorder.flush() == 4
+    assert len(collection.docs) == 4
+    recorder.record({"n": 4})
+    assert recorder.flush() == 1
+    assert len(collection.docs) == 5
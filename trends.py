@@ -0,0 +1,152 @@
+# trends.py
+"""
+Monthly recommendation / user-growth rollups for the Home page chart.
+
+Raw `recommendations` and `users` documents are grouped by month on the
+server ($group on $dateTrunc) and written to the `monthly_rollups`
+collection with $set. Each refresh recomputes only the most recent
+ROLLUP_RECOMPUTE_MONTHS months (the first refresh recomputes everything),
+so the dashboard reads a dozen rollup documents instead of scanning history.
+Recomputing is idempotent: documents that arrive late (buffered flushes,
+imports) are picked up by the next refresh, and workers refreshing at the
+same time write the same counts instead of adding them twice.
+"""
+import os
+import threading
+import time
+from datetime import datetime
+
+from pymongo import UpdateOne
+
+from mongodb_utils import get_db, get_users_collection, get_recommendations_collection
+
+ROLLUP_COLLECTION_NAME = "monthly_rollups"
+ROLLUP_STATE_COLLECTION_NAME = "rollup_state"
+ROLLUP_REFRESH_SECONDS = float(os.environ.get("ROLLUP_REFRESH_SECONDS", "60"))
+# Current month plus the previous one, so late inserts around a month boundary are counted
+ROLLUP_RECOMPUTE_MONTHS = int(os.environ.get("ROLLUP_RECOMPUTE_MONTHS", "2"))
+
+# rollup field -> (collection accessor, timestamp field)
+ROLLUP_SOURCES = {
+    "recommendations": (get_recommendations_collection, "created_at"),
+    "new_users": (get_users_collection, "created_at"),
+}
+
+_last_refresh = 0.0
+_refresh_lock = threading.Lock()
+
+
+def _month_key(month: datetime) -> str:
+    return month.strftime("%Y-%m")
+
+
+def _refresh_source(field: str, collection, ts_field: str, since: datetime = None) -> int:
+    """
+    Recount documents per month from `since` (all of history when None) and
+    $set the counts; returns the number of documents counted.
+    """
+    match = {ts_field: {"$gte": since}} if since else {ts_field: {"$type": "date"}}
+    pipeline = [
+        {"$match": match},
+        {"$group": {
+            "_id": {"$dateTrunc": {"date": f"${ts_field}", "unit": "month"}},
+            "count": {"$sum": 1},
+        }},
+    ]
+    counts = {group["_id"]: group["count"] for group in collection.aggregate(pipeline)}
+    if since:
+        # Months in the window that no longer have documents are reset to 0
+        month = since
+        while month <= datetime.now():
+            counts.setdefault(month, 0)
+            month = datetime(month.year + month.month // 12, month.month % 12 + 1, 1)
+    if not counts:
+        return 0
+
+    get_db()[ROLLUP_COLLECTION_NAME].bulk_write([
+        UpdateOne(
+            {"_id": _month_key(month)},
+            {"$set": {field: count, "month": month}},
+            upsert=True,
+        )
+        for month, count in counts.items()
+    ], ordered=False)
+    return sum(counts.values())
+
+
+_indexed = set()
+
+
+def _ensure_timestamp_index(collection, ts_field: str):
+    """Index the timestamp so recounting recent months reads only those documents"""
+    key = (collection.name, ts_field)
+    if key not in _indexed:
+        collection.create_index(ts_field)
+        _indexed.add(key)
+
+
+def refresh_rollups(force: bool = False, full: bool = False) -> bool:
+    """
+    Recount the recent months; throttled to once per ROLLUP_REFRESH_SECONDS per
+    process. full=True recounts all of history (e.g. after backfilling old data).
+    """
+    global _last_refresh
+    now = time.monotonic()
+    force = force or full
+    if not force and now - _last_refresh < ROLLUP_REFRESH_SECONDS:
+        return False
+    with _refresh_lock:
+        if not force and now - _last_refresh < ROLLUP_REFRESH_SECONDS:
+            return False
+        state = get_db()[ROLLUP_STATE_COLLECTION_NAME]
+        since = _last_months(ROLLUP_RECOMPUTE_MONTHS)[0]
+        for field, (collection_fn, ts_field) in ROLLUP_SOURCES.items():
+            collection = collection_fn()
+            _ensure_timestamp_index(collection, ts_field)
+            if full or state.find_one({"_id": field, "complete": True}) is None:
+                # First refresh (or after a reset): count all of history once
+                _refresh_source(field, collection, ts_field)
+                state.update_one({"_id": field}, {"$set": {"complete": True}}, upsert=True)
+            else:
+                _refresh_source(field, collection, ts_field, since)
+        _last_refresh = time.monotonic()
+    return True
+
+
+def _last_months(count: int, today: datetime = None) -> list:
+    today = today or datetime.now()
+    year, month = today.year, today.month
+    months = []
+    for _ in range(count):
+        months.append(datetime(year, month, 1))
+        year, month = (year - 1, 12) if month == 1 else (year, month - 1)
+    return months[::-1]
+
+
+def get_monthly_trends(months: int = 12) -> list:
+    """
+    [{"month": datetime, "recommendations": n, "new_users": n}, ...] for the
+    last `months` calendar months, oldest first; months without data are 0.
+    """
+    refresh_rollups()
+    wanted = _last_months(months)
+    keys = [_month_key(month) for month in wanted]
+    docs = {doc["_id"]: doc for doc in get_db()[ROLLUP_COLLECTION_NAME].find({"_id": {"$in": keys}})}
+    return [
+        {
+            "month": month,
+            "recommendations": docs.get(key, {}).get("recommendations", 0),
+            "new_users": docs.get(key, {}).get("new_users", 0),
+        }
+        for month, key in zip(wanted, keys)
+    ]
+
+
+def get_accuracy_rate():
+    """Share of rated feedback with rating >= 4, as a percentage (None without feedback)"""
+    from feedback import feedback_totals
+
+    totals = feedback_totals()
+    if not totals["rated"]:
+        return None
+    return round(100.0 * totals["positive"] / totals["rated"], 1)
@@ -0,0 +1,141 @@
+# user_store.py
+import os
+import re
+import threading
+
+from pymongo import ASCENDING, TEXT
+from pymongo.errors import OperationFailure
+
+from prediction_cache import PredictionCache
+
+# Only the fields the admin user list displays
+USER_LIST_PROJECTION = {
+    "full_name": 1,
+    "email": 1,
+    "age": 1,
+    "allergies": 1,
+    "created_at": 1,
+}
+
+# Case-insensitive comparison for exact email lookups (uses the email index)
+EMAIL_COLLATION = {"locale": "en", "strength": 2}
+
+_indexes_ready = set()
+_indexes_lock = threading.Lock()
+
+
+def ensure_user_indexes(users_col):
+    """Create the indexes the admin user list relies on (once per process and collection)"""
+    key = (users_col.database.name, users_col.name)
+    if key in _indexes_ready:
+        return
+    with _indexes_lock:
+        if key in _indexes_ready:
+            return
+        users_col.create_index([("full_name", TEXT), ("email", TEXT)], name="users_text_search")
+        _ensure_unique_email_index(users_col)
+        _indexes_ready.add(key)
+
+
+def _ensure_unique_email_index(users_col):
+    """Case-insensitive unique email index; replaces the older non-unique index of the same name"""
+    spec = [("email", ASCENDING)]
+    options = {"name": "users_email_ci", "collation": EMAIL_COLLATION}
+    try:
+        users_col.create_index(spec, unique=True, **options)
+    except OperationFailure as e:
+        # 85/86: same name or key already indexed with other options
+        if e.code in (85, 86):
+            users_col.drop_index("users_email_ci")
+            _create_email_index(users_col, spec, options)
+        elif e.code == 11000:
+            # Duplicate emails already stored: keep a plain index until they are cleaned up
+            users_col.create_index(spec, **options)
+        else:
+            raise
+
+
+def _create_email_index(users_col, spec, options):
+    """Unique index if the data allows it, otherwise the plain index (never leaves email unindexed)"""
+    try:
+        users_col.create_index(spec, unique=True, **options)
+    except OperationFailure as e:
+        if e.code != 11000:
+            raise
+        users_col.create_index(spec, **options)
+
+
+def build_user_query(search_term: str) -> tuple:
+    """
+    Translate the admin search box into an indexed query.
+    Returns (filter, collation): something that looks like an email address is
+    matched exactly (case-insensitive) on the email index; anything else goes
+    through the text index on full_name and email.
+    """
+    search_term = (search_term or "").strip()
+    if not search_term:
+        return {}, None
+    if re.fullmatch(r"[^@\s]+@[^@\s]+", search_term):
+        return {"email": search_term}, EMAIL_COLLATION
+    return {"$text": {"$search": search_term}}, None
+
+
+def fetch_users_page(users_col, search_term: str = "", page_size: int = 10, after_id=None) -> tuple:
+    """
+    One page of users ordered by _id using keyset pagination.
+
+    Returns (users, next_after_id); next_after_id is None on the last page.
+    Cost depends on the page size, not on how deep into the list the page is.
+    """
+    query, collation = build_user_query(search_term)
+    if after_id is not None:
+        query = {"$and": [query, {"_id": {"$gt": after_id}}]} if query else {"_id": {"$gt": after_id}}
+
+    cursor = users_col.find(query, USER_LIST_PROJECTION).sort("_id", ASCENDING).limit(page_size + 1)
+    if collation:
+        cursor = cursor.collation(collation)
+    users = list(cursor)
+
+    next_after_id = None
+    if len(users) > page_size:
+        users = users[:page_size]
+        next_after_id = users[-1]["_id"]
+    return users, next_after_id
+
+
+# ---- Allergy profiles for contraindication filtering ----
+ALLERGY_PROFILE_TTL_SECONDS = float(os.environ.get("ALLERGY_PROFILE_TTL_SECONDS", "300"))
+ALLERGY_PROFILE_CACHE_SIZE = int(os.environ.get("ALLERGY_PROFILE_CACHE_SIZE", "10000"))
+
+allergy_profiles = PredictionCache(maxsize=ALLERGY_PROFILE_CACHE_SIZE, ttl_seconds=ALLERGY_PROFILE_TTL_SECONDS)
+
+
+class UnknownUserError(LookupError):
+    pass
+
+
+def get_user_allergies(email: str, users_col=None) -> str:
+    """
+    The user's free-text allergies, looked up by email (what the session holds)
+    and cached per user so predictions do not query MongoDB; edits must call
+    invalidate_user_allergies. Raises UnknownUserError when no user has this
+    email, so a bad lookup never silently disables contraindication filtering.
+    """
+    key = email.casefold()
+    allergies = allergy_profiles.get(key)
+    if allergies is None:
+        if users_col is None:
+            from mongodb_utils import get_users_collection
+            users_col = get_users_collection()
+        cursor = users_col.find({"email": email}, {"allergies": 1, "_id": 0}).collation(EMAIL_COLLATION).limit(1)
+        user = next(iter(cursor), None)
+        if user is None:
+            raise UnknownUserError(f"No user with email {email!r}")
+        allergies = user.get("allergies") or ""
+        allergy_profiles.put(key, allergies)
+    return allergies
+
+
+def invalidate_user_allergies(email: str):
+    if email:
+        allergy_profiles.invalidate(email.casefold())
@@ -0,0 +1,264 @@
+# user_transfer.py
+"""
+Bulk user import and export for the admin portal.
+
+    python user_transfer.py import clinic_users.csv
+    python user_transfer.py export users.jsonl
+
+Imports stream CSV or JSONL rows, validate them in chunks and write each
+chunk with one unordered bulk_write of upserts keyed on the unique,
+case-insensitive email index: existing users are updated, new ones inserted.
+Passwords in the file are hashed at full strength in a process pool and only
+set for new users, unless update_passwords=True (--update-passwords).
+Exports iterate a batched, projected cursor and write rows as they arrive.
+Both run in constant memory regardless of the number of users.
+"""
+import argparse
+import csv
+import io
+import json
+import os
+import re
+import sys
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime
+from pathlib import Path
+
+from pymongo import UpdateOne
+from pymongo.errors import BulkWriteError
+
+import auth_service
+from mongodb_utils import get_users_collection
+from user_store import EMAIL_COLLATION, allergy_profiles, ensure_user_indexes
+
+IMPORT_CHUNK_SIZE = int(os.environ.get("USER_IMPORT_CHUNK_SIZE", "1000"))
+EXPORT_BATCH_SIZE = int(os.environ.get("USER_EXPORT_BATCH_SIZE", "1000"))
+# Imported passwords are hashed at full strength, spread over this many processes
+IMPORT_HASH_WORKERS = int(os.environ.get("USER_IMPORT_HASH_WORKERS", str(os.cpu_count() or 1)))
+MAX_REPORTED_ERRORS = 50
+
+EXPORT_FIELDS = ["full_name", "email", "age", "allergies", "created_at", "is_active"]
+EXPORT_PROJECTION = {"_id": 0, **{field: 1 for field in EXPORT_FIELDS}}
+
+_EMAIL = re.compile(r"[^@\s]+@[^@\s]+\.[^@\s]+")
+
+
+# ---- Import ----
+def _text_stream(source):
+    """Text stream over a path, a text file or a binary file (e.g. a Streamlit upload)"""
+    if isinstance(source, (str, Path)):
+        return open(source, "r", encoding="utf-8-sig", newline="")
+    if isinstance(source, io.TextIOBase):
+        return source
+    return io.TextIOWrapper(source, encoding="utf-8-sig", newline="")
+
+
+def iter_rows(stream, fmt: str):
+    """Yield (line_number, row dict) from a CSV or JSONL text stream; malformed JSON lines yield None"""
+    if fmt == "csv":
+        reader = csv.DictReader(stream)
+        for row in reader:
+            yield reader.line_num, row
+    elif fmt == "jsonl":
+        for line_number, line in enumerate(stream, start=1):
+            if not line.strip():
+                continue
+            try:
+                row = json.loads(line)
+            except ValueError:
+                row = None
+            yield line_number, row
+    else:
+        raise ValueError(f"Unsupported import format: {fmt} (use csv or jsonl)")
+
+
+def validate_row(row: dict) -> tuple:
+    """(fields, None) for a valid row, (None, message) otherwise"""
+    if not isinstance(row, dict):
+        return None, "malformed row (expected a JSON object)"
+    full_name = str(row.get("full_name") or "").strip()
+    email = str(row.get("email") or "").strip()
+    if not full_name:
+        return None, "missing full_name"
+    if not _EMAIL.fullmatch(email):
+        return None, f"invalid email {email!r}"
+    fields = {"full_name": full_name, "email": email}
+
+    age = row.get("age")
+    if age not in (None, ""):
+        try:
+            age = int(age)
+        except (TypeError, ValueError):
+            return None, f"invalid age {age!r}"
+        if not 1 <= age <= 120:
+            return None, f"age out of range: {age}"
+        fields["age"] = age
+    if row.get("allergies") not in (None, ""):
+        fields["allergies"] = str(row["allergies"]).strip()
+    if row.get("password"):
+        # Plaintext until the chunk is written; hashed in the pool by _hash_passwords
+        fields["password"] = str(row["password"])
+    return fields, None
+
+
+def _hash_passwords(rows: list, pool):
+    """Replace plaintext passwords in `rows` with PBKDF2 hashes, in parallel when a pool is given"""
+    pending = [fields for _, fields in rows if "password" in fields]
+    if not pending:
+        return
+    passwords = [fields["password"] for fields in pending]
+    hashes = pool.map(auth_service.hash_password, passwords, chunksize=16) if pool else map(auth_service.hash_password, passwords)
+    for fields, hashed in zip(pending, hashes):
+        fields["password"] = hashed
+
+
+def _write_chunk(users_col, chunk: list, result: dict, pool=None, update_passwords: bool = False):
+    # Last row wins when one chunk repeats an email; earlier rows are reported as skipped
+    by_email = {}
+    for line_number, fields in chunk:
+        key = fields["email"].casefold()
+        if key in by_email:
+            result["skipped"] += 1
+            _report(result, by_email[key][0], f"duplicate email {fields['email']!r}, superseded by line {line_number}")
+        by_email[key] = (line_number, fields)
+    rows = list(by_email.values())
+    _hash_passwords(rows, pool)
+
+    operations = []
+    for _, fields in rows:
+        fields = dict(fields)
+        on_insert = {"created_at": datetime.now(), "is_active": True}
+        if not update_passwords and "password" in fields:
+            # Existing users keep their password unless the import opts in
+            on_insert["password"] = fields.pop("password")
+        operations.append(UpdateOne(
+            {"email": fields["email"]},
+            {"$set": fields, "$setOnInsert": on_insert},
+            upsert=True,
+            collation=EMAIL_COLLATION,
+        ))
+    failed = set()
+    try:
+        outcome = users_col.bulk_write(operations, ordered=False).bulk_api_result
+    except BulkWriteError as e:
+        outcome = e.details
+        for error in outcome.get("writeErrors", []):
+            failed.add(error["index"])
+            _record_error(result, rows[error["index"]][0], error.get("errmsg", "write failed"))
+    result["inserted"] += outcome.get("nUpserted", 0)
+    result["updated"] += outcome.get("nMatched", 0)
+
+    inserted = {item["index"] for item in outcome.get("upserted", [])}
+    for index, (line_number, fields) in enumerate(rows):
+        if "password" not in fields or index in inserted or index in failed:
+            continue
+        if update_passwords:
+            result["passwords_replaced"] += 1
+        else:
+            result["passwords_ignored"] += 1
+            _report(result, line_number, f"existing user {fields['email']!r}: password in file ignored")
+
+
+def _report(result: dict, line_number, message: str):
+    if len(result["errors"]) < MAX_REPORTED_ERRORS:
+        result["errors"].append({"line": line_number, "error": message})
+
+
+def _record_error(result: dict, line_number, message: str):
+    result["failed"] += 1
+    _report(result, line_number, message)
+
+
+def import_users(source, fmt: str, users_col=None, chunk_size: int = IMPORT_CHUNK_SIZE,
+                 update_passwords: bool = False) -> dict:
+    """
+    Upsert users from a CSV/JSONL source (path or file object). Columns:
+    full_name, email (required), age, allergies, password. Every row ends up
+    inserted, updated, failed or skipped (an earlier duplicate of a later
+    row); passwords of existing users are only replaced with
+    update_passwords=True. Returns counts and the first MAX_REPORTED_ERRORS
+    row messages.
+    """
+    users_col = users_col if users_col is not None else get_users_collection()
+    ensure_user_indexes(users_col)
+    result = {
+        "rows": 0, "inserted": 0, "updated": 0, "failed": 0, "skipped": 0,
+        "passwords_replaced": 0, "passwords_ignored": 0, "errors": [],
+    }
+    stream = _text_stream(source)
+    pool = ProcessPoolExecutor(max_workers=IMPORT_HASH_WORKERS) if IMPORT_HASH_WORKERS > 1 else None
+    try:
+        chunk = []
+        for line_number, row in iter_rows(stream, fmt):
+            result["rows"] += 1
+            fields, error = validate_row(row)
+            if error:
+                _record_error(result, line_number, error)
+                continue
+            chunk.append((line_number, fields))
+            if len(chunk) >= chunk_size:
+                _write_chunk(users_col, chunk, result, pool, update_passwords)
+                chunk = []
+        if chunk:
+            _write_chunk(users_col, chunk, result, pool, update_passwords)
+    finally:
+        if pool is not None:
+            pool.shutdown()
+        if isinstance(source, (str, Path)):
+            stream.close()
+        elif isinstance(stream, io.TextIOWrapper) and stream is not source:
+            # Leave the caller's binary file open
+            stream.detach()
+    # Imported rows may have changed cached profiles and allergy lists
+    auth_service.profile_cache.clear()
+    allergy_profiles.clear()
+    return result
+
+
+# ---- Export ----
+def _export_value(value):
+    return value.isoformat() if isinstance(value, datetime) else value
+
+
+def export_users(out, fmt: str, users_col=None, query: dict = None, batch_size: int = EXPORT_BATCH_SIZE) -> int:
+    """Write users (without passwords) to a text stream as CSV or JSONL; returns the number written"""
+    if fmt not in ("csv", "jsonl"):
+        raise ValueError(f"Unsupported export format: {fmt} (use csv or jsonl)")
+    users_col = users_col if users_col is not None else get_users_collection()
+    cursor = users_col.find(query or {}, EXPORT_PROJECTION, batch_size=batch_size)
+    writer = None
+    if fmt == "csv":
+        writer = csv.DictWriter(out, fieldnames=EXPORT_FIELDS, extrasaction="ignore")
+        writer.writeheader()
+    count = 0
+    for user in cursor:
+        row = {field: _export_value(user.get(field)) for field in EXPORT_FIELDS}
+        if writer is not None:
+            writer.writerow(row)
+        else:
+            out.write(json.dumps(row, ensure_ascii=False, default=str) + "\n")
+        count += 1
+    return count
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Bulk import or export users")
+    parser.add_argument("command", choices=["import", "export"])
+    parser.add_argument("path", type=Path)
+    parser.add_argument("--format", choices=["csv", "jsonl"], help="defaults to the file extension")
+    parser.add_argument("--update-passwords", action="store_true", help="replace passwords of existing users")
+    args = parser.parse_args(argv)
+    fmt = args.format or args.path.suffix.lstrip(".").lower()
+
+    if args.command == "import":
+        result = import_users(args.path, fmt, update_passwords=args.update_passwords)
+        print(json.dumps(result, indent=2, default=str))
+        return 1 if result["failed"] else 0
+    with open(args.path, "w", encoding="utf-8", newline="") as out:
+        count = export_users(out, fmt)
+    print(f"Exported {count} users to {args.path}", file=sys.stderr)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())